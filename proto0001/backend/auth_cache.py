@@ -0,0 +1,114 @@
+# -------------------------------------------------
+# ・ファイル名：auth_cache.py
+# ・ファイル内容：検証済み JWT とユーザー情報のキャッシュ
+# ・作成日時：2026/10/19 03:00:00  agent
+# -------------------------------------------------
+
+import hashlib
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from response_cache import ResponseCache
+
+# 認証キャッシュ設定
+AUTH_TOKEN_CACHE_ENABLED = os.getenv("AUTH_TOKEN_CACHE_ENABLED", "true").lower() == "true"
+AUTH_TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_TOKEN_CACHE_MAX_ENTRIES", "10000"))
+AUTH_USER_CACHE_ENABLED = os.getenv("AUTH_USER_CACHE_ENABLED", "false").lower() == "true"
+AUTH_USER_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_USER_CACHE_MAX_ENTRIES", "10000"))
+AUTH_USER_CACHE_TTL_SECONDS = float(os.getenv("AUTH_USER_CACHE_TTL_SECONDS", "300"))
+
+def token_cache_key(token: str) -> str:
+    """トークン本体は保持せず、ハッシュをキーにする"""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+class AuthCache:
+    """検証済みトークン（有効期限は exp に合わせる）とユーザー情報のキャッシュ
+
+    トークンは署名検証に成功したものだけを保持し、exp を過ぎたら再検証させる。
+    """
+
+    def __init__(
+        self,
+        token_enabled: bool = AUTH_TOKEN_CACHE_ENABLED,
+        token_max_entries: int = AUTH_TOKEN_CACHE_MAX_ENTRIES,
+        user_enabled: bool = AUTH_USER_CACHE_ENABLED,
+        user_max_entries: int = AUTH_USER_CACHE_MAX_ENTRIES,
+        user_ttl: float = AUTH_USER_CACHE_TTL_SECONDS,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.tokens = ResponseCache(max_entries=token_max_entries) if token_enabled else None
+        self.users = ResponseCache(max_entries=user_max_entries, ttl=user_ttl) if user_enabled else None
+        self._clock = clock
+
+        # 統計情報（認証処理にかかった時間）
+        self._verify_count = {"hit": 0, "miss": 0}
+        self._verify_seconds = {"hit": 0.0, "miss": 0.0}
+
+    def _observe(self, outcome: str, started: float):
+        self._verify_count[outcome] += 1
+        self._verify_seconds[outcome] += time.perf_counter() - started
+
+    def verify(self, token: str, decode: Callable[[str], Dict[str, Any]]) -> Optional[str]:
+        """トークンのユーザー名を返す（キャッシュに無ければ decode で検証する）
+
+        decode の例外（署名不正・期限切れなど）はそのまま呼び出し元へ送る。
+        """
+        started = time.perf_counter()
+        key = token_cache_key(token) if self.tokens is not None else None
+        if key is not None:
+            username = self.tokens.get(key)
+            if username is not None:
+                self._observe("hit", started)
+                return username
+
+        try:
+            payload = decode(token)
+        finally:
+            self._observe("miss", started)
+        username = payload.get("sub")
+        exp = payload.get("exp")
+        if key is not None and username is not None and exp is not None:
+            ttl = float(exp) - self._clock()
+            if ttl > 0:
+                self.tokens.set(key, username, ttl)
+        return username
+
+    async def get_user(self, username: str, load: Callable[[], Awaitable[Optional[Dict[str, Any]]]]):
+        """ユーザー情報を返す（キャッシュが無効・未登録なら load で取得）"""
+        if self.users is None:
+            return await load()
+        user = self.users.get(username)
+        if user is None:
+            user = await load()
+            if user is not None:
+                self.users.set(username, user)
+        return user
+
+    def stats(self) -> Dict[str, Any]:
+        """キャッシュのヒット率と、1 リクエストあたりの認証処理時間"""
+        count = sum(self._verify_count.values())
+        seconds = sum(self._verify_seconds.values())
+
+        def avg_us(outcome: str):
+            n = self._verify_count[outcome]
+            return round(self._verify_seconds[outcome] / n * 1e6, 2) if n else None
+
+        return {
+            "tokens": self.tokens.stats() if self.tokens else None,
+            "users": self.users.stats() if self.users else None,
+            "verify_count": count,
+            "verify_avg_us": round(seconds / count * 1e6, 2) if count else None,
+            "verify_hit_avg_us": avg_us("hit"),
+            "verify_miss_avg_us": avg_us("miss"),
+        }
+
+# グローバルインスタンス
+_auth_cache: Optional[AuthCache] = None
+
+def get_auth_cache() -> AuthCache:
+    """認証キャッシュのシングルトンインスタンスを取得"""
+    global _auth_cache
+    if _auth_cache is None:
+        _auth_cache = AuthCache()
+    return _auth_cache
@@ -3,15 +3,82 @@
 # ・ファイル内容：Azure OpenAI APIクライアント
 # ・作成日時：2025/07/07 11:57:00  Claude Code
 # -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/18 12:00:00  更新者：agent
+# ・更新内容：非同期クライアントと共有 HTTP コネクションプールへ移行
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/18 17:00:00  更新者：agent
+# ・更新内容：完全一致の応答キャッシュを追加
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/18 18:00:00  更新者：agent
+# ・更新内容：同一リクエストの同時呼び出しを 1 回にまとめる
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/18 19:00:00  更新者：agent
+# ・更新内容：トークン予算に合わせて会話履歴をトリミング
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/18 20:00:00  更新者：agent
+# ・更新内容：RPM/TPM クォータに合わせたクライアント側レート制限を追加
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/18 21:00:00  更新者：agent
+# ・更新内容：リトライ・タイムアウト・サーキットブレーカーを追加
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/18 22:00:00  更新者：agent
+# ・更新内容：複数デプロイメントへの負荷分散を追加
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/18 23:00:00  更新者：agent
+# ・更新内容：ストリームが途中で閉じられたら上流も閉じる
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/19 05:00:00  更新者：agent
+# ・更新内容：呼び出し時間・最初のトークンまでの時間・受信速度・トークン使用量をメトリクスに記録
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/19 06:00:00  更新者：agent
+# ・更新内容：Azure OpenAI の呼び出し毎にトレースの子スパンを作成
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/19 07:00:00  更新者：agent
+# ・更新内容：言い換えの質問に過去の応答を返す意味的キャッシュを追加
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/19 15:00:00  更新者：agent
+# ・更新内容：max_tokens に上限を設け、キャッシュ用に組み立てる応答のサイズを制限
+# -------------------------------------------------
 
 import os
 import asyncio
+import time
+import importlib.util
 from typing import List, Dict, Any, Optional
+import httpx
 from openai import AzureOpenAI
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 import json
 from datetime import datetime
 from dotenv import load_dotenv
+from response_cache import (
+    LLM_CACHE_MAX_RESPONSE_BYTES, ResponseCache, get_response_cache, request_cache_key, replay_stream,
+)
+from request_coalescer import RequestCoalescer, get_request_coalescer
+from semantic_cache import SemanticCache, SemanticQuery, get_semantic_cache
+from context_window import ContextWindowManager, prompt_tokens
+from rate_limiter import RateLimiter, RateLimitExceeded
+from resilience import (
+    AZURE_OPENAI_FIRST_TOKEN_TIMEOUT, AZURE_OPENAI_TOTAL_TIMEOUT,
+    CircuitBreaker, CircuitOpenError, RetryPolicy, UpstreamTimeout, call_with_retries,
+)
+from deployment_pool import (
+    AZURE_OPENAI_DEPLOYMENTS, Deployment, DeploymentConfig, DeploymentPool, load_deployment_configs,
+)
+from metrics import count_llm_tokens, observe_llm_first_token, observe_llm_request, observe_llm_stream_rate
+from tracing import get_tracer
 
 # 環境変数を読み込み
 load_dotenv()
@@ -22,6 +89,16 @@ AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY", "")
 AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2023-12-01-preview")
 AZURE_OPENAI_MODEL_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-35-turbo")
 
+# HTTP コネクションプール設定
+AZURE_OPENAI_MAX_CONNECTIONS = int(os.getenv("AZURE_OPENAI_MAX_CONNECTIONS", "200"))
+AZURE_OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("AZURE_OPENAI_MAX_KEEPALIVE_CONNECTIONS", "50"))
+AZURE_OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("AZURE_OPENAI_KEEPALIVE_EXPIRY", "30"))
+AZURE_OPENAI_CONNECT_TIMEOUT = float(os.getenv("AZURE_OPENAI_CONNECT_TIMEOUT", "5"))
+AZURE_OPENAI_TIMEOUT = float(os.getenv("AZURE_OPENAI_TIMEOUT", "60"))
+AZURE_OPENAI_HTTP2 = os.getenv("AZURE_OPENAI_HTTP2", "true").lower() == "true"
+# リクエストで指定できる max_tokens の上限（応答の長さ＝ストリーム毎のメモリ使用量の上限になる）
+AZURE_OPENAI_MAX_TOKENS_LIMIT = int(os.getenv("AZURE_OPENAI_MAX_TOKENS_LIMIT", "4096"))
+
 class ChatMessage(BaseModel):
     role: str
     content: str
@@ -29,7 +106,7 @@ class ChatMessage(BaseModel):
 
 class ChatRequest(BaseModel):
     messages: List[ChatMessage]
-    max_tokens: Optional[int] = 1000
+    max_tokens: Optional[int] = Field(1000, ge=1, le=AZURE_OPENAI_MAX_TOKENS_LIMIT)
     temperature: Optional[float] = 0.7
     system_prompt: Optional[str] = None
 
@@ -38,21 +115,259 @@ class ChatResponse(BaseModel):
     usage: Optional[Dict[str, Any]] = None
     timestamp: str
 
+# 共有 HTTP クライアント
+_shared_http_client: Optional[httpx.AsyncClient] = None
+
+def http2_available() -> bool:
+    """HTTP/2 が利用可能か（h2 パッケージの有無）"""
+    return importlib.util.find_spec("h2") is not None
+
+def get_shared_http_client() -> httpx.AsyncClient:
+    """キープアライブ付きの共有 HTTP クライアントを取得"""
+    global _shared_http_client
+    if _shared_http_client is None or _shared_http_client.is_closed:
+        _shared_http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=AZURE_OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=AZURE_OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=AZURE_OPENAI_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(AZURE_OPENAI_TIMEOUT, connect=AZURE_OPENAI_CONNECT_TIMEOUT),
+            http2=AZURE_OPENAI_HTTP2 and http2_available(),
+        )
+    return _shared_http_client
+
+async def close_shared_http_client():
+    """共有 HTTP クライアントをクローズ"""
+    global _shared_http_client
+    if _shared_http_client is not None:
+        await _shared_http_client.aclose()
+        _shared_http_client = None
+
 class AzureOpenAIClient:
-    def __init__(self):
-        """Azure OpenAI クライアントの初期化"""
-        if not AZURE_OPENAI_ENDPOINT or not AZURE_OPENAI_API_KEY:
-            raise ValueError("Azure OpenAI の設定が不完全です。環境変数を確認してください。")
-        
-        self.client = AzureOpenAI(
-            azure_endpoint=AZURE_OPENAI_ENDPOINT,
-            api_key=AZURE_OPENAI_API_KEY,
-            api_version=AZURE_OPENAI_API_VERSION
+    def __init__(
+        self,
+        endpoint: Optional[str] = None,
+        api_key: Optional[str] = None,
+        api_version: Optional[str] = None,
+        model_name: Optional[str] = None,
+        http_client: Optional[httpx.AsyncClient] = None,
+        cache: Optional[ResponseCache] = None,
+        coalescer: Optional[RequestCoalescer] = None,
+        semantic_cache: Optional[SemanticCache] = None,
+        context_window: Optional[ContextWindowManager] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        first_token_timeout: float = AZURE_OPENAI_FIRST_TOKEN_TIMEOUT,
+        total_timeout: float = AZURE_OPENAI_TOTAL_TIMEOUT,
+        pool: Optional[DeploymentPool] = None,
+    ):
+        """Azure OpenAI クライアントの初期化
+
+        AZURE_OPENAI_DEPLOYMENTS が設定されていれば、その全デプロイメントに振り分ける。
+        """
+        http_client = http_client or get_shared_http_client()
+        if pool is None and AZURE_OPENAI_DEPLOYMENTS and not endpoint:
+            pool = DeploymentPool([
+                Deployment(config, http_client)
+                for config in load_deployment_configs(AZURE_OPENAI_DEPLOYMENTS, AZURE_OPENAI_API_VERSION)
+            ])
+        if pool is None:
+            config = DeploymentConfig(
+                name=model_name or AZURE_OPENAI_MODEL_NAME,
+                endpoint=endpoint or AZURE_OPENAI_ENDPOINT,
+                api_key=api_key or AZURE_OPENAI_API_KEY,
+                deployment=model_name or AZURE_OPENAI_MODEL_NAME,
+                api_version=api_version or AZURE_OPENAI_API_VERSION,
+            )
+            if not config.endpoint or not config.api_key:
+                raise ValueError("Azure OpenAI の設定が不完全です。環境変数を確認してください。")
+            pool = DeploymentPool([Deployment(config, http_client, rate_limiter, circuit_breaker)])
+        self.pool = pool
+
+        # 接続検証は先頭のデプロイメントで行う
+        primary = pool.deployments[0].config
+        self.endpoint = primary.endpoint
+        self.api_key = primary.api_key
+        self.api_version = primary.api_version
+        self.model_name = model_name or AZURE_OPENAI_MODEL_NAME
+        self.cache = cache if cache is not None else get_response_cache()
+        self.coalescer = coalescer if coalescer is not None else get_request_coalescer()
+        self.semantic_cache = semantic_cache if semantic_cache is not None else get_semantic_cache()
+        self.context_window = context_window or ContextWindowManager()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.first_token_timeout = first_token_timeout
+        self.total_timeout = total_timeout
+
+    def _fit_context(self, chat_request: ChatRequest):
+        """トークン予算を超える古い会話を削除したリクエストを返す"""
+        result = self.context_window.trim(
+            chat_request.messages, chat_request.system_prompt, chat_request.max_tokens
         )
-        self.model_name = AZURE_OPENAI_MODEL_NAME
+        if not result.dropped_messages:
+            return chat_request, result
+        messages = list(result.messages)
+        if result.summary:
+            messages.insert(0, ChatMessage(role="system", content=result.summary))
+        return chat_request.model_copy(update={"messages": messages}), result
+
+    def _cache_key(self, chat_request: ChatRequest) -> Optional[str]:
+        """キャッシュ対象ならキーを返す"""
+        if self.cache is None or not self.cache.is_cacheable(chat_request):
+            return None
+        return request_cache_key(chat_request, self.model_name)
+
+    async def _semantic_query(self, chat_request: ChatRequest) -> Optional[SemanticQuery]:
+        """意味的キャッシュの対象なら、質問を埋め込んだクエリを返す"""
+        if self.semantic_cache is None:
+            return None
+        return await self.semantic_cache.query_for(chat_request, self.model_name)
 
     async def chat_completion(self, chat_request: ChatRequest) -> ChatResponse:
-        """チャット完了APIの実行"""
+        """チャット完了APIの実行（キャッシュ有効時はヒットすれば API を呼ばない）"""
+        chat_request, trim = self._fit_context(chat_request)
+        cache_key = self._cache_key(chat_request)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return ChatResponse(
+                    message=cached.message,
+                    usage={**(cached.usage or {}), **trim.usage_info(), "cached": True},
+                    timestamp=datetime.now().isoformat()
+                )
+
+        semantic_query = await self._semantic_query(chat_request)
+        if semantic_query:
+            hit = self.semantic_cache.search(semantic_query)
+            if hit is not None:
+                return ChatResponse(
+                    message=hit.message,
+                    usage={**trim.usage_info(), "cached": True, "semantic_similarity": round(hit.similarity, 4)},
+                    timestamp=datetime.now().isoformat()
+                )
+
+        response = await self._coalesced_completion(chat_request)
+        if cache_key:
+            self.cache.set(cache_key, response)
+        if semantic_query:
+            self.semantic_cache.add(semantic_query, response.message)
+        return ChatResponse(
+            message=response.message,
+            usage={**(response.usage or {}), **trim.usage_info()},
+            timestamp=response.timestamp
+        )
+
+    async def chat_completion_stream(self, chat_request: ChatRequest):
+        """ストリーミングチャット完了APIの実行（キャッシュヒット時は疑似ストリーム）"""
+        chat_request, _ = self._fit_context(chat_request)
+        cache_key = self._cache_key(chat_request)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                async for piece in replay_stream(cached.message):
+                    yield piece
+                return
+
+        semantic_query = await self._semantic_query(chat_request)
+        if semantic_query:
+            hit = self.semantic_cache.search(semantic_query)
+            if hit is not None:
+                async for piece in replay_stream(hit.message):
+                    yield piece
+                return
+
+        # キャッシュ用に組み立てる応答（上限を超えたらキャッシュを諦めて捨てる）
+        pieces = []
+        pieces_bytes = 0
+        cacheable = bool(cache_key or semantic_query)
+        stream = self._coalesced_stream(chat_request)
+        try:
+            async for piece in stream:
+                if cacheable:
+                    pieces_bytes += len(piece.encode("utf-8"))
+                    if pieces_bytes > LLM_CACHE_MAX_RESPONSE_BYTES:
+                        cacheable = False
+                        pieces = []
+                    else:
+                        pieces.append(piece)
+                yield piece
+        finally:
+            # 途中で閉じられた場合も、上流のストリームをすぐに閉じる
+            await stream.aclose()
+
+        if not cacheable:
+            return
+        # 最後まで受信できた応答だけをキャッシュする
+        if cache_key:
+            self.cache.set(cache_key, ChatResponse(
+                message="".join(pieces),
+                usage=None,
+                timestamp=datetime.now().isoformat()
+            ))
+        if semantic_query:
+            self.semantic_cache.add(semantic_query, "".join(pieces))
+
+    async def _coalesced_completion(self, chat_request: ChatRequest) -> ChatResponse:
+        """同じリクエストが実行中ならその結果を共有する"""
+        if self.coalescer is None:
+            return await self._chat_completion(chat_request)
+        key = request_cache_key(chat_request, self.model_name)
+        return await self.coalescer.run(key, lambda: self._chat_completion(chat_request))
+
+    def _coalesced_stream(self, chat_request: ChatRequest):
+        """同じリクエストが配信中ならそのストリームに相乗りする"""
+        if self.coalescer is None:
+            return self._chat_completion_stream(chat_request)
+        key = request_cache_key(chat_request, self.model_name)
+        return self.coalescer.stream(key, lambda: self._chat_completion_stream(chat_request))
+
+    def _estimate_tokens(self, chat_request: ChatRequest) -> int:
+        """送信枠の確保に使う見積もりトークン数（プロンプト＋最大応答長）"""
+        return prompt_tokens(chat_request.messages, chat_request.system_prompt) + (chat_request.max_tokens or 0)
+
+    async def _dispatch(self, operation, estimated: int, hold: bool = False):
+        """振り分け先を選んで operation(deployment, estimated) を実行し、(deployment, 結果) を返す
+
+        選んだデプロイメントに送信枠が無い・ブレーカーが開いている場合は、
+        待たずに他のデプロイメントへ切り替える。最後の候補でだけ送信枠を待つ。
+        """
+        tried = set()
+        while True:
+            deployment = self.pool.select(exclude=tried)
+            tried.add(deployment.name)
+            has_fallback = bool(self.pool.candidates(exclude=tried))
+            try:
+                result = await deployment.call(
+                    operation, estimated, max_wait=0 if has_fallback else None, hold=hold
+                )
+                return deployment, result
+            except (RateLimitExceeded, CircuitOpenError):
+                if has_fallback:
+                    continue
+                raise
+
+    @staticmethod
+    def _outcome(e: BaseException) -> str:
+        """メトリクスの outcome ラベル"""
+        if isinstance(e, RateLimitExceeded):
+            return "rate_limited"
+        if isinstance(e, CircuitOpenError):
+            return "circuit_open"
+        if isinstance(e, (asyncio.CancelledError, GeneratorExit)):
+            return "cancelled"
+        return "error"
+
+    def _upstream_timeout(self, seconds: float) -> httpx.Timeout:
+        """1 回の HTTP 呼び出しに渡すタイムアウト（接続は短く、読み取りは残り時間まで）"""
+        return httpx.Timeout(max(seconds, 0.001), connect=min(AZURE_OPENAI_CONNECT_TIMEOUT, max(seconds, 0.001)))
+
+    async def _chat_completion(self, chat_request: ChatRequest) -> ChatResponse:
+        """Azure OpenAI のチャット完了APIを呼び出す"""
+        with get_tracer().span("azure_openai.chat_completion", {"llm.stream": False}) as span:
+            return await self._traced_chat_completion(chat_request, span)
+
+    async def _traced_chat_completion(self, chat_request: ChatRequest, span) -> ChatResponse:
         try:
             # システムプロンプトの設定
             messages = []
@@ -66,14 +381,33 @@ class AzureOpenAIClient:
                     "content": msg.content
                 })
 
-            # Azure OpenAI APIの呼び出し
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=messages,
-                max_tokens=chat_request.max_tokens,
-                temperature=chat_request.temperature,
-                stream=False
-            )
+            # Azure OpenAI APIの呼び出し（残りクォータを知るためヘッダーも受け取る）
+            async def request(deployment: Deployment, estimated: int):
+                try:
+                    async with asyncio.timeout(self.total_timeout):
+                        return await deployment.client.chat.completions.with_raw_response.create(
+                            model=deployment.config.deployment,
+                            messages=messages,
+                            max_tokens=chat_request.max_tokens,
+                            temperature=chat_request.temperature,
+                            stream=False,
+                            timeout=self._upstream_timeout(self.total_timeout),
+                        )
+                except TimeoutError:
+                    raise UpstreamTimeout(f"応答が{self.total_timeout}秒以内に完了しませんでした")
+
+            estimated = self._estimate_tokens(chat_request)
+            started = time.perf_counter()
+            try:
+                deployment, raw = await call_with_retries(
+                    lambda: self._dispatch(request, estimated), self.retry_policy
+                )
+            except BaseException as e:
+                observe_llm_request("unknown", False, self._outcome(e), time.perf_counter() - started)
+                raise
+            observe_llm_request(deployment.name, False, "ok", time.perf_counter() - started)
+            span.set_attribute("llm.deployment", deployment.name)
+            response = raw.parse()
 
             # レスポンスの処理
             assistant_message = response.choices[0].message.content
@@ -82,6 +416,14 @@ class AzureOpenAIClient:
                 "completion_tokens": response.usage.completion_tokens,
                 "total_tokens": response.usage.total_tokens
             } if response.usage else None
+            if deployment.rate_limiter is not None:
+                deployment.rate_limiter.record_usage(estimated, usage_info["total_tokens"] if usage_info else None)
+                # 実績での補正より、サーバーが返した残りクォータを優先する
+                deployment.rate_limiter.update_from_headers(raw.headers)
+            count_llm_tokens(deployment.name, usage_info)
+            if usage_info:
+                span.set_attribute("llm.prompt_tokens", usage_info["prompt_tokens"])
+                span.set_attribute("llm.completion_tokens", usage_info["completion_tokens"])
 
             return ChatResponse(
                 message=assistant_message,
@@ -89,11 +431,53 @@ class AzureOpenAIClient:
                 timestamp=datetime.now().isoformat()
             )
 
+        except (RateLimitExceeded, CircuitOpenError):
+            raise
         except Exception as e:
             raise Exception(f"Azure OpenAI APIの呼び出しでエラーが発生しました: {str(e)}")
 
-    async def chat_completion_stream(self, chat_request: ChatRequest):
-        """ストリーミングチャット完了APIの実行"""
+    async def _open_stream(self, deployment: Deployment, chat_request: ChatRequest, messages: list):
+        """ストリームを開き、最初のトークンまで受信する（リトライ 1 回分）"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        raw = None
+        try:
+            async with asyncio.timeout_at(started + self.first_token_timeout):
+                raw = await deployment.client.chat.completions.with_raw_response.create(
+                    model=deployment.config.deployment,
+                    messages=messages,
+                    max_tokens=chat_request.max_tokens,
+                    temperature=chat_request.temperature,
+                    stream=True,
+                    timeout=self._upstream_timeout(self.total_timeout),
+                )
+                if deployment.rate_limiter is not None:
+                    deployment.rate_limiter.update_from_headers(raw.headers)
+                response = raw.parse()
+                chunks = response.__aiter__()
+                # コンテンツフィルター結果のみのチャンクは choices が空
+                first = None
+                while first is None:
+                    try:
+                        chunk = await chunks.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    if chunk.choices and chunk.choices[0].delta.content is not None:
+                        first = chunk.choices[0].delta.content
+        except TimeoutError:
+            if raw is not None:
+                await raw.http_response.aclose()
+            raise UpstreamTimeout(f"最初のトークンが{self.first_token_timeout}秒以内に届きませんでした")
+        except BaseException:
+            if raw is not None:
+                await raw.http_response.aclose()
+            raise
+        return raw, chunks, first, started + self.total_timeout
+
+    async def _chat_completion_stream(self, chat_request: ChatRequest):
+        """Azure OpenAI のチャット完了APIをストリーミングで呼び出す"""
+        # ジェネレーターは最初のチャンクと以降で別のタスクから進められるため、現在のスパンにはしない
+        span = get_tracer().begin("azure_openai.chat_completion_stream", {"llm.stream": True})
         try:
             # システムプロンプトの設定
             messages = []
@@ -107,28 +491,84 @@ class AzureOpenAIClient:
                     "content": msg.content
                 })
 
-            # Azure OpenAI APIのストリーミング呼び出し
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=messages,
-                max_tokens=chat_request.max_tokens,
-                temperature=chat_request.temperature,
-                stream=True
-            )
+            # Azure OpenAI APIのストリーミング呼び出し（最初のトークンまではリトライする）
+            estimated = self._estimate_tokens(chat_request)
+            started = time.perf_counter()
+            try:
+                deployment, (raw, chunks, first, deadline) = await call_with_retries(
+                    lambda: self._dispatch(
+                        lambda d, _: self._open_stream(d, chat_request, messages), estimated, hold=True
+                    ),
+                    self.retry_policy,
+                )
+            except BaseException as e:
+                observe_llm_request("unknown", True, self._outcome(e), time.perf_counter() - started)
+                raise
+            first_token_at = time.perf_counter()
+            observe_llm_first_token(deployment.name, first_token_at - started)
+            span.set_attribute("llm.deployment", deployment.name)
+            span.add_event("first_token", {"time_to_first_token_ms": round((first_token_at - started) * 1000, 3)})
 
             # ストリーミングレスポンスの処理
-            for chunk in response:
-                if chunk.choices[0].delta.content is not None:
-                    yield chunk.choices[0].delta.content
+            completion_chunks = 0
+            outcome = "ok"
+            try:
+                if first is not None:
+                    completion_chunks += 1
+                    yield first
+                while True:
+                    try:
+                        async with asyncio.timeout_at(deadline):
+                            chunk = await chunks.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    except TimeoutError:
+                        raise UpstreamTimeout(f"応答が{self.total_timeout}秒以内に完了しませんでした")
+                    if chunk.choices and chunk.choices[0].delta.content is not None:
+                        completion_chunks += 1
+                        yield chunk.choices[0].delta.content
+            except Exception as e:
+                # 最初のトークン以降の障害はリトライせず、デプロイメントの状態にだけ反映する
+                outcome = self._outcome(e)
+                deployment.record_error(e)
+                raise
+            except BaseException as e:
+                outcome = self._outcome(e)
+                raise
+            finally:
+                deployment.release()
+                await raw.http_response.aclose()
+                finished = time.perf_counter()
+                observe_llm_request(deployment.name, True, outcome, finished - started)
+                # 最初のトークンは開始までの時間に含めたので、以降の差分数で速度を出す
+                observe_llm_stream_rate(deployment.name, completion_chunks - 1, finished - first_token_at)
+                span.set_attribute("llm.completion_chunks", completion_chunks)
+                span.set_attribute("llm.outcome", outcome)
 
+            # ストリームには usage が無いため、差分 1 件を 1 トークンとして実績を見積もる
+            if deployment.rate_limiter is not None:
+                prompt = estimated - (chat_request.max_tokens or 0)
+                deployment.rate_limiter.record_usage(estimated, prompt + completion_chunks)
+
+        except (RateLimitExceeded, CircuitOpenError) as e:
+            span.record_exception(e)
+            raise
         except Exception as e:
+            span.record_exception(e)
             raise Exception(f"Azure OpenAI APIのストリーミング呼び出しでエラーが発生しました: {str(e)}")
+        finally:
+            span.end()
 
     def validate_connection(self) -> bool:
         """接続の検証"""
         try:
-            # 簡単なテストメッセージを送信
-            test_response = self.client.chat.completions.create(
+            # 簡単なテストメッセージを送信（起動前の確認用なので同期クライアントを使う）
+            sync_client = AzureOpenAI(
+                azure_endpoint=self.endpoint,
+                api_key=self.api_key,
+                api_version=self.api_version
+            )
+            test_response = sync_client.chat.completions.create(
                 model=self.model_name,
                 messages=[{"role": "user", "content": "Hello"}],
                 max_tokens=10
@@ -0,0 +1,85 @@
+# -------------------------------------------------
+# ・ファイル名：bench_azure_client.py
+# ・ファイル内容：Azure OpenAI クライアントの同時実行数別スループット計測
+# ・作成日時：2026/10/18 12:00:00  agent
+# -------------------------------------------------
+#
+# 使い方:
+#   AZURE_OPENAI_ENDPOINT=http://localhost:8100 AZURE_OPENAI_API_KEY=dummy \
+#       python bench_azure_client.py --concurrency 1 10 50 100 200 --stream
+
+import argparse
+import asyncio
+import time
+from typing import List
+
+from azure_openai_client import (
+    AzureOpenAIClient, ChatRequest, ChatMessage, close_shared_http_client,
+)
+from bench_db_latency import percentile
+
+async def one_call(client: AzureOpenAIClient, stream: bool) -> dict:
+    """1 回分の呼び出しを計測"""
+    request = ChatRequest(messages=[ChatMessage(role="user", content="ベンチマークです")], max_tokens=50)
+    started = time.perf_counter()
+    first_token = None
+    try:
+        if stream:
+            async for _ in client.chat_completion_stream(request):
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+        else:
+            await client.chat_completion(request)
+        ok = True
+    except Exception:
+        ok = False
+    return {"ok": ok, "latency": time.perf_counter() - started, "ttft": first_token}
+
+async def run_level(client: AzureOpenAIClient, concurrency: int, requests: int, stream: bool) -> dict:
+    """指定の同時実行数で requests 回呼び出す"""
+    queue: asyncio.Queue = asyncio.Queue()
+    for _ in range(requests):
+        queue.put_nowait(None)
+    results: List[dict] = []
+
+    async def worker():
+        while True:
+            try:
+                queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            results.append(await one_call(client, stream))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [r["latency"] * 1000 for r in results if r["ok"]]
+    ttfts = [r["ttft"] * 1000 for r in results if r["ok"] and r["ttft"] is not None]
+    return {
+        "concurrency": concurrency,
+        "throughput": len(latencies) / elapsed,
+        "errors": len(results) - len(latencies),
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+        "ttft_p50": percentile(ttfts, 50),
+    }
+
+async def run(args):
+    client = AzureOpenAIClient()
+    print(f"{'conc':>6s}{'req/s':>10s}{'p50':>10s}{'p99':>10s}{'ttft50':>10s}{'errors':>8s}")
+    for concurrency in args.concurrency:
+        requests = max(args.requests, concurrency * 2)
+        result = await run_level(client, concurrency, requests, args.stream)
+        print(
+            f"{result['concurrency']:6d}{result['throughput']:10.1f}"
+            f"{result['p50']:10.1f}{result['p99']:10.1f}{result['ttft_p50']:10.1f}{result['errors']:8d}"
+        )
+    await close_shared_http_client()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Azure OpenAI クライアントのスループット計測")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50, 100, 200])
+    parser.add_argument("--requests", type=int, default=200, help="同時実行数ごとの呼び出し回数")
+    parser.add_argument("--stream", action="store_true", help="ストリーミング API を計測")
+    asyncio.run(run(parser.parse_args()))
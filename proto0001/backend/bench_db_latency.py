@@ -0,0 +1,126 @@
+# -------------------------------------------------
+# ・ファイル名：bench_db_latency.py
+# ・ファイル内容：/chat/history 負荷中の /profile レイテンシ計測
+# ・作成日時：2026/10/18 11:00:00  agent
+# -------------------------------------------------
+#
+# 使い方:
+#   # 起動中のバックエンドに対して計測
+#   python bench_db_latency.py --url http://localhost:8000
+#
+#   # DB を使わずにプロセス内で計測（クエリ遅延を擬似的に発生させる）
+#   python bench_db_latency.py --in-process --db-latency-ms 50
+
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+import httpx
+import jwt
+
+def percentile(values: List[float], pct: float) -> float:
+    """パーセンタイル値（最近傍法）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+async def history_load(client: httpx.AsyncClient, headers: dict, stop: asyncio.Event, counter: List[int]):
+    """/chat/history を連続で叩き続ける"""
+    while not stop.is_set():
+        await client.get("/chat/history", headers=headers)
+        counter[0] += 1
+
+async def measure_profile(client: httpx.AsyncClient, headers: dict, samples: int) -> List[float]:
+    """/profile のレイテンシを計測（ミリ秒）"""
+    latencies = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        response = await client.get("/profile", headers=headers)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            print(f"⚠️ /profile が {response.status_code} を返しました")
+        await asyncio.sleep(0.01)
+    return latencies
+
+def build_in_process_app(db_latency_ms: float):
+    """クエリ毎に遅延する擬似接続でアプリを構成"""
+    from unittest.mock import MagicMock
+    import database
+    import main
+
+    def slow_execute(*args, **kwargs):
+        time.sleep(db_latency_ms / 1000)
+
+    def connect():
+        conn = MagicMock()
+        conn.closed = 0
+        conn.get_transaction_status.return_value = 0
+        cursor = conn.cursor.return_value
+        cursor.execute.side_effect = slow_execute
+        cursor.fetchone.return_value = {"id": 1, "username": "testAI", "created_at": datetime.now()}
+        cursor.fetchall.return_value = []
+        return conn
+
+    database._connection_pool = database.ConnectionPool(connect=connect, min_size=0)
+    return main.app, main.SECRET_KEY
+
+async def run(args):
+    if args.in_process:
+        app, secret_key = build_in_process_app(args.db_latency_ms)
+        transport = httpx.ASGITransport(app=app)
+        base_url = "http://bench"
+        token = jwt.encode(
+            {"sub": "testAI", "exp": datetime.utcnow() + timedelta(minutes=30)},
+            secret_key,
+            algorithm="HS256",
+        )
+    else:
+        transport = None
+        base_url = args.url
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            response = await client.post("/login", json={"username": args.username, "password": args.password})
+            response.raise_for_status()
+            token = response.json()["access_token"]
+
+    headers = {"Authorization": f"Bearer {token}"}
+    async with httpx.AsyncClient(base_url=base_url, transport=transport, timeout=60) as client:
+        # 無負荷時のベースライン
+        baseline = await measure_profile(client, headers, args.samples)
+
+        # /chat/history に負荷をかけながら計測
+        stop = asyncio.Event()
+        counter = [0]
+        loaders = [
+            asyncio.create_task(history_load(client, headers, stop, counter))
+            for _ in range(args.concurrency)
+        ]
+        started = time.perf_counter()
+        loaded = await measure_profile(client, headers, args.samples)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await asyncio.gather(*loaders)
+
+    print(f"/chat/history 同時実行数: {args.concurrency}  ({counter[0] / elapsed:.1f} req/s)")
+    print(f"{'':10s}{'p50':>10s}{'p95':>10s}{'p99':>10s}{'max':>10s}")
+    for label, values in (("idle", baseline), ("loaded", loaded)):
+        print(
+            f"{label:10s}"
+            f"{percentile(values, 50):10.1f}{percentile(values, 95):10.1f}"
+            f"{percentile(values, 99):10.1f}{max(values):10.1f}"
+        )
+    print("（単位: ミリ秒）")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="/chat/history 負荷中の /profile レイテンシ計測")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--username", default="testAI")
+    parser.add_argument("--password", default="testAI00!")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--in-process", action="store_true", help="DB を擬似接続に置き換えてプロセス内で計測")
+    parser.add_argument("--db-latency-ms", type=float, default=50.0)
+    asyncio.run(run(parser.parse_args()))
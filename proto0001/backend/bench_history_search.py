@@ -0,0 +1,171 @@
+# -------------------------------------------------
+# ・ファイル名：bench_history_search.py
+# ・ファイル内容：chat_history の全文検索のベンチマーク（合成データ 100 万行）
+# ・作成日時：2026/10/19 09:00:00  agent
+# -------------------------------------------------
+#
+# 使い方:
+#   # .env の DB に検証用テーブル（chat_history_search_bench）を作って計測（終了時に削除）
+#   python bench_history_search.py --rows 1000000 --users 10
+#
+#   # 実行計画も表示し、テーブルを残す
+#   python bench_history_search.py --explain --keep
+#
+# インデックス無しの ILIKE（逐次走査）と、/chat/history/search と同じ SQL（tsvector・トライグラムの
+# GIN インデックス）を、同じユーザー・同じ検索語で比較する。pg_trgm 拡張を作成できる権限が必要。
+
+import argparse
+import time
+from typing import List
+
+from psycopg2.extras import RealDictCursor
+
+from bench_db_latency import percentile
+from database import get_db_connection
+from history_search import (
+    TRIGRAM_DOCUMENT, build_search_query, escape_like, index_names, parse_terms, schema_statements,
+    search_mode_for,
+)
+
+TABLE = "chat_history_search_bench"
+
+# 合成データの材料（質問・回答を組み合わせ、行毎に番号を付けて重複を避ける）
+QUESTIONS_JA = [
+    "経費精算の締め日はいつですか", "有給休暇の申請方法を教えてください", "会議室の予約を取り消したい",
+    "パスワードを忘れた場合の手順", "新しいノートパソコンの設定方法", "出張の宿泊費の上限はいくらですか",
+    "社内 Wi-Fi に接続できません", "健康診断の予約について", "在宅勤務の申請はどこからできますか",
+    "請求書の再発行をお願いしたい",
+]
+QUESTIONS_EN = [
+    "docker compose fails with connection refused", "how to rotate the api key", "postgres vacuum settings",
+    "kubernetes pod keeps restarting", "python asyncio timeout handling", "nginx returns 502 bad gateway",
+    "git rebase conflict resolution", "terraform state lock error", "redis memory usage is high",
+    "typescript generic constraints",
+]
+ANSWERS = [
+    "手順は次のとおりです。まず申請画面を開き、必要事項を入力してください。",
+    "Check the service logs first, then verify the network configuration and credentials.",
+    "担当部署へのお問い合わせが必要です。詳細は社内ポータルをご確認ください。",
+    "This usually happens when the configuration is out of date; restart after updating it.",
+]
+
+QUERIES = [
+    ("fts", "docker"),
+    ("fts", "connection refused"),
+    ("fts", "vacuum"),
+    ("trigram", "経費精算"),
+    ("trigram", "パスワード 手順"),
+    ("trigram", "健康診断"),
+]
+
+def sql_array(values: List[str]) -> str:
+    return "ARRAY[" + ", ".join("'" + v.replace("'", "''") + "'" for v in values) + "]"
+
+def create_table(cursor, rows: int, users: int):
+    cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    cursor.execute(f"""
+        CREATE TABLE {TABLE} (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(50) NOT NULL,
+            user_message TEXT NOT NULL,
+            assistant_message TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            truncated BOOLEAN NOT NULL DEFAULT FALSE,
+            conversation_id INTEGER
+        )
+    """)
+    questions = QUESTIONS_JA + QUESTIONS_EN
+    cursor.execute(f"""
+        INSERT INTO {TABLE} (username, user_message, assistant_message, created_at)
+        SELECT
+            'user' || (g % %s),
+            ({sql_array(questions)})[1 + floor(random() * {len(questions)})::int] || ' #' || g,
+            ({sql_array(ANSWERS)})[1 + floor(random() * {len(ANSWERS)})::int]
+                || ' ' || ({sql_array(ANSWERS)})[1 + floor(random() * {len(ANSWERS)})::int],
+            now() - make_interval(secs => g)
+        FROM generate_series(1, %s) AS g
+    """, (users, rows))
+    cursor.execute(f"CREATE INDEX ON {TABLE} (username, created_at DESC, id DESC)")
+    cursor.execute(f"ANALYZE {TABLE}")
+
+def timed(cursor, sql: str, params, repeat: int) -> List[float]:
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+def explain(cursor, sql: str, params) -> str:
+    cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params)
+    return "\n".join("    " + row["QUERY PLAN"] for row in cursor.fetchall())
+
+def naive_query(username: str, q: str, limit: int):
+    """インデックスを使わない部分一致（検索機能が無い場合の素朴な実装）"""
+    terms = parse_terms(q) or [q]
+    conditions = " AND ".join(f"{TRIGRAM_DOCUMENT} ILIKE %s" for _ in terms)
+    sql = f"""
+        SELECT id, user_message, assistant_message, created_at
+        FROM {TABLE}
+        WHERE username = %s AND {conditions}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+    """
+    return sql, [username] + [f"%{escape_like(t)}%" for t in terms] + [limit]
+
+def report(label: str, latencies: List[float]):
+    print(f"  {label:34s}{percentile(latencies, 50):10.2f}{percentile(latencies, 95):10.2f}")
+
+def run(args):
+    conn = get_db_connection()
+    conn.autocommit = True
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        started = time.perf_counter()
+        create_table(cursor, args.rows, args.users)
+        print(f"{args.rows:,} 行を作成（{args.users} ユーザー）: {time.perf_counter() - started:.1f} 秒")
+
+        username = "user1"
+        print(f"\n{'インデックス無し（ILIKE）':36s}{'p50 ms':>10s}{'p95 ms':>10s}")
+        for _, q in QUERIES:
+            sql, params = naive_query(username, q, args.limit + 1)
+            report(q, timed(cursor, sql, params, args.repeat))
+            if args.explain:
+                print(explain(cursor, sql, params))
+
+        for statement in schema_statements(TABLE):
+            started = time.perf_counter()
+            cursor.execute(statement)
+            print(f"{' '.join(statement.split())[:70]}: {time.perf_counter() - started:.1f} 秒")
+        cursor.execute(f"ANALYZE {TABLE}")
+        cursor.execute(
+            "SELECT pg_size_pretty(pg_relation_size(%s)) AS fts, pg_size_pretty(pg_relation_size(%s)) AS trgm",
+            tuple(index_names(TABLE)),
+        )
+        sizes = cursor.fetchone()
+        print(f"インデックスサイズ: tsvector {sizes['fts']} / トライグラム {sizes['trgm']}")
+
+        print(f"\n{'/chat/history/search（GIN）':36s}{'p50 ms':>10s}{'p95 ms':>10s}")
+        for expected_mode, q in QUERIES:
+            mode = search_mode_for(q)
+            assert mode == expected_mode
+            sql, params = build_search_query(username, q, mode, args.limit, table=TABLE)
+            report(f"{q} [{mode}]", timed(cursor, sql, params, args.repeat))
+            if args.explain:
+                print(explain(cursor, sql, params))
+    finally:
+        if not args.keep:
+            cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        cursor.close()
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="chat_history の全文検索のベンチマーク")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=10, help="行を振り分けるユーザー数（検索は 1 ユーザー分）")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--explain", action="store_true", help="EXPLAIN ANALYZE の結果を表示")
+    parser.add_argument("--keep", action="store_true", help="終了時にテーブルを削除しない")
+    run(parser.parse_args())
@@ -0,0 +1,161 @@
+# -------------------------------------------------
+# ・ファイル名：bench_login_storm.py
+# ・ファイル内容：ログイン集中時の /chat/stream のチャンク間隔の計測
+# ・作成日時：2026/10/19 02:00:00  agent
+# -------------------------------------------------
+#
+# 使い方:
+#   # 起動中のバックエンドに対して計測
+#   python bench_login_storm.py --url http://localhost:8000
+#
+#   # DB と Azure OpenAI を擬似的に置き換え、プロセス内で uvicorn を起動して計測
+#   python bench_login_storm.py --in-process --hash-workers 4
+#
+#   # 従来の動作（bcrypt をイベントループ上で実行）と比較
+#   python bench_login_storm.py --in-process --hash-workers 0
+
+import argparse
+import asyncio
+import time
+from datetime import datetime
+from typing import List
+
+import bcrypt
+import httpx
+
+from bench_db_latency import percentile
+
+async def stream_gaps(client: httpx.AsyncClient, headers: dict, gaps: List[float]):
+    """/chat/stream を 1 回受信し、チャンクの到着間隔（ミリ秒）を記録"""
+    body = {"messages": [{"role": "user", "content": "ベンチマークです"}]}
+    async with client.stream("POST", "/chat/stream", json=body, headers=headers) as response:
+        last = None
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            now = time.perf_counter()
+            if last is not None:
+                gaps.append((now - last) * 1000)
+            last = now
+
+async def stream_load(client: httpx.AsyncClient, headers: dict, stop: asyncio.Event, gaps: List[float]):
+    while not stop.is_set():
+        await stream_gaps(client, headers, gaps)
+
+async def login_storm(client: httpx.AsyncClient, args, stop: asyncio.Event, results: dict):
+    """ログインを連続で行う（成功・503 などを数える）"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = await client.post("/login", json={"username": args.username, "password": args.password})
+        results["latency"].append((time.perf_counter() - started) * 1000)
+        results[response.status_code] = results.get(response.status_code, 0) + 1
+        if response.status_code == 503:
+            await asyncio.sleep(0.05)
+
+async def measure(client: httpx.AsyncClient, headers: dict, args, storm: bool) -> dict:
+    stop = asyncio.Event()
+    gaps: List[float] = []
+    logins = {"latency": []}
+    tasks = [asyncio.create_task(stream_load(client, headers, stop, gaps)) for _ in range(args.streams)]
+    if storm:
+        tasks += [asyncio.create_task(login_storm(client, args, stop, logins)) for _ in range(args.logins)]
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*tasks)
+    return {"gaps": gaps, "logins": logins}
+
+def setup_in_process(args):
+    """DB・Azure OpenAI を擬似的に置き換えてアプリを構成"""
+    from unittest.mock import MagicMock
+    import database
+    import main
+    import password_hasher
+
+    password_hash = bcrypt.hashpw(args.password.encode("utf-8"), bcrypt.gensalt(args.rounds)).decode("utf-8")
+
+    def connect():
+        conn = MagicMock()
+        conn.closed = 0
+        conn.get_transaction_status.return_value = 0
+        cursor = conn.cursor.return_value
+        cursor.fetchone.return_value = {
+            "id": 1, "username": args.username, "password_hash": password_hash, "created_at": datetime.now(),
+        }
+        return conn
+
+    class StubClient:
+        async def chat_completion_stream(self, request):
+            for i in range(args.tokens):
+                await asyncio.sleep(1 / args.tokens_per_sec)
+                yield f"t{i} "
+
+    async def skip_history(records):
+        pass
+
+    database._connection_pool = database.ConnectionPool(connect=connect, min_size=0)
+    main.insert_chat_history_batch = skip_history
+    main.get_azure_openai_client = lambda: StubClient()
+    password_hasher._password_hasher = password_hasher.PasswordHasher(max_workers=args.hash_workers)
+    return main.app
+
+def summary(label: str, values: List[float]) -> str:
+    if not values:
+        return f"{label:14s}{'-':>10s}"
+    return (
+        f"{label:14s}{percentile(values, 50):10.1f}{percentile(values, 95):10.1f}"
+        f"{percentile(values, 99):10.1f}{max(values):10.1f}"
+    )
+
+async def run(args):
+    server = None
+    if args.in_process:
+        import uvicorn
+        app = setup_in_process(args)
+        # lifespan を無効にして DB の初期化を行わない
+        server = uvicorn.Server(uvicorn.Config(app, port=args.port, log_level="warning", lifespan="off"))
+        serve_task = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.05)
+        base_url = f"http://127.0.0.1:{args.port}"
+    else:
+        base_url = args.url
+
+    limits = httpx.Limits(max_connections=args.streams + args.logins + 10)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+        response = await client.post("/login", json={"username": args.username, "password": args.password})
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        idle = await measure(client, headers, args, storm=False)
+        loaded = await measure(client, headers, args, storm=True)
+
+    if server is not None:
+        server.should_exit = True
+        await serve_task
+
+    logins = loaded["logins"]
+    counts = {code: n for code, n in logins.items() if code != "latency"}
+    print(f"ストリーム {args.streams} 本 / ログイン同時実行数 {args.logins} / {args.duration:.0f} 秒"
+          + (f" / bcrypt ワーカー {args.hash_workers}" if args.in_process else ""))
+    print(f"ログイン結果: {counts}  ({sum(counts.values()) / args.duration:.1f} req/s)")
+    print(f"{'':14s}{'p50':>10s}{'p95':>10s}{'p99':>10s}{'max':>10s}")
+    print(summary("gap idle", idle["gaps"]))
+    print(summary("gap storm", loaded["gaps"]))
+    print(summary("login", logins["latency"]))
+    print("（単位: ミリ秒）")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ログイン集中時の /chat/stream のチャンク間隔の計測")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--username", default="testAI")
+    parser.add_argument("--password", default="testAI00!")
+    parser.add_argument("--streams", type=int, default=10, help="同時に受信するストリーム数")
+    parser.add_argument("--logins", type=int, default=20, help="ログインの同時実行数")
+    parser.add_argument("--duration", type=float, default=10.0, help="各フェーズの計測秒数")
+    parser.add_argument("--in-process", action="store_true", help="DB・Azure OpenAI を擬似的に置き換えて計測")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--hash-workers", type=int, default=4, help="bcrypt のワーカー数（0 でイベントループ上）")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt のコスト")
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--tokens-per-sec", type=float, default=20.0)
+    asyncio.run(run(parser.parse_args()))
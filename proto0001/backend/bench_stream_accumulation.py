@@ -0,0 +1,120 @@
+# -------------------------------------------------
+# ・ファイル名：bench_stream_accumulation.py
+# ・ファイル内容：ストリーム応答の蓄積方法（文字列 += とチャンクのリスト）の比較
+# ・作成日時：2026/10/19 01:00:00  agent
+# -------------------------------------------------
+#
+# 使い方:
+#   # 10,000 トークンの擬似ストリームで比較
+#   python bench_stream_accumulation.py --tokens 10000 --repeat 20
+#
+#   # ChatStreamSession を通した 1 ストリーム全体の処理時間も計測
+#   python bench_stream_accumulation.py --tokens 10000 --session
+#
+# CPython はローカル変数の文字列が他から参照されていない場合に限り += をその場で伸ばすため、
+# "str += (local)" は線形に近くなる。参照が残る場合（"shared ref"）や他の処理系では毎回コピーが発生する。
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import tracemalloc
+from typing import Callable, List
+
+from bench_db_latency import percentile
+from chat_stream import ChatStreamRegistry, ResponseBuffer
+
+def synthetic_tokens(count: int, seed: int = 0) -> List[str]:
+    """GPT の差分に近い 1〜4 文字のトークン列（日本語と ASCII の混在）"""
+    rng = random.Random(seed)
+    alphabet = "あいうえおかきくけこさしすせそ漢字変換テスト abcdefghijklmnopqrstuvwxyz。、\n"
+    return ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 4))) for _ in range(count)]
+
+def accumulate_concat(tokens: List[str]) -> str:
+    """従来の実装（ローカル変数への +=）"""
+    full_response = ""
+    for token in tokens:
+        full_response += token
+    return full_response
+
+def accumulate_concat_shared(tokens: List[str]) -> str:
+    """+= の最適化が効かない場合（結合途中の文字列を他からも参照している）"""
+    full_response = ""
+    snapshot = full_response
+    for token in tokens:
+        full_response += token
+        snapshot = full_response
+    return snapshot
+
+def accumulate_buffer(tokens: List[str]) -> str:
+    """チャンクのリストに積んで最後に 1 回結合（ResponseBuffer）"""
+    buffer = ResponseBuffer(max_chars=0)
+    for token in tokens:
+        buffer.append(token)
+    return buffer.getvalue()
+
+def measure(func: Callable[[List[str]], str], tokens: List[str], repeat: int) -> dict:
+    """処理時間（ミリ秒）とメモリのピーク（KiB）"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(tokens)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    func(tokens)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "mean": statistics.mean(timings),
+        "p95": percentile(timings, 95),
+        "peak_kib": peak / 1024,
+    }
+
+async def measure_session(tokens: List[str], repeat: int) -> List[float]:
+    """ChatStreamSession で上流の受信から履歴保存の呼び出しまでの時間（ミリ秒）"""
+    registry = ChatStreamRegistry(coalesce_ms=0, max_sessions=repeat)
+
+    async def upstream():
+        for token in tokens:
+            yield token
+
+    async def on_complete(text: str, truncated: bool):
+        pass
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        session = registry.create("bench", upstream(), None, on_complete, lambda text: None)
+        await session.task
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+def main(args):
+    tokens = synthetic_tokens(args.tokens)
+    total_chars = sum(len(token) for token in tokens)
+    print(f"🧪 {args.tokens} トークン（{total_chars} 文字）× {args.repeat} 回")
+
+    expected = "".join(tokens)
+    print(f"{'方式':<24}{'平均(ms)':>12}{'p95(ms)':>12}{'ピーク(KiB)':>14}")
+    for name, func in [
+        ("str += (local)", accumulate_concat),
+        ("str += (shared ref)", accumulate_concat_shared),
+        ("ResponseBuffer", accumulate_buffer),
+    ]:
+        assert func(tokens) == expected
+        result = measure(func, tokens, args.repeat)
+        print(f"{name:<24}{result['mean']:>12.3f}{result['p95']:>12.3f}{result['peak_kib']:>14.1f}")
+
+    if args.session:
+        timings = asyncio.run(measure_session(tokens, args.repeat))
+        print(f"ChatStreamSession 1 ストリーム: 平均 {statistics.mean(timings):.2f} ms, "
+              f"p95 {percentile(timings, 95):.2f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ストリーム応答の蓄積方法の比較")
+    parser.add_argument("--tokens", type=int, default=10000, help="擬似ストリームのトークン数")
+    parser.add_argument("--repeat", type=int, default=20, help="計測の繰り返し回数")
+    parser.add_argument("--session", action="store_true", help="ChatStreamSession 全体も計測")
+    main(parser.parse_args())
@@ -0,0 +1,332 @@
+# -------------------------------------------------
+# ・ファイル名：chat_stream.py
+# ・ファイル内容：チャット応答の SSE 配信（差分の結合・ハートビート・再接続時の再送）
+# ・作成日時：2026/10/19 00:00:00  agent
+# -------------------------------------------------
+
+import asyncio
+import json
+import os
+import secrets
+import time
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+# SSE 配信設定
+CHAT_STREAM_COALESCE_MS = float(os.getenv("CHAT_STREAM_COALESCE_MS", "50"))
+CHAT_STREAM_COALESCE_BYTES = int(os.getenv("CHAT_STREAM_COALESCE_BYTES", "1024"))
+CHAT_STREAM_HEARTBEAT_SECONDS = float(os.getenv("CHAT_STREAM_HEARTBEAT_SECONDS", "15"))
+CHAT_STREAM_RETRY_MS = int(os.getenv("CHAT_STREAM_RETRY_MS", "3000"))
+CHAT_STREAM_RESUME_GRACE_SECONDS = float(os.getenv("CHAT_STREAM_RESUME_GRACE_SECONDS", "10"))
+CHAT_STREAM_REPLAY_TTL_SECONDS = float(os.getenv("CHAT_STREAM_REPLAY_TTL_SECONDS", "60"))
+CHAT_STREAM_REPLAY_MAX_EVENTS = int(os.getenv("CHAT_STREAM_REPLAY_MAX_EVENTS", "2000"))
+# 再送バッファの上限（ストリーム毎、イベントの UTF-8 バイト数。超えたら古いイベントから捨てる）
+CHAT_STREAM_REPLAY_MAX_BYTES = int(os.getenv("CHAT_STREAM_REPLAY_MAX_BYTES", "262144"))
+CHAT_STREAM_MAX_SESSIONS = int(os.getenv("CHAT_STREAM_MAX_SESSIONS", "1000"))
+# 履歴保存用に保持する応答の上限（文字数。超えた分はクライアントへの配信のみ）
+CHAT_STREAM_MAX_RESPONSE_CHARS = int(os.getenv("CHAT_STREAM_MAX_RESPONSE_CHARS", "262144"))
+
+class ReplayUnavailable(Exception):
+    """要求された位置のイベントが再送バッファに残っていない"""
+
+class ResponseBuffer:
+    """ストリーム応答の蓄積（チャンクのリストに積み、最後に 1 回だけ結合する）
+
+    文字列の += は長い応答ほど再コピーが増えるため使わない。
+    max_chars を超えた分は保持せず truncated を立てる（0 以下なら上限なし）。
+    """
+
+    def __init__(self, max_chars: int = CHAT_STREAM_MAX_RESPONSE_CHARS):
+        self.max_chars = max_chars
+        self.parts: List[str] = []
+        self.size = 0
+        self.truncated = False
+
+    def append(self, delta: str):
+        if self.truncated or not delta:
+            return
+        if self.max_chars > 0 and self.size + len(delta) > self.max_chars:
+            delta = delta[:self.max_chars - self.size]
+            self.truncated = True
+            if not delta:
+                return
+        self.parts.append(delta)
+        self.size += len(delta)
+
+    def getvalue(self) -> str:
+        """結合した応答（結合結果を保持し、2 回目以降はコピーしない）"""
+        if len(self.parts) != 1:
+            self.parts = ["".join(self.parts)]
+        return self.parts[0]
+
+def format_event(event_id: int, data: str) -> str:
+    return f"id: {event_id}\ndata: {data}\n\n"
+
+class ChatStreamSession:
+    """1 回分の応答ストリーム
+
+    上流のチャンクはリクエストとは独立したタスクで受信し、イベントとしてバッファに積む。
+    HTTP 応答はバッファの購読者で、再接続した場合は Last-Event-ID の続きから再送する。
+    購読者が resume_grace 秒いなくなったら上流を打ち切る。
+    再送バッファはイベント数と合計バイト数の両方で上限を設け、超えたら古いものから捨てる。
+    """
+
+    def __init__(
+        self,
+        stream_id: str,
+        username: str,
+        chunks: AsyncIterator[str],
+        first_chunk: Optional[str],
+        on_complete: Callable[[str, bool], Awaitable[None]],
+        on_cancel: Callable[[str], None],
+        registry: "ChatStreamRegistry",
+    ):
+        self.id = stream_id
+        self.username = username
+        self.registry = registry
+        # (イベント ID, データ, データのバイト数)
+        self.events: deque = deque()
+        self.event_bytes = 0
+        self.next_id = 1
+        self.done = False
+        self.outcome: Optional[str] = None
+        self.finished_at: Optional[float] = None
+        self.subscribers = 0
+        self._updated = asyncio.Event()
+        self._abandon_handle: Optional[asyncio.TimerHandle] = None
+        self._on_complete = on_complete
+        self._on_cancel = on_cancel
+        self.task = asyncio.ensure_future(self._produce(chunks, first_chunk))
+
+    def _notify(self):
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    def _emit(self, payload: Dict[str, Any]):
+        data = json.dumps(payload, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        self.events.append((self.next_id, data, size))
+        self.event_bytes += size
+        self.next_id += 1
+        # 最新のイベント（完了・エラー通知を含む）は常に残す
+        registry = self.registry
+        while len(self.events) > 1 and (
+            len(self.events) > registry.max_events or self.event_bytes > registry.replay_max_bytes
+        ):
+            self.event_bytes -= self.events.popleft()[2]
+        self._notify()
+
+    def _finish(self, outcome: str):
+        self.done = True
+        self.outcome = outcome
+        self.finished_at = time.monotonic()
+        self.registry.stats_counts[outcome] += 1
+        self._notify()
+
+    async def _produce(self, chunks: AsyncIterator[str], first_chunk: Optional[str]):
+        """上流のチャンクを結合してイベントにする（時間窓かバイト数で区切る）"""
+        registry = self.registry
+        loop = asyncio.get_running_loop()
+        window = registry.coalesce_ms / 1000
+        response = ResponseBuffer(registry.max_response_chars)
+        pending = []
+        pending_bytes = 0
+        flush_at = 0.0
+        next_chunk: Optional[asyncio.Future] = None
+
+        def flush():
+            nonlocal pending, pending_bytes
+            if pending:
+                self._emit({"chunk": "".join(pending)})
+                pending, pending_bytes = [], 0
+
+        def add(delta: str):
+            nonlocal pending_bytes, flush_at
+            response.append(delta)
+            if not pending:
+                flush_at = loop.time() + window
+            pending.append(delta)
+            pending_bytes += len(delta.encode("utf-8"))
+            if pending_bytes >= registry.coalesce_bytes or window <= 0:
+                flush()
+
+        try:
+            if first_chunk is not None:
+                add(first_chunk)
+            iterator = chunks.__aiter__()
+            while True:
+                if next_chunk is None:
+                    next_chunk = asyncio.ensure_future(iterator.__anext__())
+                timeout = max(flush_at - loop.time(), 0) if pending else None
+                # wait はタイムアウトしても上流の受信を取り消さない
+                finished, _ = await asyncio.wait({next_chunk}, timeout=timeout)
+                if not finished:
+                    flush()
+                    continue
+                task, next_chunk = next_chunk, None
+                try:
+                    delta = task.result()
+                except StopAsyncIteration:
+                    break
+                add(delta)
+            flush()
+        except asyncio.CancelledError:
+            # 購読者が戻らなかったので上流を閉じる
+            if next_chunk is not None:
+                next_chunk.cancel()
+                try:
+                    await next_chunk
+                except BaseException:
+                    pass
+            await chunks.aclose()
+            self._finish("cancelled")
+            self._on_cancel(response.getvalue())
+            return
+        except Exception as e:
+            self._emit({"error": f"ストリーミングチャット処理中にエラーが発生しました: {str(e)}"})
+            self._finish("failed")
+            return
+
+        # 完了通知（履歴の保存を待たずにクライアントへ返す）
+        self._emit({"done": True})
+        self._finish("completed")
+        if response.truncated:
+            registry.stats_counts["response_capped"] += 1
+        await self._on_complete(response.getvalue(), response.truncated)
+
+    def replay_from(self, last_event_id: int) -> int:
+        """再送の開始位置を検証（バッファから消えていれば ReplayUnavailable）"""
+        first_id = self.events[0][0] if self.events else self.next_id
+        if last_event_id < first_id - 1 or last_event_id >= self.next_id:
+            raise ReplayUnavailable(f"イベント {last_event_id} の続きは再送できません")
+        return last_event_id
+
+    async def subscribe(self, last_event_id: int = 0) -> AsyncIterator[str]:
+        """SSE のテキストを返す（last_event_id より後のイベントから）"""
+        self.subscribers += 1
+        if self._abandon_handle is not None:
+            self._abandon_handle.cancel()
+            self._abandon_handle = None
+        cursor = last_event_id
+        try:
+            yield f"retry: {self.registry.retry_ms}\n\n"
+            while True:
+                updated = self._updated
+                # 送信中にも古いイベントが捨てられるため、位置は毎回数え直す
+                while self.events and cursor < self.events[-1][0]:
+                    first_id = self.events[0][0]
+                    if cursor < first_id - 1:
+                        # 送信が追いつかず、未送信のイベントが捨てられた（再接続すると 410 になる）
+                        self.registry.stats_counts["overrun"] += 1
+                        return
+                    event_id, data, _ = self.events[cursor - first_id + 1]
+                    cursor = event_id
+                    yield format_event(event_id, data)
+                if self.done and cursor >= self.next_id - 1:
+                    return
+                try:
+                    await asyncio.wait_for(updated.wait(), self.registry.heartbeat)
+                except asyncio.TimeoutError:
+                    # プロキシにアイドル接続として切られないようコメント行を送る
+                    yield ": ping\n\n"
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                self._schedule_abandon()
+
+    def _schedule_abandon(self):
+        grace = self.registry.resume_grace
+        if grace <= 0:
+            self.task.cancel()
+            return
+        self._abandon_handle = asyncio.get_running_loop().call_later(grace, self._abandon)
+
+    def _abandon(self):
+        self._abandon_handle = None
+        if self.subscribers == 0 and not self.done:
+            self.task.cancel()
+
+class ChatStreamRegistry:
+    """配信中・配信済み（再送用に一定時間保持）のストリームを管理"""
+
+    def __init__(
+        self,
+        coalesce_ms: float = CHAT_STREAM_COALESCE_MS,
+        coalesce_bytes: int = CHAT_STREAM_COALESCE_BYTES,
+        heartbeat: float = CHAT_STREAM_HEARTBEAT_SECONDS,
+        retry_ms: int = CHAT_STREAM_RETRY_MS,
+        resume_grace: float = CHAT_STREAM_RESUME_GRACE_SECONDS,
+        replay_ttl: float = CHAT_STREAM_REPLAY_TTL_SECONDS,
+        max_events: int = CHAT_STREAM_REPLAY_MAX_EVENTS,
+        replay_max_bytes: int = CHAT_STREAM_REPLAY_MAX_BYTES,
+        max_sessions: int = CHAT_STREAM_MAX_SESSIONS,
+        max_response_chars: int = CHAT_STREAM_MAX_RESPONSE_CHARS,
+    ):
+        self.coalesce_ms = coalesce_ms
+        self.coalesce_bytes = coalesce_bytes
+        self.heartbeat = heartbeat
+        self.retry_ms = retry_ms
+        self.resume_grace = resume_grace
+        self.replay_ttl = replay_ttl
+        self.max_events = max_events
+        self.replay_max_bytes = replay_max_bytes
+        self.max_sessions = max_sessions
+        self.max_response_chars = max_response_chars
+        self._sessions: "OrderedDict[str, ChatStreamSession]" = OrderedDict()
+
+        # 統計情報
+        self.stats_counts = {"started": 0, "completed": 0, "cancelled": 0, "failed": 0, "resumed": 0,
+                            "response_capped": 0, "overrun": 0}
+
+    def _purge(self):
+        """保持期間を過ぎた配信済みストリームを削除（上限超過時は古いものから）"""
+        now = time.monotonic()
+        for stream_id, session in list(self._sessions.items()):
+            expired = session.done and now - session.finished_at >= self.replay_ttl
+            if expired or (len(self._sessions) > self.max_sessions and session.done):
+                del self._sessions[stream_id]
+
+    def create(
+        self,
+        username: str,
+        chunks: AsyncIterator[str],
+        first_chunk: Optional[str],
+        on_complete: Callable[[str, bool], Awaitable[None]],
+        on_cancel: Callable[[str], None],
+    ) -> ChatStreamSession:
+        self._purge()
+        session = ChatStreamSession(
+            secrets.token_urlsafe(12), username, chunks, first_chunk, on_complete, on_cancel, self
+        )
+        self._sessions[session.id] = session
+        self.stats_counts["started"] += 1
+        return session
+
+    def get(self, stream_id: str, username: str) -> Optional[ChatStreamSession]:
+        """再接続用にストリームを取得（他のユーザーのストリームは返さない）"""
+        self._purge()
+        session = self._sessions.get(stream_id)
+        if session is None or session.username != username:
+            return None
+        self.stats_counts["resumed"] += 1
+        return session
+
+    def stats(self) -> Dict[str, Any]:
+        """ストリーミングの統計情報"""
+        return {
+            **self.stats_counts,
+            "active": sum(1 for s in self._sessions.values() if not s.done),
+            "retained": len(self._sessions),
+            "subscribers": sum(s.subscribers for s in self._sessions.values()),
+            "replay_bytes": sum(s.event_bytes for s in self._sessions.values()),
+        }
+
+# グローバルインスタンス
+_chat_stream_registry: Optional[ChatStreamRegistry] = None
+
+def get_chat_stream_registry() -> ChatStreamRegistry:
+    """ストリーム管理のシングルトンインスタンスを取得"""
+    global _chat_stream_registry
+    if _chat_stream_registry is None:
+        _chat_stream_registry = ChatStreamRegistry()
+    return _chat_stream_registry
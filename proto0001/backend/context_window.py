@@ -0,0 +1,155 @@
+# -------------------------------------------------
+# ・ファイル名：context_window.py
+# ・ファイル内容：トークン数に基づく会話履歴のトリミング
+# ・作成日時：2026/10/18 19:00:00  agent
+# -------------------------------------------------
+
+import os
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, List, Optional
+
+# コンテキストウィンドウ設定
+AZURE_OPENAI_CONTEXT_TOKENS = int(os.getenv("AZURE_OPENAI_CONTEXT_TOKENS", "4096"))
+CONTEXT_PROMPT_TOKEN_BUDGET = int(os.getenv("CONTEXT_PROMPT_TOKEN_BUDGET", "0"))
+CONTEXT_SAFETY_MARGIN_TOKENS = int(os.getenv("CONTEXT_SAFETY_MARGIN_TOKENS", "64"))
+CONTEXT_SUMMARY_ENABLED = os.getenv("CONTEXT_SUMMARY_ENABLED", "false").lower() == "true"
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "256"))
+CONTEXT_TOKEN_CACHE_SIZE = int(os.getenv("CONTEXT_TOKEN_CACHE_SIZE", "10000"))
+
+# 要約メッセージの見出し
+SUMMARY_PREFIX = "これまでの会話の要約:\n"
+
+# ChatML の 1 メッセージあたりのオーバーヘッドと、応答開始分のトークン
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 3
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+# tiktoken が無い場合の概算用（CJK は 1 文字 1 トークン、それ以外は 4 文字 1 トークン）
+_CJK_PATTERN = re.compile(r"[　-ヿ㐀-䶿一-鿿豈-﫿＀-￯]")
+
+def count_tokens(text: str) -> int:
+    """テキストのトークン数"""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+@lru_cache(maxsize=CONTEXT_TOKEN_CACHE_SIZE)
+def message_tokens(role: str, content: str) -> int:
+    """1 メッセージ分のトークン数（同じ内容は再計算しない）"""
+    return MESSAGE_OVERHEAD_TOKENS + count_tokens(role) + count_tokens(content)
+
+def prompt_tokens(messages: List, system_prompt: Optional[str] = None) -> int:
+    """システムプロンプトを含むプロンプト全体のトークン数"""
+    total = REPLY_PRIMING_TOKENS + sum(message_tokens(msg.role, msg.content) for msg in messages)
+    if system_prompt:
+        total += message_tokens("system", system_prompt)
+    return total
+
+def extractive_summary(messages: List, max_tokens: int) -> str:
+    """削除したユーザー発言の冒頭を並べた簡易要約"""
+    lines = []
+    used = 0
+    for msg in messages:
+        text = msg.content.strip()
+        if msg.role != "user" or not text:
+            continue
+        line = "- " + text.splitlines()[0][:80]
+        tokens = count_tokens(line)
+        if used + tokens > max_tokens:
+            break
+        lines.append(line)
+        used += tokens
+    return "\n".join(lines)
+
+@dataclass
+class TrimResult:
+    """トリミング結果"""
+    messages: List
+    summary: Optional[str] = None
+    prompt_tokens_before: int = 0
+    prompt_tokens_after: int = 0
+    dropped_messages: int = 0
+
+    @property
+    def prompt_tokens_saved(self) -> int:
+        return self.prompt_tokens_before - self.prompt_tokens_after
+
+    def usage_info(self) -> dict:
+        return {
+            "prompt_tokens_estimated": self.prompt_tokens_after,
+            "prompt_tokens_saved": self.prompt_tokens_saved,
+            "trimmed_messages": self.dropped_messages,
+            "summarized": self.summary is not None,
+        }
+
+class ContextWindowManager:
+    """システムプロンプトと直近の会話をトークン予算内に収める"""
+
+    def __init__(
+        self,
+        context_tokens: int = AZURE_OPENAI_CONTEXT_TOKENS,
+        prompt_budget: int = CONTEXT_PROMPT_TOKEN_BUDGET,
+        safety_margin: int = CONTEXT_SAFETY_MARGIN_TOKENS,
+        summary_enabled: bool = CONTEXT_SUMMARY_ENABLED,
+        summary_max_tokens: int = CONTEXT_SUMMARY_MAX_TOKENS,
+        summarizer: Callable[[List, int], str] = extractive_summary,
+    ):
+        self.context_tokens = context_tokens
+        self.prompt_budget = prompt_budget
+        self.safety_margin = safety_margin
+        self.summary_enabled = summary_enabled
+        self.summary_max_tokens = summary_max_tokens
+        self.summarizer = summarizer
+
+    def budget_for(self, max_tokens: Optional[int]) -> int:
+        """プロンプトに使えるトークン数（応答分を差し引く）"""
+        budget = self.context_tokens - (max_tokens or 0) - self.safety_margin
+        if self.prompt_budget:
+            budget = min(budget, self.prompt_budget)
+        return max(budget, 0)
+
+    def trim(self, messages: List, system_prompt: Optional[str], max_tokens: Optional[int]) -> TrimResult:
+        """予算を超える古いメッセージを削除（最新のメッセージは必ず残す）"""
+        fixed = REPLY_PRIMING_TOKENS
+        if system_prompt:
+            fixed += message_tokens("system", system_prompt)
+        costs = [message_tokens(msg.role, msg.content) for msg in messages]
+        total = fixed + sum(costs)
+        budget = self.budget_for(max_tokens)
+        if total <= budget or len(messages) <= 1:
+            return TrimResult(list(messages), None, total, total, 0)
+
+        available = budget - fixed
+        if self.summary_enabled:
+            available -= self.summary_max_tokens + MESSAGE_OVERHEAD_TOKENS
+
+        # 新しい順に予算内で残す
+        keep_from = len(messages) - 1
+        used = costs[-1]
+        while keep_from > 0 and used + costs[keep_from - 1] <= available:
+            keep_from -= 1
+            used += costs[keep_from]
+        # 残す範囲がアシスタント発言から始まらないようにする
+        while keep_from < len(messages) - 1 and messages[keep_from].role == "assistant":
+            used -= costs[keep_from]
+            keep_from += 1
+
+        dropped = list(messages[:keep_from])
+        summary = None
+        after = fixed + used
+        if self.summary_enabled and dropped:
+            body = self.summarizer(dropped, self.summary_max_tokens)
+            if body:
+                summary = SUMMARY_PREFIX + body
+                after += message_tokens("system", summary)
+        return TrimResult(list(messages[keep_from:]), summary, total, after, len(dropped))
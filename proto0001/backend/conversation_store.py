@@ -0,0 +1,143 @@
+# -------------------------------------------------
+# ・ファイル名：conversation_store.py
+# ・ファイル内容：会話スレッドのトランスクリプト（サーバー側で保持し、毎ターン差分で更新）
+# ・作成日時：2026/10/19 08:00:00  agent
+# -------------------------------------------------
+#
+# クライアントは会話 ID と新しいメッセージだけを送り、過去のやり取りはここから組み立てる。
+# トランスクリプトはプロセス内にキャッシュし、応答の度に 1 往復分を追加する（DB は読み直さない）。
+# 他のワーカーで会話が進んだ場合は conversations.turn_count がキャッシュより大きくなるので、
+# その時だけ chat_history から読み直す。履歴の書き込みは非同期なので、キャッシュが DB より
+# 先に進んでいる状態（turn_count がキャッシュ以下）は正常とみなす。
+
+import os
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from azure_openai_client import ChatMessage
+from database import fetch_all, fetch_one
+from response_cache import ResponseCache
+
+# 会話スレッド設定
+CONVERSATION_CACHE_MAX_ENTRIES = int(os.getenv("CONVERSATION_CACHE_MAX_ENTRIES", "5000"))
+CONVERSATION_CACHE_TTL_SECONDS = float(os.getenv("CONVERSATION_CACHE_TTL_SECONDS", "3600"))
+# 保持する直近の往復数（古いものはコンテキストウィンドウで要約・削除される前提）
+CONVERSATION_MAX_TURNS = int(os.getenv("CONVERSATION_MAX_TURNS", "50"))
+CONVERSATION_TITLE_CHARS = int(os.getenv("CONVERSATION_TITLE_CHARS", "50"))
+
+FetchOne = Callable[[str, Optional[Sequence]], Awaitable[Optional[Dict[str, Any]]]]
+FetchAll = Callable[[str, Optional[Sequence]], Awaitable[List[Dict[str, Any]]]]
+
+@dataclass
+class Transcript:
+    """1 つの会話の直近のやり取り"""
+    conversation_id: int
+    username: str
+    system_prompt: Optional[str]
+    # (ユーザーメッセージ, アシスタントの応答) の直近 CONVERSATION_MAX_TURNS 往復
+    turns: Deque[Tuple[str, str]] = field(default_factory=deque)
+    # 会話全体の往復数（turns に残っていない古いものを含む）
+    turn_count: int = 0
+
+    def messages(self, new_message: Optional[str] = None) -> List[ChatMessage]:
+        """ChatRequest.messages 用のメッセージ列（new_message を末尾のユーザーメッセージとして追加）
+
+        保存済みの内容から組み立てるため、Pydantic の検証は行わない。
+        """
+        messages = []
+        for user_message, assistant_message in self.turns:
+            messages.append(ChatMessage.model_construct(role="user", content=user_message, timestamp=None))
+            messages.append(ChatMessage.model_construct(role="assistant", content=assistant_message, timestamp=None))
+        if new_message is not None:
+            messages.append(ChatMessage.model_construct(role="user", content=new_message, timestamp=None))
+        return messages
+
+def conversation_title(message: str, max_chars: int = CONVERSATION_TITLE_CHARS) -> str:
+    """最初のメッセージから会話のタイトルを作る"""
+    title = " ".join(message.split())
+    return title if len(title) <= max_chars else title[:max_chars - 1] + "…"
+
+class ConversationStore:
+    """会話のトランスクリプトのキャッシュ（所有者と turn_count は毎回 DB の conversations で確認する）"""
+
+    def __init__(
+        self,
+        max_entries: int = CONVERSATION_CACHE_MAX_ENTRIES,
+        ttl: float = CONVERSATION_CACHE_TTL_SECONDS,
+        max_turns: int = CONVERSATION_MAX_TURNS,
+        fetch_one: FetchOne = fetch_one,
+        fetch_all: FetchAll = fetch_all,
+    ):
+        self.cache = ResponseCache(max_entries=max_entries, ttl=ttl)
+        self.max_turns = max_turns
+        self._fetch_one = fetch_one
+        self._fetch_all = fetch_all
+
+        # 統計情報
+        self._reloads = 0
+        self._appended = 0
+
+    async def get(self, conversation_id: int, username: str) -> Optional[Transcript]:
+        """会話のトランスクリプト（存在しない・他のユーザーの会話なら None）"""
+        meta = await self._fetch_one(
+            "SELECT system_prompt, turn_count FROM conversations WHERE id = %s AND username = %s",
+            (conversation_id, username),
+        )
+        if meta is None:
+            return None
+        transcript = self.cache.get(conversation_id)
+        if transcript is not None and transcript.username == username and transcript.turn_count >= meta["turn_count"]:
+            return transcript
+
+        # 未キャッシュ、または他のワーカーで会話が進んだ
+        self._reloads += 1
+        rows = await self._fetch_all("""
+            SELECT user_message, assistant_message
+            FROM chat_history
+            WHERE conversation_id = %s
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """, (conversation_id, self.max_turns))
+        transcript = Transcript(
+            conversation_id=conversation_id,
+            username=username,
+            system_prompt=meta["system_prompt"],
+            turns=deque(((row["user_message"], row["assistant_message"]) for row in reversed(rows)),
+                        maxlen=self.max_turns),
+            turn_count=max(meta["turn_count"], len(rows)),
+        )
+        self.cache.set(conversation_id, transcript)
+        return transcript
+
+    def append(self, transcript: Transcript, user_message: str, assistant_message: str):
+        """1 往復分を追加（履歴の保存と同時に呼ぶ）"""
+        transcript.turns.append((user_message, assistant_message))
+        transcript.turn_count += 1
+        self._appended += 1
+        self.cache.set(transcript.conversation_id, transcript)
+
+    def evict(self, conversation_id: int):
+        self.cache.delete(conversation_id)
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """トランスクリプトのキャッシュの統計情報"""
+        return {
+            **self.cache.stats(),
+            "reloads": self._reloads,
+            "appended_turns": self._appended,
+            "max_turns": self.max_turns,
+        }
+
+# グローバルインスタンス
+_conversation_store: Optional[ConversationStore] = None
+
+def get_conversation_store() -> ConversationStore:
+    """会話ストアのシングルトンインスタンスを取得"""
+    global _conversation_store
+    if _conversation_store is None:
+        _conversation_store = ConversationStore()
+    return _conversation_store
@@ -3,10 +3,42 @@
 # ・ファイル内容：PostgreSQL データベース接続設定
 # ・作成日時：2025/07/06 17:56:00  Claude Code
 # -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/18 10:00:00  更新者：agent
+# ・更新内容：コネクションプールの追加
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/18 11:00:00  更新者：agent
+# ・更新内容：イベントループを塞がない非同期アクセス関数の追加
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/19 05:00:00  更新者：agent
+# ・更新内容：DB アクセスの所要時間をメトリクスに記録
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/19 06:00:00  更新者：agent
+# ・更新内容：DB アクセス毎にトレースの子スパンを作成
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/19 08:00:00  更新者：agent
+# ・更新内容：RETURNING 付きの更新系クエリ用の関数を追加
+# -------------------------------------------------
 
 import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor
+import asyncio
 import os
-from typing import Optional
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional, Callable, Dict, Any, List, Sequence, TypeVar
+from metrics import observe_db_query
+from tracing import get_tracer
+
+T = TypeVar("T")
 
 # データベース接続設定
 DATABASE_CONFIG = {
@@ -17,6 +49,17 @@ DATABASE_CONFIG = {
     "port": os.getenv("DB_PORT", "5432"),
 }
 
+# コネクションプール設定
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5.0"))
+DB_POOL_MAX_USES = int(os.getenv("DB_POOL_MAX_USES", "1000"))
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))
+DB_POOL_HEALTH_CHECK_IDLE = float(os.getenv("DB_POOL_HEALTH_CHECK_IDLE", "5"))
+
+# 非同期アクセス用ワーカースレッド数（プール上限と揃えると接続待ちが発生しない）
+DB_EXECUTOR_MAX_WORKERS = int(os.getenv("DB_EXECUTOR_MAX_WORKERS", str(DB_POOL_MAX_SIZE)))
+
 def get_db_connection():
     """PostgreSQL データベースへの接続を取得"""
     try:
@@ -26,6 +69,363 @@ def get_db_connection():
         print(f"データベース接続エラー: {e}")
         raise
 
+class PoolTimeoutError(Exception):
+    """コネクションの貸し出し待ちがタイムアウトした"""
+
+class _PooledConnection:
+    """プール内の接続と利用状況"""
+    __slots__ = ("conn", "created_at", "last_used", "uses")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+        self.uses = 0
+
+class ConnectionPool:
+    """スレッドセーフな PostgreSQL コネクションプール
+
+    貸し出し時に一定時間アイドルだった接続は SELECT 1 で検査し、
+    使用回数またはアイドル時間が上限を超えた接続は破棄して作り直す。
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Any] = get_db_connection,
+        min_size: int = DB_POOL_MIN_SIZE,
+        max_size: int = DB_POOL_MAX_SIZE,
+        timeout: float = DB_POOL_TIMEOUT,
+        max_uses: int = DB_POOL_MAX_USES,
+        max_idle: float = DB_POOL_MAX_IDLE,
+        health_check_idle: float = DB_POOL_HEALTH_CHECK_IDLE,
+    ):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError("コネクションプールのサイズ設定が不正です")
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_uses = max_uses
+        self.max_idle = max_idle
+        self.health_check_idle = health_check_idle
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._in_use: Dict[int, _PooledConnection] = {}
+        self._size = 0
+        self._waiting = 0
+        self._closed = False
+
+        # 統計情報
+        self._checkouts = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._recycled = 0
+        self._health_check_failures = 0
+
+    def open(self):
+        """最小サイズまで接続を作成"""
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            record = self._create()
+            with self._cond:
+                self._idle.append(record)
+                self._cond.notify()
+
+    def _create(self) -> _PooledConnection:
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._created += 1
+        return _PooledConnection(conn)
+
+    def _discard(self, record: _PooledConnection):
+        try:
+            record.conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._recycled += 1
+            self._cond.notify()
+
+    def _is_expired(self, record: _PooledConnection, now: float) -> bool:
+        if getattr(record.conn, "closed", 0):
+            return True
+        if self.max_uses and record.uses >= self.max_uses:
+            return True
+        if self.max_idle and now - record.last_used > self.max_idle:
+            return True
+        return False
+
+    def _is_healthy(self, record: _PooledConnection, now: float) -> bool:
+        if now - record.last_used < self.health_check_idle:
+            return True
+        try:
+            cursor = record.conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            record.conn.rollback()
+            return True
+        except Exception:
+            with self._cond:
+                self._health_check_failures += 1
+            return False
+
+    def getconn(self, timeout: Optional[float] = None):
+        """プールから接続を借りる"""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        while True:
+            record = None
+            create = False
+            with self._cond:
+                if self._closed:
+                    raise PoolTimeoutError("コネクションプールはクローズされています")
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(
+                            f"{timeout:.1f}秒以内にデータベース接続を取得できませんでした"
+                        )
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+                if self._idle:
+                    record = self._idle.pop()
+                else:
+                    self._size += 1
+                    create = True
+
+            now = time.monotonic()
+            if create:
+                record = self._create()
+            elif self._is_expired(record, now) or not self._is_healthy(record, now):
+                self._discard(record)
+                continue
+
+            record.uses += 1
+            waited = time.monotonic() - started
+            with self._cond:
+                self._in_use[id(record.conn)] = record
+                self._checkouts += 1
+                self._wait_time_total += waited
+                self._wait_time_max = max(self._wait_time_max, waited)
+            return record.conn
+
+    def putconn(self, conn, discard: bool = False):
+        """接続をプールへ返却"""
+        with self._cond:
+            record = self._in_use.pop(id(conn), None)
+        if record is None:
+            return
+
+        if not discard and not getattr(conn, "closed", 0):
+            try:
+                # 未完了のトランザクションは巻き戻してから再利用する
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            reuse = not discard and not self._closed and not self._is_expired(record, time.monotonic())
+            if reuse:
+                record.last_used = time.monotonic()
+                self._idle.append(record)
+                self._cond.notify()
+                return
+        self._discard(record)
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None):
+        """接続を借りて、ブロックを抜けたら返却するコンテキストマネージャ"""
+        conn = self.getconn(timeout)
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def stats(self) -> Dict[str, Any]:
+        """プールの統計情報"""
+        with self._cond:
+            checkouts = self._checkouts
+            return {
+                "size": self._size,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "checkouts": checkouts,
+                "wait_time_total": round(self._wait_time_total, 6),
+                "wait_time_avg": round(self._wait_time_total / checkouts, 6) if checkouts else 0.0,
+                "wait_time_max": round(self._wait_time_max, 6),
+                "timeouts": self._timeouts,
+                "connections_created": self._created,
+                "connections_recycled": self._recycled,
+                "health_check_failures": self._health_check_failures,
+            }
+
+    def close(self):
+        """アイドル接続をすべてクローズ（貸し出し中の接続は返却時にクローズ）"""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+        for record in idle:
+            self._discard(record)
+
+# グローバルインスタンス
+_connection_pool: Optional[ConnectionPool] = None
+_connection_pool_lock = threading.Lock()
+
+def get_connection_pool() -> ConnectionPool:
+    """コネクションプールのシングルトンインスタンスを取得"""
+    global _connection_pool
+    if _connection_pool is None:
+        with _connection_pool_lock:
+            if _connection_pool is None:
+                _connection_pool = ConnectionPool()
+    return _connection_pool
+
+def close_connection_pool():
+    """コネクションプールを破棄"""
+    global _connection_pool
+    with _connection_pool_lock:
+        if _connection_pool is not None:
+            _connection_pool.close()
+            _connection_pool = None
+
+@contextmanager
+def db_connection():
+    """プールから接続を借りるコンテキストマネージャ"""
+    with get_connection_pool().connection() as conn:
+        yield conn
+
+def get_db():
+    """FastAPI の依存関係として使うプール接続"""
+    with db_connection() as conn:
+        yield conn
+
+# 非同期アクセス
+_db_executor: Optional[ThreadPoolExecutor] = None
+
+def get_db_executor() -> ThreadPoolExecutor:
+    """DB アクセス専用のスレッドプールを取得"""
+    global _db_executor
+    if _db_executor is None:
+        with _connection_pool_lock:
+            if _db_executor is None:
+                _db_executor = ThreadPoolExecutor(
+                    max_workers=DB_EXECUTOR_MAX_WORKERS,
+                    thread_name_prefix="db",
+                )
+    return _db_executor
+
+def close_db_executor():
+    """DB アクセス専用のスレッドプールを停止"""
+    global _db_executor
+    with _connection_pool_lock:
+        if _db_executor is not None:
+            _db_executor.shutdown(wait=True)
+            _db_executor = None
+
+async def run_in_db(func: Callable[[Any], T], operation: str = "query", statement: Optional[str] = None) -> T:
+    """プール接続を受け取る同期処理をワーカースレッドで実行（所要時間を operation 毎に記録）"""
+    def task():
+        with db_connection() as conn:
+            return func(conn)
+
+    loop = asyncio.get_running_loop()
+    attributes = {"db.system": "postgresql", "db.operation": operation}
+    if statement:
+        attributes["db.statement"] = " ".join(statement.split())[:500]
+    with get_tracer().span(f"db.{operation}", attributes):
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(get_db_executor(), task)
+        finally:
+            observe_db_query(operation, time.perf_counter() - started)
+
+async def fetch_one(query: str, params: Optional[Sequence] = None) -> Optional[Dict[str, Any]]:
+    """1 行を辞書形式（RealDictCursor）で取得"""
+    def task(conn):
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            cursor.execute(query, params)
+            return cursor.fetchone()
+        finally:
+            cursor.close()
+
+    return await run_in_db(task, "fetch_one", query)
+
+async def fetch_all(query: str, params: Optional[Sequence] = None) -> List[Dict[str, Any]]:
+    """全行を辞書形式（RealDictCursor）で取得"""
+    def task(conn):
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    return await run_in_db(task, "fetch_all", query)
+
+async def execute(query: str, params: Optional[Sequence] = None) -> int:
+    """更新系クエリを実行してコミットし、影響行数を返す"""
+    def task(conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query, params)
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            cursor.close()
+
+    return await run_in_db(task, "execute", query)
+
+async def execute_returning(query: str, params: Optional[Sequence] = None) -> Optional[Dict[str, Any]]:
+    """RETURNING 付きの更新系クエリを実行してコミットし、1 行目を辞書形式で返す"""
+    def task(conn):
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            cursor.execute(query, params)
+            row = cursor.fetchone()
+            conn.commit()
+            return row
+        finally:
+            cursor.close()
+
+    return await run_in_db(task, "execute_returning", query)
+
 def test_connection() -> bool:
     """データベース接続をテスト"""
     try:
@@ -38,4 +438,4 @@ def test_connection() -> bool:
         return result is not None
     except Exception as e:
         print(f"データベース接続テストエラー: {e}")
-        return False
\ No newline at end of file
+        return False
@@ -0,0 +1,248 @@
+# -------------------------------------------------
+# ・ファイル名：deployment_pool.py
+# ・ファイル内容：複数の Azure OpenAI デプロイメントへの負荷分散
+# ・作成日時：2026/10/18 22:00:00  agent
+# -------------------------------------------------
+
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Collection, Dict, List, Optional, TypeVar
+
+import httpx
+from openai import AsyncAzureOpenAI, RateLimitError
+from rate_limiter import RateLimiter, RateLimitExceeded, get_rate_limiter, retry_after_seconds
+from resilience import CircuitBreaker, get_circuit_breaker, is_upstream_failure
+
+# 負荷分散設定
+# 例: [{"name": "east", "endpoint": "https://east.openai.azure.com/", "api_key": "...", "deployment": "gpt-35-turbo",
+#       "weight": 1, "rpm": 300, "tpm": 50000}]
+AZURE_OPENAI_DEPLOYMENTS = os.getenv("AZURE_OPENAI_DEPLOYMENTS", "")
+AZURE_OPENAI_ROUTING = os.getenv("AZURE_OPENAI_ROUTING", "least_outstanding")
+AZURE_OPENAI_EJECTION_SECONDS = float(os.getenv("AZURE_OPENAI_EJECTION_SECONDS", "30"))
+AZURE_OPENAI_LATENCY_EWMA_ALPHA = float(os.getenv("AZURE_OPENAI_LATENCY_EWMA_ALPHA", "0.2"))
+
+ROUTING_STRATEGIES = ("least_outstanding", "latency")
+
+T = TypeVar("T")
+
+@dataclass
+class DeploymentConfig:
+    """1 つのデプロイメント（エンドポイント・キー・デプロイメント名）"""
+    name: str
+    endpoint: str
+    api_key: str
+    deployment: str
+    api_version: str
+    weight: float = 1.0
+    rpm: Optional[int] = None
+    tpm: Optional[int] = None
+
+def load_deployment_configs(raw: str, default_api_version: str) -> List[DeploymentConfig]:
+    """AZURE_OPENAI_DEPLOYMENTS（JSON 配列）を読み込む"""
+    try:
+        entries = json.loads(raw)
+    except ValueError as e:
+        raise ValueError(f"AZURE_OPENAI_DEPLOYMENTS の JSON が正しくありません: {str(e)}")
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("AZURE_OPENAI_DEPLOYMENTS には 1 件以上のデプロイメントを指定してください")
+
+    configs = []
+    for index, entry in enumerate(entries):
+        if not entry.get("endpoint") or not entry.get("api_key") or not entry.get("deployment"):
+            raise ValueError(f"AZURE_OPENAI_DEPLOYMENTS[{index}] に endpoint・api_key・deployment がありません")
+        weight = float(entry.get("weight", 1.0))
+        if weight <= 0:
+            raise ValueError(f"AZURE_OPENAI_DEPLOYMENTS[{index}] の weight は正の数を指定してください")
+        configs.append(DeploymentConfig(
+            name=entry.get("name") or f"{entry['deployment']}@{index}",
+            endpoint=entry["endpoint"],
+            api_key=entry["api_key"],
+            deployment=entry["deployment"],
+            api_version=entry.get("api_version") or default_api_version,
+            weight=weight,
+            rpm=entry.get("rpm"),
+            tpm=entry.get("tpm"),
+        ))
+    return configs
+
+class Deployment:
+    """デプロイメント 1 つ分のクライアントと、レート制限・ブレーカー・統計"""
+
+    def __init__(
+        self,
+        config: DeploymentConfig,
+        http_client: httpx.AsyncClient,
+        rate_limiter: Optional[RateLimiter] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        ejection_seconds: float = AZURE_OPENAI_EJECTION_SECONDS,
+        ewma_alpha: float = AZURE_OPENAI_LATENCY_EWMA_ALPHA,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.config = config
+        self.name = config.name
+        self.client = AsyncAzureOpenAI(
+            azure_endpoint=config.endpoint,
+            api_key=config.api_key,
+            api_version=config.api_version,
+            http_client=http_client,
+            # リトライは呼び出し側で行い、429 はレート制限側で待ち合わせる
+            max_retries=0,
+        )
+        self.rate_limiter = (
+            rate_limiter if rate_limiter is not None
+            else get_rate_limiter(config.name, config.rpm, config.tpm)
+        )
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None else get_circuit_breaker(config.name)
+        self.ejection_seconds = ejection_seconds
+        self.ewma_alpha = ewma_alpha
+        self._clock = clock
+
+        self.outstanding = 0
+        self.latency_ewma: Optional[float] = None
+        self._ejected_until = 0.0
+
+        # 統計情報
+        self._requests = 0
+        self._failures = 0
+        self._throttled = 0
+        self._ejections = 0
+
+    @property
+    def ejected(self) -> bool:
+        return self._clock() < self._ejected_until
+
+    @property
+    def available(self) -> bool:
+        """振り分け対象か（一時除外中・ブレーカーが開いている間は対象外）"""
+        if self.ejected:
+            return False
+        return self.circuit_breaker is None or self.circuit_breaker.state != CircuitBreaker.OPEN
+
+    def eject(self, seconds: Optional[float] = None):
+        """429/5xx を返したデプロイメントをしばらく振り分けから外す"""
+        self._ejections += 1
+        until = self._clock() + (self.ejection_seconds if seconds is None else seconds)
+        self._ejected_until = max(self._ejected_until, until)
+
+    def _observe_latency(self, seconds: float):
+        if self.latency_ewma is None:
+            self.latency_ewma = seconds
+        else:
+            self.latency_ewma += self.ewma_alpha * (seconds - self.latency_ewma)
+
+    def record_error(self, exc: BaseException):
+        """呼び出し後（ストリームの途中を含む）のエラーを記録"""
+        if isinstance(exc, RateLimitError):
+            self._throttled += 1
+            if self.rate_limiter is not None:
+                self.rate_limiter.update_from_headers(exc.response.headers)
+            self.eject(retry_after_seconds(exc.response.headers))
+        elif isinstance(exc, Exception) and is_upstream_failure(exc):
+            self._failures += 1
+            self.eject()
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_outcome(exc)
+
+    async def call(self, operation: Callable[["Deployment", int], Awaitable[T]], estimated_tokens: int,
+                   max_wait: Optional[float] = None, hold: bool = False) -> T:
+        """operation(self, 見積もりトークン数) を送信枠を確保して実行
+
+        hold=True の場合、成功後も処理中の件数に数えたままにする（ストリームの受信中など）。
+        呼び出し元は受信を終えたら release() を呼ぶ。
+        """
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.before_call()
+        try:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire(estimated_tokens, max_wait)
+        except BaseException as e:
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.record_outcome(e)
+            raise
+
+        self._requests += 1
+        self.outstanding += 1
+        started = self._clock()
+        try:
+            result = await operation(self, estimated_tokens)
+        except RateLimitError as e:
+            self.record_error(e)
+            self.outstanding -= 1
+            retry_after = retry_after_seconds(e.response.headers)
+            raise RateLimitExceeded("Azure OpenAI のレート制限に達しました", retry_after or 1.0)
+        except BaseException as e:
+            self.record_error(e)
+            self.outstanding -= 1
+            raise
+        self._observe_latency(self._clock() - started)
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_outcome(None)
+        if not hold:
+            self.outstanding -= 1
+        return result
+
+    def release(self):
+        """hold=True で実行した呼び出しの終了"""
+        self.outstanding -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """デプロイメント毎の統計情報"""
+        return {
+            "endpoint": self.config.endpoint,
+            "deployment": self.config.deployment,
+            "weight": self.config.weight,
+            "available": self.available,
+            "ejected_for": round(max(self._ejected_until - self._clock(), 0.0), 3),
+            "outstanding": self.outstanding,
+            "latency_ewma_ms": round(self.latency_ewma * 1000, 3) if self.latency_ewma is not None else None,
+            "requests": self._requests,
+            "failures": self._failures,
+            "throttled": self._throttled,
+            "ejections": self._ejections,
+            "rate_limit": self.rate_limiter.stats() if self.rate_limiter else None,
+            "circuit_breaker": self.circuit_breaker.stats() if self.circuit_breaker else None,
+        }
+
+class DeploymentPool:
+    """リクエスト毎に振り分け先のデプロイメントを選ぶ
+
+    least_outstanding: 重みあたりの処理中件数が最も少ないもの（同数なら応答が速いもの）
+    latency: 応答時間の EWMA ×（処理中件数 + 1）÷ 重み が最も小さいもの
+    """
+
+    def __init__(self, deployments: List[Deployment], routing: str = AZURE_OPENAI_ROUTING):
+        if not deployments:
+            raise ValueError("デプロイメントが 1 件もありません")
+        if routing not in ROUTING_STRATEGIES:
+            raise ValueError(f"AZURE_OPENAI_ROUTING は {ROUTING_STRATEGIES} のいずれかを指定してください")
+        self.deployments = deployments
+        self.routing = routing
+
+    def __len__(self) -> int:
+        return len(self.deployments)
+
+    def _score(self, deployment: Deployment):
+        latency = deployment.latency_ewma or 0.0
+        if self.routing == "latency":
+            return (latency * (deployment.outstanding + 1) / deployment.config.weight, deployment.outstanding)
+        return (deployment.outstanding / deployment.config.weight, latency)
+
+    def candidates(self, exclude: Collection[str] = ()) -> List[Deployment]:
+        """振り分け可能なデプロイメント"""
+        return [d for d in self.deployments if d.available and d.name not in exclude]
+
+    def select(self, exclude: Collection[str] = ()) -> Deployment:
+        """振り分け先を選ぶ（全て除外中なら、除外対象外の中から選ぶ）"""
+        candidates = self.candidates(exclude)
+        if not candidates:
+            candidates = [d for d in self.deployments if d.name not in exclude] or self.deployments
+        return min(candidates, key=self._score)
+
+    def stats(self) -> Dict[str, Any]:
+        """振り分け方式とデプロイメント毎の統計情報"""
+        return {
+            "routing": self.routing,
+            "deployments": {d.name: d.stats() for d in self.deployments},
+        }
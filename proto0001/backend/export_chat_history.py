@@ -0,0 +1,63 @@
+# -------------------------------------------------
+# ・ファイル名：export_chat_history.py
+# ・ファイル内容：チャット履歴の一括エクスポート（コマンドライン）
+# ・作成日時：2026/10/19 10:00:00  agent
+# -------------------------------------------------
+#
+# 使い方:
+#   # 全ユーザー分を NDJSON で標準出力へ
+#   python export_chat_history.py > chat_history.ndjson
+#
+#   # ユーザー・期間を絞って gzip 圧縮した CSV をファイルへ
+#   python export_chat_history.py --user alice --user bob --since 2026-10-01 --until 2026-11-01 \
+#       --format csv --gzip --output chat_history.csv.gz
+#
+# API の /chat/history/export と同じ処理（CSV は COPY TO、NDJSON はサーバー側カーソル）で、
+# 行数に関わらずメモリ使用量は一定。API と違い、任意のユーザーを指定できる。
+# NDJSON の最後の行は {"_export": "complete", "rows": 行数}（途中で失敗した場合は "incomplete"）。
+# CSV には末尾の印が無いため、途中で失敗した場合は終了コード 1 で判断する（--gzip なら
+# 途中切れのファイルは展開時にエラーになる）。
+
+import argparse
+import sys
+import time
+from datetime import datetime
+
+from database import get_db_connection
+from history_export import EXPORT_FETCH_SIZE, EXPORT_FORMATS, ChunkSink, ExportFilter, write_export
+
+def run(args):
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    conn = get_db_connection()
+    try:
+        started = time.perf_counter()
+        sink = ChunkSink(output.write, args.gzip)
+        export_filter = ExportFilter(usernames=args.user or (), since=args.since, until=args.until)
+        try:
+            rows = write_export(conn, sink, args.format, export_filter, args.fetch_size)
+        except Exception:
+            # NDJSON は incomplete の行まで書き出す（CSV の gzip は途中切れのまま残す）
+            if args.format == "ndjson":
+                sink.close()
+                output.flush()
+            raise
+        sink.close()
+        output.flush()
+        count = f"{rows:,} 行, " if rows >= 0 else ""
+        print(f"エクスポート完了: {count}{sink.bytes_in:,} バイト（圧縮前）, "
+              f"{time.perf_counter() - started:.1f} 秒", file=sys.stderr)
+    finally:
+        conn.close()
+        if args.output:
+            output.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="チャット履歴の一括エクスポート")
+    parser.add_argument("--user", action="append", help="対象のユーザー（複数指定可、省略時は全ユーザー）")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="この日時以降（ISO 8601）")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="この日時より前（ISO 8601）")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+    parser.add_argument("--gzip", action="store_true", help="gzip で圧縮する")
+    parser.add_argument("--output", help="出力先のファイル（省略時は標準出力）")
+    parser.add_argument("--fetch-size", type=int, default=EXPORT_FETCH_SIZE, help="NDJSON で 1 回に読む行数")
+    run(parser.parse_args())
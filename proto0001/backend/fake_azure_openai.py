@@ -0,0 +1,202 @@
+# -------------------------------------------------
+# ・ファイル名：fake_azure_openai.py
+# ・ファイル内容：負荷試験・ベンチマーク用の Azure OpenAI 擬似サーバー
+# ・作成日時：2026/10/18 13:00:00  agent
+# -------------------------------------------------
+#
+# 使い方:
+#   python fake_azure_openai.py --port 8100 --ttft-ms 300 --tokens-per-sec 50
+#   AZURE_OPENAI_ENDPOINT=http://localhost:8100 AZURE_OPENAI_API_KEY=dummy uvicorn main:app
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from dataclasses import dataclass, asdict
+from typing import List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# 応答として返す文章（トークン単位に分割して返す）
+DEFAULT_RESPONSE_TEXT = (
+    "これはローカルの擬似 Azure OpenAI サーバーからの応答です。"
+    "負荷試験とベンチマークのために、一定の速度でトークンを返します。"
+)
+
+@dataclass
+class FakeServerConfig:
+    """擬似サーバーの挙動設定"""
+    latency_ms: float = float(os.getenv("FAKE_AOAI_LATENCY_MS", "500"))
+    ttft_ms: float = float(os.getenv("FAKE_AOAI_TTFT_MS", "200"))
+    tokens_per_sec: float = float(os.getenv("FAKE_AOAI_TOKENS_PER_SEC", "50"))
+    response_tokens: int = int(os.getenv("FAKE_AOAI_RESPONSE_TOKENS", "40"))
+    error_rate: float = float(os.getenv("FAKE_AOAI_ERROR_RATE", "0"))
+    rate_limit_rate: float = float(os.getenv("FAKE_AOAI_RATE_LIMIT_RATE", "0"))
+    retry_after: float = float(os.getenv("FAKE_AOAI_RETRY_AFTER", "1"))
+    rpm_limit: int = int(os.getenv("FAKE_AOAI_RPM_LIMIT", "0"))
+    seed: Optional[int] = None
+
+def split_tokens(text: str, count: int) -> List[str]:
+    """文章を擬似トークン（2 文字単位）に分割し count 個に揃える"""
+    pieces = [text[i:i + 2] for i in range(0, len(text), 2)]
+    tokens = []
+    while len(tokens) < count:
+        tokens.extend(pieces)
+    return tokens[:count]
+
+def estimate_prompt_tokens(messages: List[dict]) -> int:
+    """プロンプトトークン数の概算"""
+    return sum(len(str(m.get("content", ""))) // 2 + 4 for m in messages)
+
+def create_app(config: Optional[FakeServerConfig] = None) -> FastAPI:
+    """擬似サーバーのアプリケーションを作成"""
+    config = config or FakeServerConfig()
+    rng = random.Random(config.seed)
+    app = FastAPI(title="Fake Azure OpenAI", version="1.0.0")
+    app.state.config = config
+    app.state.stats = {"requests": 0, "streams": 0, "errors": 0, "rate_limited": 0}
+    window: List[float] = []
+
+    def rate_limit_headers() -> dict:
+        headers = {}
+        if config.rpm_limit:
+            headers["x-ratelimit-limit-requests"] = str(config.rpm_limit)
+            headers["x-ratelimit-remaining-requests"] = str(max(0, config.rpm_limit - len(window)))
+        return headers
+
+    def rate_limited() -> bool:
+        # 確率的な 429 と、RPM 上限による 429
+        if config.rate_limit_rate and rng.random() < config.rate_limit_rate:
+            return True
+        if config.rpm_limit:
+            now = time.monotonic()
+            while window and now - window[0] > 60:
+                window.pop(0)
+            if len(window) >= config.rpm_limit:
+                return True
+            window.append(now)
+        return False
+
+    def chunk_event(completion_id: str, model: str, delta: dict, finish_reason=None) -> str:
+        body = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(body, ensure_ascii=False)}\n\n"
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok", "config": asdict(config), "stats": app.state.stats}
+
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def chat_completions(deployment: str, request: Request):
+        body = await request.json()
+        app.state.stats["requests"] += 1
+
+        if rate_limited():
+            app.state.stats["rate_limited"] += 1
+            headers = rate_limit_headers()
+            headers["retry-after"] = str(config.retry_after)
+            headers["retry-after-ms"] = str(int(config.retry_after * 1000))
+            return JSONResponse(
+                status_code=429,
+                content={"error": {"code": "429", "message": "Rate limit is exceeded."}},
+                headers=headers,
+            )
+        if config.error_rate and rng.random() < config.error_rate:
+            app.state.stats["errors"] += 1
+            return JSONResponse(
+                status_code=500,
+                content={"error": {"code": "500", "message": "Injected server error."}},
+            )
+
+        messages = body.get("messages", [])
+        max_tokens = body.get("max_tokens") or config.response_tokens
+        tokens = split_tokens(DEFAULT_RESPONSE_TEXT, min(config.response_tokens, max_tokens))
+        prompt_tokens = estimate_prompt_tokens(messages)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        }
+
+        if not body.get("stream"):
+            await asyncio.sleep(config.latency_ms / 1000)
+            return JSONResponse(
+                content={
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": deployment,
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "".join(tokens)},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": usage,
+                },
+                headers=rate_limit_headers(),
+            )
+
+        app.state.stats["streams"] += 1
+        interval = 1 / config.tokens_per_sec if config.tokens_per_sec > 0 else 0
+
+        async def stream():
+            # Azure と同様に、先頭はコンテンツフィルター結果のみのチャンク
+            prompt_filter = {"id": "", "object": "", "created": 0, "model": "", "choices": [], "prompt_filter_results": []}
+            yield f"data: {json.dumps(prompt_filter)}\n\n"
+            await asyncio.sleep(config.ttft_ms / 1000)
+            yield chunk_event(completion_id, deployment, {"role": "assistant", "content": ""})
+            for index, token in enumerate(tokens):
+                if index and interval:
+                    await asyncio.sleep(interval)
+                yield chunk_event(completion_id, deployment, {"content": token})
+            yield chunk_event(completion_id, deployment, {}, finish_reason="stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream", headers=rate_limit_headers())
+
+    return app
+
+app = create_app()
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Azure OpenAI 擬似サーバー")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-ms", type=float, default=FakeServerConfig.latency_ms)
+    parser.add_argument("--ttft-ms", type=float, default=FakeServerConfig.ttft_ms)
+    parser.add_argument("--tokens-per-sec", type=float, default=FakeServerConfig.tokens_per_sec)
+    parser.add_argument("--response-tokens", type=int, default=FakeServerConfig.response_tokens)
+    parser.add_argument("--error-rate", type=float, default=FakeServerConfig.error_rate)
+    parser.add_argument("--rate-limit-rate", type=float, default=FakeServerConfig.rate_limit_rate)
+    parser.add_argument("--retry-after", type=float, default=FakeServerConfig.retry_after)
+    parser.add_argument("--rpm-limit", type=int, default=FakeServerConfig.rpm_limit)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    uvicorn.run(
+        create_app(FakeServerConfig(
+            latency_ms=args.latency_ms,
+            ttft_ms=args.ttft_ms,
+            tokens_per_sec=args.tokens_per_sec,
+            response_tokens=args.response_tokens,
+            error_rate=args.error_rate,
+            rate_limit_rate=args.rate_limit_rate,
+            retry_after=args.retry_after,
+            rpm_limit=args.rpm_limit,
+            seed=args.seed,
+        )),
+        host=args.host,
+        port=args.port,
+    )
@@ -3,9 +3,26 @@
 # ・ファイル内容：データベーススキーマ修正スクリプト
 # ・作成日時：2025/07/07 Claude Code
 # -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/18 16:00:00  更新者：agent
+# ・更新内容：履歴ページング用の複合インデックスに置き換え
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/18 23:00:00  更新者：agent
+# ・更新内容：打ち切られた応答を示す truncated カラムを追加
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/19 12:00:00  更新者：agent
+# ・更新内容：リセット時に会話スレッド・全文検索の列とインデックスも作り直す
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/19 13:00:00  更新者：agent
+# ・更新内容：全文検索インデックスを CONCURRENTLY で作成するマイグレーションを追加
+# -------------------------------------------------
 
 import psycopg2
 from database import DATABASE_CONFIG
+from history_search import index_names as history_search_indexes, schema_statements as history_search_schema
 
 def fix_chat_history_schema():
     """chat_historyテーブルにusernameカラムを追加"""
@@ -40,17 +57,22 @@ def fix_chat_history_schema():
         else:
             print("✅ usernameカラムは既に存在します")
         
-        # インデックスを追加してパフォーマンスを向上
+        # 途中で打ち切られたストリーム応答の印
         cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_chat_history_username 
-            ON chat_history(username)
+            ALTER TABLE chat_history
+            ADD COLUMN IF NOT EXISTS truncated BOOLEAN NOT NULL DEFAULT FALSE
         """)
         
+        # ユーザー毎の新しい順ページング用の複合インデックス
         cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_chat_history_created_at 
-            ON chat_history(created_at DESC)
+            CREATE INDEX IF NOT EXISTS idx_chat_history_username_created_at_id
+            ON chat_history(username, created_at DESC, id DESC)
         """)
         
+        # 複合インデックスで代替できる単一カラムのインデックスを削除
+        cursor.execute("DROP INDEX IF EXISTS idx_chat_history_username")
+        cursor.execute("DROP INDEX IF EXISTS idx_chat_history_created_at")
+        
         conn.commit()
         cursor.close()
         conn.close()
@@ -70,6 +92,7 @@ def reset_database():
         
         print("🗑️ 既存のテーブルを削除中...")
         cursor.execute("DROP TABLE IF EXISTS chat_history CASCADE")
+        cursor.execute("DROP TABLE IF EXISTS conversations CASCADE")
         cursor.execute("DROP TABLE IF EXISTS users CASCADE")
         
         print("📊 テーブルを再作成中...")
@@ -84,6 +107,20 @@ def reset_database():
             )
         """)
         
+        # conversationsテーブルの作成（会話スレッド）
+        cursor.execute("""
+            CREATE TABLE conversations (
+                id SERIAL PRIMARY KEY,
+                username VARCHAR(50) NOT NULL,
+                title VARCHAR(200),
+                system_prompt TEXT,
+                turn_count INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (username) REFERENCES users(username)
+            )
+        """)
+        
         # chat_historyテーブルの作成（usernameカラム付き）
         cursor.execute("""
             CREATE TABLE chat_history (
@@ -92,18 +129,31 @@ def reset_database():
                 username VARCHAR(50) NOT NULL,
                 user_message TEXT NOT NULL,
                 assistant_message TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                truncated BOOLEAN NOT NULL DEFAULT FALSE,
+                conversation_id INTEGER REFERENCES conversations(id) ON DELETE CASCADE
             )
         """)
         
         # インデックスの作成
         cursor.execute("""
-            CREATE INDEX idx_chat_history_username ON chat_history(username)
+            CREATE INDEX idx_chat_history_username_created_at_id
+            ON chat_history(username, created_at DESC, id DESC)
+        """)
+        cursor.execute("""
+            CREATE INDEX idx_chat_history_conversation_id
+            ON chat_history (conversation_id, created_at DESC, id DESC)
+            WHERE conversation_id IS NOT NULL
         """)
         cursor.execute("""
-            CREATE INDEX idx_chat_history_created_at ON chat_history(created_at DESC)
+            CREATE INDEX idx_conversations_username_updated_at_id
+            ON conversations (username, updated_at DESC, id DESC)
         """)
         
+        # 全文検索用のインデックス（空のテーブルなのでトランザクション内で作成）
+        for statement in history_search_schema(concurrently=False):
+            cursor.execute(statement)
+        
         # テストユーザーの作成
         from passlib.context import CryptContext
         pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -125,16 +175,56 @@ def reset_database():
         print(f"❌ データベースリセットエラー: {e}")
         return False
 
+def create_history_search_indexes():
+    """全文検索の GIN インデックスを書き込みを止めずに作成（既存データ保持）
+
+    CREATE INDEX CONCURRENTLY はトランザクション外で実行する必要があるため autocommit で実行する。
+    作成中に失敗すると無効な（INVALID）インデックスが残るので、削除してから作り直す。
+    """
+    try:
+        conn = psycopg2.connect(**DATABASE_CONFIG)
+        conn.autocommit = True
+        cursor = conn.cursor()
+        
+        # 以前の版で起動時に追加していた生成列（追加時にテーブル全体を書き直していた）は不要
+        cursor.execute("ALTER TABLE chat_history DROP COLUMN IF EXISTS search_vector")
+        
+        for name in history_search_indexes():
+            cursor.execute("""
+                SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+                WHERE pg_class.relname = %s AND NOT pg_index.indisvalid
+            """, (name,))
+            if cursor.fetchone():
+                print(f"🗑️ 無効なインデックス {name} を削除中...")
+                cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        
+        for statement in history_search_schema(concurrently=True):
+            print(f"📝 {statement}")
+            cursor.execute(statement)
+        
+        cursor.close()
+        conn.close()
+        
+        print("✅ 全文検索インデックスの作成が完了しました")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 全文検索インデックス作成エラー: {e}")
+        return False
+
 if __name__ == "__main__":
     print("データベーススキーマの修正を開始します...")
     print("1. スキーマ修正（既存データ保持）")
     print("2. 完全リセット（データ削除）")
+    print("3. 全文検索インデックスの作成（既存データ保持、書き込みを止めずに作成）")
     
-    choice = input("選択してください (1 or 2): ")
+    choice = input("選択してください (1, 2 or 3): ")
     
     if choice == "1":
         fix_chat_history_schema()
     elif choice == "2":
         reset_database()
+    elif choice == "3":
+        create_history_search_indexes()
     else:
         print("無効な選択です")
\ No newline at end of file
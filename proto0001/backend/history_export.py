@@ -0,0 +1,326 @@
+# -------------------------------------------------
+# ・ファイル名：history_export.py
+# ・ファイル内容：チャット履歴の一括エクスポート（NDJSON / CSV、gzip 圧縮可、メモリ使用量一定）
+# ・作成日時：2026/10/19 10:00:00  agent
+# -------------------------------------------------
+#
+# CSV は COPY (SELECT ...) TO STDOUT をそのまま流し、NDJSON はサーバー側カーソル（名前付きカーソル）
+# から fetch_size 行ずつ読んで 1 行 1 JSON に変換する。どちらも chunk_size 毎に書き出すため、
+# 行数に関わらずメモリに載るのは数チャンク分だけ。
+# API からは専用のスレッドで DB を読み、上限付きのキューでイベントループへ渡す（受信側が遅ければ
+# DB の読み出しも止まる）。CLI は export_chat_history.py。
+#
+# 途中で失敗した場合に完全な出力と区別できるよう、NDJSON は最後に {"_export": ...} の行を付ける
+# （完了時は "complete"、失敗時は "incomplete" と、それまでに書いた行数）。CSV には末尾の印が無いため、
+# API では失敗時に接続を切る（チャンク転送が終端されず、クライアントには正常な EOF ではなくエラーに
+# 見える）。保存済みのファイルで途中切れを検出できるのは gzip（末尾の CRC・長さが無い）の場合のみ。
+
+import asyncio
+import concurrent.futures
+import json
+import os
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Optional, Sequence
+
+import anyio
+
+from database import db_connection
+from metrics import observe_db_query
+
+# エクスポート設定
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "2"))
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "2000"))
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", "65536"))
+# イベントループへ渡す前に溜めておくチャンク数（メモリ使用量は約 EXPORT_CHUNK_BYTES × この値）
+EXPORT_QUEUE_CHUNKS = int(os.getenv("EXPORT_QUEUE_CHUNKS", "8"))
+
+EXPORT_FORMATS = ("ndjson", "csv")
+EXPORT_COLUMNS = (
+    "id", "username", "conversation_id", "created_at", "truncated", "user_message", "assistant_message",
+)
+
+class ExportBusy(Exception):
+    """同時に実行できるエクスポート数の上限に達した"""
+
+class ExportCancelled(Exception):
+    """受信側が切断した"""
+
+@dataclass
+class ExportFilter:
+    """対象の行（usernames が空なら全ユーザー）"""
+    usernames: Sequence[str] = ()
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+
+    def where(self):
+        conditions, params = [], []
+        if self.usernames:
+            conditions.append("username = ANY(%s)")
+            params.append(list(self.usernames))
+        if self.since:
+            conditions.append("created_at >= %s")
+            params.append(self.since)
+        if self.until:
+            conditions.append("created_at < %s")
+            params.append(self.until)
+        return (" WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+def select_sql(export_filter: ExportFilter):
+    where, params = export_filter.where()
+    sql = f"""
+        SELECT {", ".join(EXPORT_COLUMNS)}
+        FROM chat_history{where}
+        ORDER BY created_at, id
+    """
+    return sql, params
+
+class ChunkSink:
+    """書き込まれたデータを chunk_size 毎にまとめて emit に渡す（gzip 指定時は圧縮してから）"""
+
+    def __init__(self, emit: Callable[[bytes], None], gzip: bool = False, chunk_size: int = EXPORT_CHUNK_BYTES):
+        self._emit = emit
+        self._buffer = bytearray()
+        self._chunk_size = chunk_size
+        # wbits=31 で gzip 形式（そのまま .gz として保存できる）
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+        self.bytes_in = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.bytes_in += len(data)
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        self._buffer += data
+        if len(self._buffer) >= self._chunk_size:
+            self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            self._emit(bytes(self._buffer))
+            self._buffer.clear()
+
+    def close(self):
+        if self._compressor is not None:
+            self._buffer += self._compressor.flush()
+        self._flush()
+
+def _json_default(value: Any):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} は JSON に変換できません")
+
+def export_trailer(status: str, rows: int, error: Optional[str] = None) -> str:
+    """NDJSON の最後の行（履歴の行には無い _export キーで区別する）"""
+    trailer: dict = {"_export": status, "rows": rows}
+    if error is not None:
+        trailer["error"] = error
+    return json.dumps(trailer, ensure_ascii=False) + "\n"
+
+def write_export(conn, sink: ChunkSink, fmt: str, export_filter: ExportFilter,
+                 fetch_size: int = EXPORT_FETCH_SIZE) -> int:
+    """履歴を sink に書き出し、行数を返す（CSV は行数を数えないため -1）
+
+    NDJSON は最後に export_trailer の行を書く。DB の読み出しで失敗した場合も "incomplete" の行を
+    書いてから例外を送出する。
+    """
+    sql, params = select_sql(export_filter)
+    if fmt == "csv":
+        cursor = conn.cursor()
+        try:
+            query = cursor.mogrify(sql, params).decode("utf-8")
+            cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", sink)
+        finally:
+            cursor.close()
+        return -1
+
+    if fmt != "ndjson":
+        raise ValueError("format は ndjson・csv のいずれかを指定してください")
+    # 名前付きカーソルはサーバー側で保持され、fetch_size 行ずつ転送される
+    cursor = conn.cursor(name=f"chat_history_export_{threading.get_ident()}")
+    cursor.itersize = fetch_size
+    rows = 0
+    try:
+        cursor.execute(sql, params)
+        for row in cursor:
+            sink.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False, default=_json_default))
+            sink.write("\n")
+            rows += 1
+    except ExportCancelled:
+        raise
+    except Exception as e:
+        try:
+            sink.write(export_trailer("incomplete", rows, str(e)))
+        except Exception:
+            # 書き出し先の失敗（ファイルの書き込みエラーなど）なら印も書けない
+            pass
+        raise
+    else:
+        sink.write(export_trailer("complete", rows))
+    finally:
+        cursor.close()
+        # 読み取りのみのトランザクションを閉じてからプールへ返す
+        conn.rollback()
+    return rows
+
+class HistoryExporter:
+    """エクスポート専用のスレッドで DB を読み、チャンクを非同期に返す"""
+
+    def __init__(self, max_concurrent: int = EXPORT_MAX_CONCURRENT, queue_chunks: int = EXPORT_QUEUE_CHUNKS,
+                 connection=db_connection):
+        self.max_concurrent = max_concurrent
+        self.queue_chunks = queue_chunks
+        self._connection = connection
+        # 長時間かかるため、通常の DB アクセス用スレッドプールとは分ける
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrent, thread_name_prefix="export",
+        )
+        self._running = 0
+
+        # 統計情報
+        self._completed = 0
+        self._cancelled = 0
+        self._failed = 0
+        self._rejected = 0
+        self._bytes = 0
+
+    def check_capacity(self):
+        """実行中のエクスポートが上限なら ExportBusy（レスポンスを返し始める前に呼ぶ）
+
+        枠は stream() の開始時に数える。レスポンスの送信前に切断されると stream() が始まらない
+        ため、ここで枠を確保すると返されないことがある。同時に確認をすり抜けた分は
+        スレッドプールの空き待ちになるだけなので、厳密には数えない。
+        """
+        if self._running >= self.max_concurrent:
+            self._rejected += 1
+            raise ExportBusy("エクスポートの同時実行数が上限に達しました")
+
+    async def stream(self, fmt: str, export_filter: ExportFilter, gzip: bool = False) -> AsyncIterator[bytes]:
+        """エクスポートを実行し、チャンクを順に返す（途中で閉じられたら DB の読み出しも止める）"""
+        self._running += 1
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_chunks)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            if stop.is_set():
+                raise ExportCancelled()
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            while True:
+                try:
+                    return future.result(timeout=0.5)
+                except concurrent.futures.TimeoutError:
+                    if stop.is_set():
+                        future.cancel()
+                        raise ExportCancelled()
+
+        def produce():
+            started = time.perf_counter()
+            sink = ChunkSink(put, gzip)
+            try:
+                try:
+                    with self._connection() as conn:
+                        write_export(conn, sink, fmt, export_filter)
+                except ExportCancelled:
+                    raise
+                except Exception:
+                    # NDJSON は incomplete の行まで送ってから失敗を伝える。CSV の gzip は閉じると
+                    # 正常なファイルに見えてしまうため閉じない
+                    if fmt == "ndjson":
+                        try:
+                            sink.close()
+                        except ExportCancelled:
+                            raise
+                        except Exception:
+                            pass
+                    raise
+                sink.close()
+                put(done)
+            except ExportCancelled:
+                pass
+            except Exception as e:
+                if not stop.is_set():
+                    try:
+                        put(e)
+                    except ExportCancelled:
+                        pass
+            finally:
+                observe_db_query("export", time.perf_counter() - started)
+
+        producer = loop.run_in_executor(self._executor, produce)
+        outcome = "cancelled"
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    outcome = "completed"
+                    break
+                if isinstance(item, Exception):
+                    # 送信済みの応答を正常に終わらせず、接続を切らせる（途中切れを EOF と区別させる）
+                    outcome = "failed"
+                    raise item
+                self._bytes += len(item)
+                yield item
+        finally:
+            try:
+                stop.set()
+                # 書き込み待ちの producer を先に進め、停止要求に気付かせる
+                while not queue.empty():
+                    queue.get_nowait()
+                # 切断時は StreamingResponse のキャンセルスコープから取り消しが繰り返し届くため、
+                # asyncio.shield では待ち切れない。producer が止まるまで取り消しを受け付けない
+                with anyio.CancelScope(shield=True):
+                    await producer
+            finally:
+                self._running -= 1
+                if outcome == "completed":
+                    self._completed += 1
+                elif outcome == "failed":
+                    self._failed += 1
+                else:
+                    self._cancelled += 1
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        """エクスポートの統計情報"""
+        return {
+            "running": self._running,
+            "max_concurrent": self.max_concurrent,
+            "completed": self._completed,
+            "cancelled": self._cancelled,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "bytes_sent": self._bytes,
+        }
+
+def export_filename(fmt: str, gzip: bool, now: Optional[datetime] = None) -> str:
+    name = f"chat_history_{(now or datetime.now()).strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    return name + ".gz" if gzip else name
+
+def export_media_type(fmt: str, gzip: bool) -> str:
+    if gzip:
+        return "application/gzip"
+    return "application/x-ndjson" if fmt == "ndjson" else "text/csv; charset=utf-8"
+
+# グローバルインスタンス
+_history_exporter: Optional[HistoryExporter] = None
+
+def get_history_exporter() -> HistoryExporter:
+    """エクスポーターのシングルトンインスタンスを取得"""
+    global _history_exporter
+    if _history_exporter is None:
+        _history_exporter = HistoryExporter()
+    return _history_exporter
+
+def close_history_exporter():
+    global _history_exporter
+    if _history_exporter is not None:
+        _history_exporter.close()
+        _history_exporter = None
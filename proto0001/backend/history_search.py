@@ -0,0 +1,187 @@
+# -------------------------------------------------
+# ・ファイル名：history_search.py
+# ・ファイル内容：チャット履歴の全文検索（tsvector + GIN、日本語はトライグラム）
+# ・作成日時：2026/10/19 09:00:00  agent
+# -------------------------------------------------
+#
+# PostgreSQL の標準の設定には日本語の分かち書きが無く、'simple' では区切りの無い文全体が
+# 1 語になってしまう。そのため検索語に日本語を含む場合は、pg_trgm の GIN インデックスを使った
+# 部分一致（ILIKE）に切り替える。英数字だけの検索語は tsvector の GIN インデックスで検索し、
+# ts_rank_cd の順に返す（部分一致は新しい順）。
+# インデックスはどちらも式インデックスで、既存の行を書き換えない（生成列を追加するとテーブル全体が
+# 書き直され、その間は ACCESS EXCLUSIVE ロックで読み書きが止まる）。作成は起動時ではなく
+# fix_db_schema.py から CREATE INDEX CONCURRENTLY で行う。インデックスが無くても検索はできる（逐次走査）。
+# スニペットはアプリ側で作り、強調箇所は HTML ではなく位置（[開始, 終了)）で返す。
+
+import base64
+import json
+import os
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# 履歴検索設定
+# tsvector の生成に使う設定（日本語の分かち書きを入れた場合はその設定名。変更時は列を作り直す）
+HISTORY_SEARCH_TS_CONFIG = os.getenv("HISTORY_SEARCH_TS_CONFIG", "simple")
+HISTORY_SEARCH_MAX_TERMS = int(os.getenv("HISTORY_SEARCH_MAX_TERMS", "8"))
+HISTORY_SEARCH_SNIPPET_CHARS = int(os.getenv("HISTORY_SEARCH_SNIPPET_CHARS", "120"))
+
+SEARCH_MODES = ("auto", "fts", "trigram")
+
+if not re.fullmatch(r"[a-z_][a-z0-9_]*", HISTORY_SEARCH_TS_CONFIG):
+    raise ValueError("HISTORY_SEARCH_TS_CONFIG には英小文字・数字・_ の設定名を指定してください")
+
+# 検索の対象（インデックスの式と同じ式で検索しないとインデックスが使われない）
+TRIGRAM_DOCUMENT = "(user_message || ' ' || assistant_message)"
+TSVECTOR_DOCUMENT = f"to_tsvector('{HISTORY_SEARCH_TS_CONFIG}', user_message || ' ' || assistant_message)"
+
+# ひらがな・カタカナ・漢字・全角英数など（単語の区切りが無い文字）
+_CJK = re.compile("[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+def schema_statements(table: str = "chat_history", concurrently: bool = True) -> List[str]:
+    """検索用のインデックス（fix_db_schema.py とベンチマークで共用）
+
+    concurrently の場合は書き込みを止めずに作成する（トランザクション外、autocommit で実行する）。
+    """
+    option = "CONCURRENTLY " if concurrently else ""
+    return [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        f"CREATE INDEX {option}IF NOT EXISTS idx_{table}_search_fts ON {table} USING gin ({TSVECTOR_DOCUMENT})",
+        f"CREATE INDEX {option}IF NOT EXISTS idx_{table}_search_trgm ON {table} USING gin ({TRIGRAM_DOCUMENT} gin_trgm_ops)",
+    ]
+
+def index_names(table: str = "chat_history") -> List[str]:
+    return [f"idx_{table}_search_fts", f"idx_{table}_search_trgm"]
+
+def parse_terms(q: str) -> List[str]:
+    """検索語（"..." はフレーズ、-語 と OR は除く）"""
+    terms = []
+    for phrase, word in re.findall(r'"([^"]+)"|(\S+)', q):
+        term = phrase or word
+        if not phrase and (term.startswith("-") or term.lower() == "or"):
+            continue
+        term = term.strip()
+        if term and term.lower() not in (t.lower() for t in terms):
+            terms.append(term)
+    return terms[:HISTORY_SEARCH_MAX_TERMS]
+
+def search_mode_for(q: str, mode: str = "auto") -> str:
+    """auto の場合、日本語を含めばトライグラム、それ以外は全文検索"""
+    if mode != "auto":
+        return mode
+    return "trigram" if _CJK.search(q) else "fts"
+
+def escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def encode_search_cursor(mode: str, sort_key: Any, row_id: int) -> str:
+    raw = json.dumps({"mode": mode, "key": sort_key, "id": row_id})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_search_cursor(cursor: str, mode: str) -> Tuple[Any, int]:
+    """(並び順の値, id)。形式が違う・別のモードのカーソルは ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if data["mode"] != mode:
+            raise ValueError("検索モードが異なるカーソルです")
+        key = float(data["key"]) if mode == "fts" else datetime.fromisoformat(data["key"])
+        return key, int(data["id"])
+    except (KeyError, TypeError) as e:
+        raise ValueError(str(e))
+
+def build_search_query(
+    username: str,
+    q: str,
+    mode: str,
+    limit: int,
+    cursor: Optional[Tuple[Any, int]] = None,
+    conversation_id: Optional[int] = None,
+    table: str = "chat_history",
+) -> Tuple[str, List[Any]]:
+    """検索の SQL とパラメータ（limit + 1 件取得して次ページの有無を判定する）"""
+    columns = "id, user_message, assistant_message, created_at, truncated, conversation_id"
+    if mode == "fts":
+        conditions = ["username = %s", f"{TSVECTOR_DOCUMENT} @@ query"]
+        params: List[Any] = [q, username]
+        if conversation_id is not None:
+            conditions.append("conversation_id = %s")
+            params.append(conversation_id)
+        outer = ""
+        if cursor:
+            outer = "WHERE (rank, id) < (%s, %s)"
+            params.extend(cursor)
+        sql = f"""
+            SELECT * FROM (
+                SELECT {columns}, ts_rank_cd({TSVECTOR_DOCUMENT}, query) AS rank
+                FROM {table}, websearch_to_tsquery('{HISTORY_SEARCH_TS_CONFIG}', %s) AS query
+                WHERE {" AND ".join(conditions)}
+            ) AS matches
+            {outer}
+            ORDER BY rank DESC, id DESC
+            LIMIT %s
+        """
+        return sql, [*params, limit + 1]
+
+    terms = parse_terms(q) or [q.strip()]
+    conditions = ["username = %s"] + [f"{TRIGRAM_DOCUMENT} ILIKE %s" for _ in terms]
+    params = [username] + [f"%{escape_like(term)}%" for term in terms]
+    if conversation_id is not None:
+        conditions.append("conversation_id = %s")
+        params.append(conversation_id)
+    if cursor:
+        conditions.append("(created_at, id) < (%s, %s)")
+        params.extend(cursor)
+    sql = f"""
+        SELECT {columns}, NULL::real AS rank
+        FROM {table}
+        WHERE {" AND ".join(conditions)}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+    """
+    return sql, [*params, limit + 1]
+
+def build_snippet(text: str, terms: Sequence[str], width: int = HISTORY_SEARCH_SNIPPET_CHARS) -> Dict[str, Any]:
+    """最初に一致した箇所の前後 width 文字と、その中の一致箇所の位置"""
+    folded = text.lower()
+    needles = [term.lower() for term in terms if term]
+    first = min((i for i in (folded.find(n) for n in needles) if i >= 0), default=-1)
+
+    start = 0 if first < 0 else max(0, min(first - width // 3, len(text) - width))
+    end = min(len(text), start + width)
+    prefix = "…" if start > 0 else ""
+    snippet = prefix + text[start:end] + ("…" if end < len(text) else "")
+
+    highlights = []
+    window = folded[start:end]
+    for needle in needles:
+        position = window.find(needle)
+        while position >= 0:
+            highlights.append([len(prefix) + position, len(prefix) + position + len(needle)])
+            position = window.find(needle, position + len(needle))
+    highlights.sort()
+    # 重なった強調箇所をまとめる
+    merged: List[List[int]] = []
+    for span in highlights:
+        if merged and span[0] <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], span[1])
+        else:
+            merged.append(span)
+    return {"text": snippet, "highlights": merged}
+
+def search_result(row: Dict[str, Any], terms: Sequence[str]) -> Dict[str, Any]:
+    """検索結果の 1 件（本文の代わりにスニペットを返す）"""
+    return {
+        "id": row["id"],
+        "created_at": row["created_at"],
+        "truncated": row["truncated"],
+        "conversation_id": row["conversation_id"],
+        "rank": row["rank"],
+        "user_snippet": build_snippet(row["user_message"], terms),
+        "assistant_snippet": build_snippet(row["assistant_message"], terms),
+    }
+
+def next_search_cursor(mode: str, last: Dict[str, Any]) -> str:
+    if mode == "fts":
+        return encode_search_cursor(mode, last["rank"], last["id"])
+    return encode_search_cursor(mode, last["created_at"].isoformat(), last["id"])
@@ -0,0 +1,284 @@
+# -------------------------------------------------
+# ・ファイル名：history_writer.py
+# ・ファイル内容：チャット履歴の非同期一括書き込み（ライトビハインド）
+# ・作成日時：2026/10/18 15:00:00  agent
+# -------------------------------------------------
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Any, List, Optional
+
+import psycopg2
+from psycopg2.extras import execute_values
+from database import PoolTimeoutError, run_in_db
+from conversation_store import conversation_title
+
+# ライトビハインド設定
+CHAT_HISTORY_QUEUE_SIZE = int(os.getenv("CHAT_HISTORY_QUEUE_SIZE", "10000"))
+CHAT_HISTORY_BATCH_SIZE = int(os.getenv("CHAT_HISTORY_BATCH_SIZE", "100"))
+CHAT_HISTORY_FLUSH_INTERVAL = float(os.getenv("CHAT_HISTORY_FLUSH_INTERVAL", "0.5"))
+CHAT_HISTORY_DRAIN_TIMEOUT = float(os.getenv("CHAT_HISTORY_DRAIN_TIMEOUT", "10"))
+# 接続断などの一時的なエラーの再試行回数と初回の待ち時間（秒、再試行毎に倍）
+CHAT_HISTORY_RETRY_ATTEMPTS = int(os.getenv("CHAT_HISTORY_RETRY_ATTEMPTS", "3"))
+CHAT_HISTORY_RETRY_BACKOFF = float(os.getenv("CHAT_HISTORY_RETRY_BACKOFF", "0.2"))
+
+# 再試行すれば成功し得るエラー（それ以外は行の内容が原因とみなす）
+TRANSIENT_DB_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, PoolTimeoutError)
+
+@dataclass
+class ChatHistoryRecord:
+    """chat_history の 1 行分"""
+    username: str
+    user_message: str
+    assistant_message: str
+    created_at: datetime = field(default_factory=datetime.now)
+    # ストリームが途中で打ち切られた応答
+    truncated: bool = False
+    # 会話スレッド（/conversations 経由のチャットのみ）
+    conversation_id: Optional[int] = None
+
+    def as_row(self) -> tuple:
+        return (self.username, self.user_message, self.assistant_message, self.created_at, self.truncated,
+                self.conversation_id)
+
+INSERT_COLUMNS = "(username, user_message, assistant_message, created_at, truncated, conversation_id)"
+
+# 書き込みまでの間に削除された会話の履歴は捨てる（外部キー違反でバッチ全体を失わないように）
+INSERT_WITH_CONVERSATION_SQL = f"""
+    INSERT INTO chat_history {INSERT_COLUMNS}
+    SELECT v.username, v.user_message, v.assistant_message, v.created_at, v.truncated, v.conversation_id
+    FROM (VALUES %s) AS v {INSERT_COLUMNS}
+    WHERE v.conversation_id IS NULL
+       OR EXISTS (SELECT 1 FROM conversations WHERE conversations.id = v.conversation_id)
+"""
+INSERT_WITH_CONVERSATION_TEMPLATE = "(%s, %s, %s, %s::timestamp, %s::boolean, %s::integer)"
+
+def conversation_updates(records: List[ChatHistoryRecord]) -> List[tuple]:
+    """会話毎の (id, 追加した往復数, 最終更新日時, 最初のメッセージから作ったタイトル)"""
+    updates: Dict[int, list] = {}
+    for record in records:
+        if record.conversation_id is None:
+            continue
+        update = updates.get(record.conversation_id)
+        if update is None:
+            updates[record.conversation_id] = [
+                record.conversation_id, 1, record.created_at, conversation_title(record.user_message),
+            ]
+        else:
+            update[1] += 1
+            update[2] = max(update[2], record.created_at)
+    return [tuple(update) for update in updates.values()]
+
+# ワーカー停止用のマーカー
+_STOP = object()
+
+async def insert_chat_history_batch(records: List[ChatHistoryRecord]):
+    """複数行をまとめて INSERT（会話スレッドの往復数・更新日時も同じトランザクションで更新）"""
+    rows = [record.as_row() for record in records]
+    updates = conversation_updates(records)
+
+    def task(conn):
+        cursor = conn.cursor()
+        try:
+            if updates:
+                execute_values(
+                    cursor, INSERT_WITH_CONVERSATION_SQL, rows,
+                    template=INSERT_WITH_CONVERSATION_TEMPLATE, page_size=len(rows),
+                )
+                execute_values(
+                    cursor,
+                    """
+                    UPDATE conversations
+                    SET turn_count = conversations.turn_count + c.turns,
+                        updated_at = GREATEST(conversations.updated_at, c.updated_at),
+                        title = COALESCE(conversations.title, c.title)
+                    FROM (VALUES %s) AS c (id, turns, updated_at, title)
+                    WHERE conversations.id = c.id
+                    """,
+                    updates,
+                    template="(%s::integer, %s::integer, %s::timestamp, %s::text)",
+                    page_size=len(updates),
+                )
+            else:
+                execute_values(
+                    cursor,
+                    f"INSERT INTO chat_history {INSERT_COLUMNS} VALUES %s",
+                    rows,
+                    page_size=len(rows),
+                )
+            conn.commit()
+        finally:
+            cursor.close()
+
+    await run_in_db(task, "insert_chat_history", f"INSERT INTO chat_history {INSERT_COLUMNS} VALUES ... ({len(rows)} rows)")
+
+class ChatHistoryWriter:
+    """キューに溜めた履歴をバックグラウンドでまとめて書き込む
+
+    バッチサイズに達するか、最初の 1 件から flush_interval 秒経過した時点で書き込む。
+    一時的なエラーは間隔を空けて再試行し、それ以外のエラーはバッチを半分ずつに分けて書き直す
+    （NUL 文字を含むなど、書き込めない行だけを捨てる）。
+    停止時はキューに残った履歴を書き切ってから終了する。
+    """
+
+    def __init__(
+        self,
+        insert_batch: Callable[[List[ChatHistoryRecord]], Awaitable[None]] = insert_chat_history_batch,
+        queue_size: int = CHAT_HISTORY_QUEUE_SIZE,
+        batch_size: int = CHAT_HISTORY_BATCH_SIZE,
+        flush_interval: float = CHAT_HISTORY_FLUSH_INTERVAL,
+        retry_attempts: int = CHAT_HISTORY_RETRY_ATTEMPTS,
+        retry_backoff: float = CHAT_HISTORY_RETRY_BACKOFF,
+    ):
+        self._insert_batch = insert_batch
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_attempts = retry_attempts
+        self.retry_backoff = retry_backoff
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+        # 統計情報
+        self._enqueued = 0
+        self._written = 0
+        self._batches = 0
+        self._failed = 0
+        self._retries = 0
+        self._rejected = 0
+        self._last_flush_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        """バックグラウンドワーカーを起動"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def put(self, record: ChatHistoryRecord):
+        """履歴をキューに追加（満杯なら空くまで待つ）"""
+        await self._queue.put(record)
+        self._enqueued += 1
+
+    def put_nowait(self, record: ChatHistoryRecord) -> bool:
+        """履歴をキューに追加（満杯なら False）"""
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self._rejected += 1
+            return False
+        self._enqueued += 1
+        return True
+
+    async def _next_batch(self):
+        """次のバッチと、停止要求を受け取ったかを返す"""
+        item = await self._queue.get()
+        if item is _STOP:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _insert_with_retry(self, batch: List[ChatHistoryRecord]):
+        for attempt in range(self.retry_attempts + 1):
+            try:
+                return await self._insert_batch(batch)
+            except TRANSIENT_DB_ERRORS:
+                if attempt == self.retry_attempts:
+                    raise
+                self._retries += 1
+                await asyncio.sleep(self.retry_backoff * (2 ** attempt))
+
+    async def _write(self, batch: List[ChatHistoryRecord]) -> int:
+        """書き込めた件数を返す"""
+        try:
+            await self._insert_with_retry(batch)
+            self._batches += 1
+            return len(batch)
+        except TRANSIENT_DB_ERRORS as e:
+            self._failed += len(batch)
+            print(f"チャット履歴の一括保存エラー（{len(batch)}件）: {str(e)}")
+            return 0
+        except Exception as e:
+            if len(batch) == 1:
+                self._failed += 1
+                print(f"チャット履歴の保存エラー（{batch[0].username}）: {str(e)}")
+                return 0
+            # 他のユーザーの行まで失わないよう、半分ずつ書き直して原因の行を絞り込む
+            middle = len(batch) // 2
+            return await self._write(batch[:middle]) + await self._write(batch[middle:])
+
+    async def _flush(self, batch: List[ChatHistoryRecord]):
+        started = time.perf_counter()
+        try:
+            self._written += await self._write(batch)
+        finally:
+            self._last_flush_ms = (time.perf_counter() - started) * 1000
+
+    async def _run(self):
+        while True:
+            batch, stopping = await self._next_batch()
+            if batch:
+                await self._flush(batch)
+            if stopping:
+                return
+
+    async def stop(self, timeout: float = CHAT_HISTORY_DRAIN_TIMEOUT):
+        """キューを書き切ってからワーカーを停止"""
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        if not task.done():
+            async def drain():
+                # 停止マーカーより前に積まれた履歴はすべて書き込まれる
+                # （キューが満杯ならマーカーを積むのも待つため、ここも timeout に含める）
+                await self._queue.put(_STOP)
+                await asyncio.shield(task)
+
+            try:
+                await asyncio.wait_for(drain(), timeout)
+            except asyncio.TimeoutError:
+                print(f"チャット履歴の書き込みが{timeout}秒以内に完了しませんでした（残り{self._queue.qsize()}件）")
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """書き込みキューの統計情報"""
+        return {
+            "running": self.running,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "enqueued": self._enqueued,
+            "written": self._written,
+            "batches": self._batches,
+            "failed": self._failed,
+            "retries": self._retries,
+            "rejected": self._rejected,
+            "last_flush_ms": round(self._last_flush_ms, 3),
+        }
+
+# グローバルインスタンス
+_chat_history_writer: Optional[ChatHistoryWriter] = None
+
+def get_chat_history_writer() -> ChatHistoryWriter:
+    """チャット履歴ライターのシングルトンインスタンスを取得"""
+    global _chat_history_writer
+    if _chat_history_writer is None:
+        _chat_history_writer = ChatHistoryWriter()
+    return _chat_history_writer
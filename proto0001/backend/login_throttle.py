@@ -0,0 +1,378 @@
+# -------------------------------------------------
+# ・ファイル名：login_throttle.py
+# ・ファイル内容：ログイン試行のスライディングウィンドウ制限（ユーザー名毎・IP 毎）
+# ・作成日時：2026/10/19 04:00:00  agent
+# -------------------------------------------------
+
+import ipaddress
+import math
+import os
+import secrets
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from tracing import parse_networks
+
+# ログイン制限設定
+LOGIN_THROTTLE_ENABLED = os.getenv("LOGIN_THROTTLE_ENABLED", "true").lower() == "true"
+# ユーザー名毎: 失敗回数 / 秒数（成功するとリセット）
+LOGIN_THROTTLE_USER_LIMIT = int(os.getenv("LOGIN_THROTTLE_USER_LIMIT", "5"))
+LOGIN_THROTTLE_USER_WINDOW = float(os.getenv("LOGIN_THROTTLE_USER_WINDOW", "300"))
+# IP 毎: パスワード照合まで進んだ試行回数 / 秒数
+LOGIN_THROTTLE_IP_LIMIT = int(os.getenv("LOGIN_THROTTLE_IP_LIMIT", "20"))
+LOGIN_THROTTLE_IP_WINDOW = float(os.getenv("LOGIN_THROTTLE_IP_WINDOW", "60"))
+# memory: ワーカー毎に保持 / redis: 複数ワーカーで共有（redis パッケージが必要）/ local: redis の代替（開発用）
+LOGIN_THROTTLE_STORE = os.getenv("LOGIN_THROTTLE_STORE", "memory")
+LOGIN_THROTTLE_REDIS_URL = os.getenv("LOGIN_THROTTLE_REDIS_URL", "redis://localhost:6379/0")
+LOGIN_THROTTLE_MAX_KEYS = int(os.getenv("LOGIN_THROTTLE_MAX_KEYS", "100000"))
+# X-Forwarded-For を参照する接続元（リバースプロキシの IP・CIDR のカンマ区切り）。空なら参照しない
+# 先頭の値はクライアントが自由に書けるため、信頼するプロキシを除いた最も右の値を使う
+LOGIN_THROTTLE_TRUSTED_PROXIES = os.getenv("LOGIN_THROTTLE_TRUSTED_PROXIES", "")
+_trusted_proxy_networks = parse_networks(LOGIN_THROTTLE_TRUSTED_PROXIES)
+
+class LoginThrottled(Exception):
+    """ログイン試行の回数が上限に達した"""
+
+    def __init__(self, message: str, retry_after: float, scope: str):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.scope = scope
+
+    @property
+    def retry_after_header(self) -> str:
+        """Retry-After ヘッダーの値（整数秒、最低 1 秒）"""
+        return str(max(1, math.ceil(self.retry_after)))
+
+class ThrottleStore(ABC):
+    """試行の保存先（キー毎に、ウィンドウ内の試行を古い順に保持する）"""
+
+    @abstractmethod
+    async def acquire(self, key: str, limit: int, window: float, now: float) -> Tuple[Optional[str], float]:
+        """上限内なら試行を記録して (試行の ID, 0)、上限なら記録せずに (None, 次に試行できるまでの秒数)
+
+        判定と記録は不可分に行う（同時に届いた試行がそろって判定を通り抜けないように）。
+        """
+
+    @abstractmethod
+    async def release(self, key: str, attempt_id: str):
+        """記録した試行を取り消す"""
+
+    @abstractmethod
+    async def reset(self, key: str):
+        """キーの試行を全て消す"""
+
+def _retry_after(timestamps: List[float], limit: int, window: float, now: float) -> float:
+    """ウィンドウ内の試行時刻（古い順、上限以上）から、次に試行できるまでの秒数"""
+    return max(timestamps[len(timestamps) - limit] + window - now, 0.0)
+
+class MemoryThrottleStore(ThrottleStore):
+    """プロセス内の保存先（キー数は max_keys まで。超えたら最も古く使われたキーを捨てる）
+
+    acquire の途中で await しないため、イベントループ内では判定と記録が不可分になる。
+    """
+
+    def __init__(self, max_keys: int = LOGIN_THROTTLE_MAX_KEYS):
+        self.max_keys = max_keys
+        # キー毎の (試行時刻, 試行の ID)
+        self._entries: "OrderedDict[str, deque]" = OrderedDict()
+
+    def _prune(self, key: str, window: float, now: float) -> Optional[deque]:
+        attempts = self._entries.get(key)
+        if attempts is None:
+            return None
+        while attempts and attempts[0][0] <= now - window:
+            attempts.popleft()
+        if not attempts:
+            del self._entries[key]
+            return None
+        return attempts
+
+    async def acquire(self, key: str, limit: int, window: float, now: float) -> Tuple[Optional[str], float]:
+        attempts = self._prune(key, window, now)
+        if attempts is not None and len(attempts) >= limit:
+            return None, _retry_after([t for t, _ in attempts], limit, window, now)
+        if attempts is None:
+            attempts = self._entries[key] = deque()
+        attempt_id = secrets.token_hex(4)
+        attempts.append((now, attempt_id))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_keys:
+            self._entries.popitem(last=False)
+        return attempt_id, 0.0
+
+    async def release(self, key: str, attempt_id: str):
+        attempts = self._entries.get(key)
+        if attempts is None:
+            return
+        for attempt in attempts:
+            if attempt[1] == attempt_id:
+                attempts.remove(attempt)
+                break
+        if not attempts:
+            del self._entries[key]
+
+    async def reset(self, key: str):
+        self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class SortedSetThrottleStore(ThrottleStore):
+    """Redis のソート済みセット（スコア = 試行時刻）を使う共有の保存先
+
+    client は redis.asyncio.Redis と同じ pipeline / zrem / delete を持つもの。
+    古い試行の削除・追加・件数の確認を MULTI でまとめて実行し、上限を超えていたら追加した試行を
+    取り消す（複数ワーカーから同時に届いても、上限を超えて通るものは出ない）。
+    """
+
+    def __init__(self, client, prefix: str = "throttle:"):
+        self.client = client
+        self.prefix = prefix
+
+    async def acquire(self, key: str, limit: int, window: float, now: float) -> Tuple[Optional[str], float]:
+        name = self.prefix + key
+        # 同時刻の試行が重ならないようメンバーに乱数を付ける
+        attempt_id = f"{now}:{secrets.token_hex(4)}"
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(name, "-inf", now - window)
+            pipe.zadd(name, {attempt_id: now})
+            pipe.zrange(name, 0, -1, withscores=True)
+            pipe.expire(name, math.ceil(window))
+            _, _, entries, _ = await pipe.execute()
+        if len(entries) <= limit:
+            return attempt_id, 0.0
+        await self.client.zrem(name, attempt_id)
+        others = [score for member, score in entries
+                  if (member.decode() if isinstance(member, bytes) else member) != attempt_id]
+        return None, _retry_after(others, limit, window, now)
+
+    async def release(self, key: str, attempt_id: str):
+        await self.client.zrem(self.prefix + key, attempt_id)
+
+    async def reset(self, key: str):
+        await self.client.delete(self.prefix + key)
+
+class LocalSortedSetClient:
+    """SortedSetThrottleStore 用の Redis の代替（単一プロセス内。開発・テスト用）"""
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self._sets: Dict[str, Dict[str, float]] = {}
+        self._expires: Dict[str, float] = {}
+        self._clock = clock
+
+    def _get(self, name: str) -> Dict[str, float]:
+        expires_at = self._expires.get(name)
+        if expires_at is not None and expires_at <= self._clock():
+            self._sets.pop(name, None)
+            self._expires.pop(name, None)
+        return self._sets.get(name, {})
+
+    async def zremrangebyscore(self, name: str, min_score, max_score) -> int:
+        members = self._get(name)
+        low, high = float(min_score), float(max_score)
+        removed = [m for m, score in members.items() if low <= score <= high]
+        for member in removed:
+            del members[member]
+        return len(removed)
+
+    async def zrange(self, name: str, start: int, end: int, withscores: bool = False):
+        ordered = sorted(self._get(name).items(), key=lambda item: item[1])
+        ordered = ordered[start:None if end == -1 else end + 1]
+        return ordered if withscores else [member for member, _ in ordered]
+
+    async def zadd(self, name: str, mapping: Dict[str, float]) -> int:
+        members = self._sets.setdefault(name, self._get(name))
+        added = sum(1 for member in mapping if member not in members)
+        members.update(mapping)
+        return added
+
+    async def expire(self, name: str, seconds: int) -> bool:
+        if name not in self._sets:
+            return False
+        self._expires[name] = self._clock() + seconds
+        return True
+
+    async def zrem(self, name: str, *members: str) -> int:
+        current = self._get(name)
+        return sum(1 for member in members if current.pop(member, None) is not None)
+
+    async def delete(self, name: str) -> int:
+        self._expires.pop(name, None)
+        return 1 if self._sets.pop(name, None) is not None else 0
+
+    def pipeline(self, transaction: bool = True) -> "LocalPipeline":
+        return LocalPipeline(self)
+
+class LocalPipeline:
+    """LocalSortedSetClient のコマンドを溜めて順に実行する（途中で他の処理が割り込まない）"""
+
+    def __init__(self, client: LocalSortedSetClient):
+        self._client = client
+        self._commands: List[tuple] = []
+
+    def __getattr__(self, command: str):
+        def queue(*args, **kwargs):
+            self._commands.append((getattr(self._client, command), args, kwargs))
+            return self
+        return queue
+
+    async def execute(self) -> list:
+        commands, self._commands = self._commands, []
+        return [await method(*args, **kwargs) for method, args, kwargs in commands]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self._commands = []
+
+def create_throttle_store(kind: str = LOGIN_THROTTLE_STORE) -> ThrottleStore:
+    """LOGIN_THROTTLE_STORE に応じた保存先"""
+    if kind == "memory":
+        return MemoryThrottleStore()
+    if kind == "local":
+        return SortedSetThrottleStore(LocalSortedSetClient())
+    if kind == "redis":
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise ValueError("LOGIN_THROTTLE_STORE=redis には redis パッケージが必要です")
+        return SortedSetThrottleStore(redis.from_url(LOGIN_THROTTLE_REDIS_URL))
+    raise ValueError("LOGIN_THROTTLE_STORE は memory・local・redis のいずれかを指定してください")
+
+@dataclass
+class LoginAttempt:
+    """check() で記録した試行（(キー, 試行の ID) の一覧）"""
+    reserved: List[Tuple[str, str]] = field(default_factory=list)
+
+class LoginThrottle:
+    """ログイン試行の制限（DB・bcrypt の前に判定する）
+
+    ユーザー名毎: 試行を判定と同時に失敗として数え、成功したらリセットする。照合の結果を待ってから
+    数えると、同時に届いた試行がそろって判定を通り抜けてしまうため。
+    IP 毎: パスワード照合まで進んだ試行を全て数える（上限で断った試行は数えない）。
+    """
+
+    def __init__(
+        self,
+        store: Optional[ThrottleStore] = None,
+        user_limit: int = LOGIN_THROTTLE_USER_LIMIT,
+        user_window: float = LOGIN_THROTTLE_USER_WINDOW,
+        ip_limit: int = LOGIN_THROTTLE_IP_LIMIT,
+        ip_window: float = LOGIN_THROTTLE_IP_WINDOW,
+        enabled: bool = LOGIN_THROTTLE_ENABLED,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.store = store if store is not None else MemoryThrottleStore()
+        self.user_limit = user_limit
+        self.user_window = user_window
+        self.ip_limit = ip_limit
+        self.ip_window = ip_window
+        self.enabled = enabled
+        self._clock = clock
+
+        # 統計情報
+        self._checked = 0
+        self._rejected = {"user": 0, "ip": 0}
+        self._failures = 0
+        self._cancelled = 0
+
+    @staticmethod
+    def user_key(username: str) -> str:
+        return f"login:user:{username.strip().lower()}"
+
+    @staticmethod
+    def ip_key(client_ip: str) -> str:
+        return f"login:ip:{client_ip}"
+
+    async def check(self, username: str, client_ip: str) -> LoginAttempt:
+        """試行できるか判定し、ユーザー名毎・IP 毎の試行として記録する（上限なら LoginThrottled）"""
+        attempt = LoginAttempt()
+        if not self.enabled:
+            return attempt
+        self._checked += 1
+        now = self._clock()
+        for scope, key, limit, window in (
+            ("user", self.user_key(username), self.user_limit, self.user_window),
+            ("ip", self.ip_key(client_ip), self.ip_limit, self.ip_window),
+        ):
+            if limit <= 0:
+                continue
+            attempt_id, retry_after = await self.store.acquire(key, limit, window, now)
+            if attempt_id is None:
+                await self.cancel(attempt)
+                self._rejected[scope] += 1
+                raise LoginThrottled("ログインの試行回数が上限に達しました", retry_after, scope)
+            attempt.reserved.append((key, attempt_id))
+        return attempt
+
+    async def cancel(self, attempt: LoginAttempt):
+        """照合まで進まなかった試行（混雑で断った場合など）の記録を取り消す"""
+        for key, attempt_id in attempt.reserved:
+            await self.store.release(key, attempt_id)
+        if attempt.reserved:
+            self._cancelled += 1
+        attempt.reserved = []
+
+    async def record_failure(self, username: str):
+        """失敗した試行（check() の時点で記録済みのため、統計のみ）"""
+        if self.enabled:
+            self._failures += 1
+
+    async def record_success(self, username: str):
+        if self.enabled:
+            await self.store.reset(self.user_key(username))
+
+    def stats(self) -> Dict[str, Any]:
+        """ログイン制限の統計情報"""
+        return {
+            "enabled": self.enabled,
+            "store": type(self.store).__name__,
+            "checked": self._checked,
+            "rejected_user": self._rejected["user"],
+            "rejected_ip": self._rejected["ip"],
+            "failures": self._failures,
+            "cancelled": self._cancelled,
+        }
+
+def _is_trusted(address: str, trusted_proxies: Sequence[Any]) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in trusted_proxies)
+
+def client_ip_from(headers, peer: Optional[str],
+                   trusted_proxies: Optional[Sequence[Any]] = None) -> str:
+    """制限に使うクライアントの IP
+
+    接続元が信頼するプロキシの場合のみ X-Forwarded-For を参照し、右から順に信頼するプロキシを
+    飛ばして最初の値を使う（それより左はクライアントが偽装できる）。
+    """
+    if trusted_proxies is None:
+        trusted_proxies = _trusted_proxy_networks
+    if not peer or not _is_trusted(peer, trusted_proxies):
+        return peer or "unknown"
+    forwarded = [item.strip() for item in headers.get("x-forwarded-for", "").split(",") if item.strip()]
+    for address in reversed(forwarded):
+        if not _is_trusted(address, trusted_proxies):
+            try:
+                return str(ipaddress.ip_address(address))
+            except ValueError:
+                # プロキシが付けた値ではない（書式が不正）ため、接続元を使う
+                return peer
+    # 全て信頼するプロキシなら最も左（最初のプロキシ）
+    return forwarded[0] if forwarded else peer
+
+# グローバルインスタンス
+_login_throttle: Optional[LoginThrottle] = None
+
+def get_login_throttle() -> LoginThrottle:
+    """ログイン制限のシングルトンインスタンスを取得"""
+    global _login_throttle
+    if _login_throttle is None:
+        _login_throttle = LoginThrottle(create_throttle_store())
+    return _login_throttle
@@ -7,23 +7,147 @@
 # ・更新日時：2025/07/07 11:57:00  更新者：Claude Code
 # ・更新内容：Azure OpenAI チャット機能の追加
 # -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/18 10:00:00  更新者：agent
+# ・更新内容：データベース接続をコネクションプール経由に変更
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/18 11:00:00  更新者：agent
+# ・更新内容：DB アクセスを非同期化しイベントループのブロックを解消
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/18 12:00:00  更新者：agent
+# ・更新内容：終了時に Azure OpenAI 用 HTTP クライアントをクローズ
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/18 15:00:00  更新者：agent
+# ・更新内容：チャット履歴の保存をライトビハインドキュー経由に変更
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/18 16:00:00  更新者：agent
+# ・更新内容：チャット履歴のキーセットページングと絞り込みを追加
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/18 20:00:00  更新者：agent
+# ・更新内容：Azure OpenAI の送信枠不足を 429 で返す
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/18 21:00:00  更新者：agent
+# ・更新内容：サーキットブレーカーが開いている間は 503 で即座に返す
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/18 22:00:00  更新者：agent
+# ・更新内容：統計情報をデプロイメント毎に出力
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/18 23:00:00  更新者：agent
+# ・更新内容：クライアント切断時に上流ストリームを中断し、途中までの応答を保存
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/19 00:00:00  更新者：agent
+# ・更新内容：/chat/stream を SSE 化（差分の結合・ハートビート・Last-Event-ID での再接続）
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/19 01:00:00  更新者：agent
+# ・更新内容：上限を超えたストリーム応答を truncated 付きで保存
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/19 02:00:00  更新者：agent
+# ・更新内容：ログイン時の bcrypt 照合を専用スレッドプールで実行し、混雑時は 503 を返す
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/19 03:00:00  更新者：agent
+# ・更新内容：検証済み JWT と /profile のユーザー情報をキャッシュ
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/19 04:00:00  更新者：agent
+# ・更新内容：ユーザー名毎・IP 毎のログイン試行制限を追加
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/19 05:00:00  更新者：agent
+# ・更新内容：Prometheus 形式の /metrics を追加
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/19 06:00:00  更新者：agent
+# ・更新内容：リクエスト毎のトレース（ルートスパン・DB / Azure OpenAI の子スパン）を追加
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/19 07:00:00  更新者：agent
+# ・更新内容：意味的キャッシュの統計を追加し、終了時に索引を保存
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/19 08:00:00  更新者：agent
+# ・更新内容：サーバー側で会話を保持する /conversations API を追加
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/19 09:00:00  更新者：agent
+# ・更新内容：チャット履歴の全文検索 /chat/history/search を追加
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/19 10:00:00  更新者：agent
+# ・更新内容：チャット履歴の一括エクスポート /chat/history/export を追加
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/19 11:00:00  更新者：agent
+# ・更新内容：ログイン試行を照合前に数え、混雑で断った試行は取り消す
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/19 13:00:00  更新者：agent
+# ・更新内容：全文検索のインデックス作成を起動時から fix_db_schema.py へ移動
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/19 14:00:00  更新者：agent
+# ・更新内容：エクスポートが途中で失敗した場合の扱いを明記
+# -------------------------------------------------
+# -------------------------------------------------
+# ・更新日時：2026/10/19 15:00:00  更新者：agent
+# ・更新内容：会話スレッドへの送信の max_tokens に上限を設定
+# -------------------------------------------------
 
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field
 from typing import Optional, List
 import jwt
-import bcrypt
 from datetime import datetime, timedelta
 import os
 from dotenv import load_dotenv
-from database import get_db_connection
+from database import (
+    get_db_connection, get_connection_pool, close_connection_pool, close_db_executor,
+    fetch_one, fetch_all, execute, execute_returning,
+)
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from azure_openai_client import get_azure_openai_client, ChatRequest, ChatMessage, ChatResponse
+from azure_openai_client import (
+    get_azure_openai_client, close_shared_http_client, ChatRequest, ChatMessage, ChatResponse,
+    AZURE_OPENAI_MAX_TOKENS_LIMIT,
+)
+from rate_limiter import RateLimitExceeded
+from resilience import CircuitOpenError
+from response_cache import get_response_cache
+from semantic_cache import get_semantic_cache, close_semantic_cache
+from request_coalescer import get_request_coalescer
+from history_writer import get_chat_history_writer, insert_chat_history_batch, ChatHistoryRecord
+from chat_stream import ChatStreamSession, ReplayUnavailable, get_chat_stream_registry
+from conversation_store import Transcript, get_conversation_store
+from history_search import (
+    SEARCH_MODES, build_search_query, decode_search_cursor, next_search_cursor, parse_terms,
+    search_mode_for, search_result,
+)
+from history_export import (
+    EXPORT_FORMATS, ExportBusy, ExportFilter, close_history_exporter, export_filename, export_media_type,
+    get_history_exporter,
+)
+from auth_cache import get_auth_cache
+from login_throttle import LoginThrottled, client_ip_from, get_login_throttle
+from metrics import METRICS_ENABLED, MetricsMiddleware, mark_process_dead, render_metrics, route_template
+from tracing import MemoryExporter, TracingMiddleware, close_tracer, get_tracer
+from password_hasher import (
+    PasswordHasherBusy, get_password_hasher, close_password_hasher, hash_password_sync, verify_password_sync,
+)
 import json
+import base64
 
 # 環境変数を読み込み
 load_dotenv()
@@ -37,14 +161,25 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Stream-Id", "X-Trace-Id"],
 )
 
+# メトリクス（ルート毎のリクエスト数・処理時間・処理中の件数）
+app.add_middleware(MetricsMiddleware)
+
+# トレース（リクエスト毎のルートスパン。DB・Azure OpenAI の呼び出しは子スパンになる）
+app.add_middleware(TracingMiddleware, route_label=route_template)
+
 # セキュリティ設定
 security = HTTPBearer()
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# チャット履歴のページング設定
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "50"))
+CHAT_HISTORY_MAX_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_MAX_PAGE_SIZE", "200"))
+
 # データモデル
 class UserLogin(BaseModel):
     username: str
@@ -59,12 +194,27 @@ class Token(BaseModel):
     access_token: str
     token_type: str
 
-# パスワードハッシュ化
+class ConversationCreate(BaseModel):
+    title: Optional[str] = Field(None, max_length=200)
+    system_prompt: Optional[str] = None
+
+class ConversationChatRequest(BaseModel):
+    """会話スレッドへの送信（過去のやり取りはサーバー側で補う）"""
+    message: str = Field(..., min_length=1)
+    max_tokens: Optional[int] = Field(1000, ge=1, le=AZURE_OPENAI_MAX_TOKENS_LIMIT)
+    temperature: Optional[float] = 0.7
+
+# 既定のシステムプロンプト
+DEFAULT_SYSTEM_PROMPT = """あなたは親切で知識豊富なAIアシスタントです。
+ユーザーの質問に対して、正確で有用な回答を提供してください。
+回答は日本語で行ってください。"""
+
+# パスワードハッシュ化（同期版。リクエスト処理中は get_password_hasher() を使う）
 def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return hash_password_sync(password)
 
 def verify_password(password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+    return verify_password_sync(password, hashed_password)
 
 # JWT生成
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -78,10 +228,13 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 # JWT検証
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def decode_access_token(token: str) -> dict:
+    return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+
+# 検証済みのトークンは exp までキャッシュし、署名検証を繰り返さない
+async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
+        username: str = get_auth_cache().verify(credentials.credentials, decode_access_token)
         if username is None:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -119,9 +272,50 @@ def init_database():
             user_message TEXT NOT NULL,
             assistant_message TEXT NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            truncated BOOLEAN NOT NULL DEFAULT FALSE,
+            FOREIGN KEY (username) REFERENCES users(username)
+        )
+    """)
+    cursor.execute("""
+        ALTER TABLE chat_history
+        ADD COLUMN IF NOT EXISTS truncated BOOLEAN NOT NULL DEFAULT FALSE
+    """)
+    
+    # 会話スレッドテーブル作成（turn_count は履歴の書き込みと同じトランザクションで加算）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS conversations (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(50) NOT NULL,
+            title VARCHAR(200),
+            system_prompt TEXT,
+            turn_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (username) REFERENCES users(username)
         )
     """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_conversations_username_updated_at_id
+        ON conversations (username, updated_at DESC, id DESC)
+    """)
+    cursor.execute("""
+        ALTER TABLE chat_history
+        ADD COLUMN IF NOT EXISTS conversation_id INTEGER REFERENCES conversations(id) ON DELETE CASCADE
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_history_conversation_id
+        ON chat_history (conversation_id, created_at DESC, id DESC)
+        WHERE conversation_id IS NOT NULL
+    """)
+    
+    # 全文検索の GIN インデックスは、大きなテーブルでは作成に時間がかかるため起動時には作らない
+    # （fix_db_schema.py の「3. 全文検索インデックスの作成」で CONCURRENTLY で作成する）
+    
+    # 履歴のページング用複合インデックス
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_history_username_created_at_id
+        ON chat_history (username, created_at DESC, id DESC)
+    """)
     
     # テストユーザー作成
     cursor.execute("SELECT COUNT(*) FROM users WHERE username = 'testAI'")
@@ -142,22 +336,41 @@ async def root():
     return {"message": "WebApp API is running"}
 
 @app.post("/login", response_model=Token)
-async def login(user: UserLogin):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+async def login(user: UserLogin, request: Request):
+    # 総当たり対策（DB・bcrypt の処理より前に判定する）
+    throttle = get_login_throttle()
+    client_ip = client_ip_from(request.headers, request.client.host if request.client else None)
+    try:
+        attempt = await throttle.check(user.username, client_ip)
+    except LoginThrottled as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="ログインの試行回数が上限に達しました。しばらく待ってから再度お試しください",
+            headers={"Retry-After": e.retry_after_header},
+        )
     
-    cursor.execute("SELECT * FROM users WHERE username = %s", (user.username,))
-    db_user = cursor.fetchone()
+    db_user = await fetch_one("SELECT * FROM users WHERE username = %s", (user.username,))
     
-    cursor.close()
-    conn.close()
+    # bcrypt の照合はイベントループを塞がないよう専用スレッドプールで行う
+    try:
+        verified = bool(db_user) and await get_password_hasher().verify(user.password, db_user['password_hash'])
+    except PasswordHasherBusy as e:
+        # 照合していない試行は失敗として数えない
+        await throttle.cancel(attempt)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="ログインが集中しています。しばらく待ってから再度お試しください",
+            headers={"Retry-After": e.retry_after_header},
+        )
     
-    if not db_user or not verify_password(user.password, db_user['password_hash']):
+    if not verified:
+        await throttle.record_failure(user.username)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="ユーザー名またはパスワードが間違っています",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    await throttle.record_success(user.username)
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -178,14 +391,11 @@ async def dashboard(current_user: str = Depends(verify_token)):
 
 @app.get("/profile")
 async def profile(current_user: str = Depends(verify_token)):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cursor.execute("SELECT id, username, created_at FROM users WHERE username = %s", (current_user,))
-    user_data = cursor.fetchone()
-    
-    cursor.close()
-    conn.close()
+    # ユーザー情報は更新されないため、有効時はキャッシュから返す
+    user_data = await get_auth_cache().get_user(
+        current_user,
+        lambda: fetch_one("SELECT id, username, created_at FROM users WHERE username = %s", (current_user,)),
+    )
     
     if not user_data:
         raise HTTPException(
@@ -195,6 +405,65 @@ async def profile(current_user: str = Depends(verify_token)):
     
     return user_data
 
+@app.get("/system/stats")
+async def system_stats(current_user: str = Depends(verify_token)):
+    """サーバー内部の統計情報（コネクションプールのサイジング用）"""
+    cache = get_response_cache()
+    semantic_cache = get_semantic_cache()
+    coalescer = get_request_coalescer()
+    try:
+        deployments = get_azure_openai_client().pool.stats()
+    except ValueError:
+        # Azure OpenAI が未設定
+        deployments = None
+    return {
+        "db_pool": get_connection_pool().stats(),
+        "chat_history_writer": get_chat_history_writer().stats(),
+        "llm_cache": cache.stats() if cache else None,
+        "llm_semantic_cache": semantic_cache.stats() if semantic_cache else None,
+        "llm_coalescing": coalescer.stats() if coalescer else None,
+        "llm_deployments": deployments,
+        "chat_streams": get_chat_stream_registry().stats(),
+        "password_hasher": get_password_hasher().stats(),
+        "auth": get_auth_cache().stats(),
+        "login_throttle": get_login_throttle().stats(),
+        "conversations": get_conversation_store().stats(),
+        "history_export": get_history_exporter().stats(),
+        "tracing": get_tracer().stats(),
+    }
+
+@app.get("/system/traces")
+async def system_traces(limit: int = Query(20, ge=1, le=200), current_user: str = Depends(verify_token)):
+    """直近のトレース（TRACING_EXPORTER=memory の場合のみ）"""
+    exporter = get_tracer().exporter
+    if not isinstance(exporter, MemoryExporter):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="トレースはプロセス内に保持していません")
+    return {"traces": exporter.traces(limit)}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus のスクレイプ用（認証なし。公開しない経路で取得する）"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+def rate_limited_error(e: RateLimitExceeded) -> HTTPException:
+    """送信枠不足を、Retry-After 付きの 429 に変換"""
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="現在リクエストが集中しています。しばらく待ってから再度お試しください",
+        headers={"Retry-After": e.retry_after_header},
+    )
+
+def circuit_open_error(e: CircuitOpenError) -> HTTPException:
+    """Azure OpenAI の障害中は、待たせずに 503 を返す"""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="AI サービスが一時的に利用できません。しばらく待ってから再度お試しください",
+        headers={"Retry-After": e.retry_after_header},
+    )
+
 # チャット関連のAPIエンドポイント
 @app.post("/chat", response_model=ChatResponse)
 async def chat(chat_request: ChatRequest, current_user: str = Depends(verify_token)):
@@ -203,14 +472,9 @@ async def chat(chat_request: ChatRequest, current_user: str = Depends(verify_tok
         # Azure OpenAI クライアントの取得
         client = get_azure_openai_client()
         
-        # システムプロンプトの設定
-        system_prompt = """あなたは親切で知識豊富なAIアシスタントです。
-ユーザーの質問に対して、正確で有用な回答を提供してください。
-回答は日本語で行ってください。"""
-        
         # チャットリクエストにシステムプロンプトを設定
         if not chat_request.system_prompt:
-            chat_request.system_prompt = system_prompt
+            chat_request.system_prompt = DEFAULT_SYSTEM_PROMPT
         
         # Azure OpenAI APIの呼び出し
         response = await client.chat_completion(chat_request)
@@ -220,6 +484,10 @@ async def chat(chat_request: ChatRequest, current_user: str = Depends(verify_tok
         
         return response
         
+    except RateLimitExceeded as e:
+        raise rate_limited_error(e)
+    except CircuitOpenError as e:
+        raise circuit_open_error(e)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -233,64 +501,145 @@ async def chat_stream(chat_request: ChatRequest, current_user: str = Depends(ver
         # Azure OpenAI クライアントの取得
         client = get_azure_openai_client()
         
-        # システムプロンプトの設定
-        system_prompt = """あなたは親切で知識豊富なAIアシスタントです。
-ユーザーの質問に対して、正確で有用な回答を提供してください。
-回答は日本語で行ってください。"""
-        
         # チャットリクエストにシステムプロンプトを設定
         if not chat_request.system_prompt:
-            chat_request.system_prompt = system_prompt
+            chat_request.system_prompt = DEFAULT_SYSTEM_PROMPT
+        
+        # 最初のチャンクまでは応答ヘッダーを送らず、送信枠不足を 429 で返せるようにする
+        chunks = client.chat_completion_stream(chat_request)
+        try:
+            first_chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            first_chunk = None
+
+        # 上流の受信はリクエストとは別タスクで行い、切断後も再接続を一定時間待つ
+        async def on_complete(full_response: str, truncated: bool):
+            # チャット履歴をデータベースに保存（保持上限を超えた応答は truncated 付き）
+            await save_chat_history(current_user, chat_request.messages, full_response, truncated)
         
-        # ストリーミングレスポンスの生成
-        async def stream_generator():
-            full_response = ""
-            async for chunk in client.chat_completion_stream(chat_request):
-                full_response += chunk
-                yield f"data: {json.dumps({'chunk': chunk})}\n\n"
-            
-            # 完了通知
-            yield f"data: {json.dumps({'done': True})}\n\n"
-            
-            # チャット履歴をデータベースに保存
-            await save_chat_history(current_user, chat_request.messages, full_response)
+        def on_cancel(partial_response: str):
+            record_partial_chat_history(current_user, chat_request.messages, partial_response)
         
-        return StreamingResponse(
-            stream_generator(),
-            media_type="text/plain",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-            }
+        session = get_chat_stream_registry().create(
+            current_user, chunks, first_chunk, on_complete, on_cancel
         )
+        return sse_response(session)
         
+    except RateLimitExceeded as e:
+        raise rate_limited_error(e)
+    except CircuitOpenError as e:
+        raise circuit_open_error(e)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"ストリーミングチャット処理中にエラーが発生しました: {str(e)}"
         )
 
+def sse_response(session: ChatStreamSession, last_event_id: int = 0) -> StreamingResponse:
+    """text/event-stream の応答（X-Stream-Id で再接続先を伝える）"""
+    return StreamingResponse(
+        session.subscribe(last_event_id),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            # nginx などのプロキシにバッファさせない
+            "X-Accel-Buffering": "no",
+            "X-Stream-Id": session.id,
+        }
+    )
+
+@app.get("/chat/stream/{stream_id}")
+async def resume_chat_stream(
+    stream_id: str,
+    current_user: str = Depends(verify_token),
+    last_event_id: Optional[int] = Header(None, alias="Last-Event-ID"),
+    last_event_id_query: Optional[int] = Query(None, alias="last_event_id"),
+):
+    """切断したストリームに再接続（Last-Event-ID の続きから再送）"""
+    session = get_chat_stream_registry().get(stream_id, current_user)
+    if session is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="ストリームが見つかりません"
+        )
+    after = last_event_id if last_event_id is not None else (last_event_id_query or 0)
+    try:
+        session.replay_from(after)
+    except ReplayUnavailable as e:
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail=str(e))
+    return sse_response(session, after)
+
+# 履歴ページングのカーソル（最後の行の created_at と id）
+def encode_history_cursor(created_at: datetime, history_id: int) -> str:
+    raw = json.dumps({"created_at": created_at.isoformat(), "id": history_id})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_history_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(data["created_at"]), int(data["id"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="カーソルの形式が正しくありません"
+        )
+
 @app.get("/chat/history")
-async def get_chat_history(current_user: str = Depends(verify_token)):
-    """チャット履歴の取得"""
+async def get_chat_history(
+    current_user: str = Depends(verify_token),
+    limit: int = Query(CHAT_HISTORY_PAGE_SIZE, ge=1, le=CHAT_HISTORY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    conversation_id: Optional[int] = None,
+    preview: bool = False,
+    preview_length: int = Query(100, ge=1, le=10000),
+):
+    """チャット履歴の取得（新しい順、cursor で続きを取得）"""
+    conditions = ["username = %s"]
+    params: list = [current_user]
+    if since:
+        conditions.append("created_at >= %s")
+        params.append(since)
+    if until:
+        conditions.append("created_at < %s")
+        params.append(until)
+    if conversation_id is not None:
+        conditions.append("conversation_id = %s")
+        params.append(conversation_id)
+    if cursor:
+        conditions.append("(created_at, id) < (%s, %s)")
+        params.extend(decode_history_cursor(cursor))
+    
+    if preview:
+        # 本文の代わりに先頭部分だけを返す
+        assistant_column = (
+            "LEFT(assistant_message, %s) AS assistant_message, "
+            "LENGTH(assistant_message) > %s AS preview_truncated"
+        )
+        params = [preview_length, preview_length] + params
+    else:
+        assistant_column = "assistant_message"
+    
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        cursor.execute("""
-            SELECT id, user_message, assistant_message, created_at
+        # 1 件多く取得して次ページの有無を判定
+        rows = await fetch_all(f"""
+            SELECT id, user_message, {assistant_column}, created_at, truncated, conversation_id
             FROM chat_history
-            WHERE username = %s
-            ORDER BY created_at DESC
-            LIMIT 50
-        """, (current_user,))
-        
-        history = cursor.fetchall()
+            WHERE {" AND ".join(conditions)}
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """, (*params, limit + 1))
         
-        cursor.close()
-        conn.close()
+        history = rows[:limit]
+        next_cursor = None
+        if len(rows) > limit:
+            last = history[-1]
+            next_cursor = encode_history_cursor(last["created_at"], last["id"])
         
-        return {"history": history}
+        return {"history": history, "next_cursor": next_cursor}
         
     except Exception as e:
         raise HTTPException(
@@ -298,18 +647,83 @@ async def get_chat_history(current_user: str = Depends(verify_token)):
             detail=f"チャット履歴の取得中にエラーが発生しました: {str(e)}"
         )
 
+@app.get("/chat/history/search")
+async def search_chat_history(
+    q: str = Query(..., min_length=1, max_length=200),
+    current_user: str = Depends(verify_token),
+    mode: str = Query("auto", pattern="^(" + "|".join(SEARCH_MODES) + ")$"),
+    limit: int = Query(20, ge=1, le=CHAT_HISTORY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    conversation_id: Optional[int] = None,
+):
+    """チャット履歴の検索（全文検索は関連度順、日本語の部分一致は新しい順。cursor で続きを取得）"""
+    mode = search_mode_for(q, mode)
+    after = None
+    if cursor:
+        try:
+            after = decode_search_cursor(cursor, mode)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="カーソルの形式が正しくありません"
+            )
+    sql, params = build_search_query(current_user, q, mode, limit, after, conversation_id)
+    try:
+        rows = await fetch_all(sql, params)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"チャット履歴の検索中にエラーが発生しました: {str(e)}"
+        )
+    
+    terms = parse_terms(q)
+    page = rows[:limit]
+    return {
+        "mode": mode,
+        "results": [search_result(row, terms) for row in page],
+        "next_cursor": next_search_cursor(mode, page[-1]) if len(rows) > limit else None,
+    }
+
+@app.get("/chat/history/export")
+async def export_chat_history(
+    current_user: str = Depends(verify_token),
+    format: str = Query("ndjson", pattern="^(" + "|".join(EXPORT_FORMATS) + ")$"),
+    gzip: bool = False,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
+    """チャット履歴の一括ダウンロード（古い順、件数に関わらず逐次送信）
+
+    NDJSON の最後の行は {"_export": "complete", "rows": 行数}。送信開始後に失敗した場合は
+    接続を切る（NDJSON は "incomplete" の行を送ってから）。
+    """
+    exporter = get_history_exporter()
+    try:
+        exporter.check_capacity()
+    except ExportBusy as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "5"},
+        )
+    filename = export_filename(format, gzip)
+    return StreamingResponse(
+        exporter.stream(format, ExportFilter(usernames=[current_user], since=since, until=until), gzip),
+        media_type=export_media_type(format, gzip),
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
 @app.delete("/chat/history")
 async def clear_chat_history(current_user: str = Depends(verify_token)):
     """チャット履歴の削除"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("DELETE FROM chat_history WHERE username = %s", (current_user,))
-        conn.commit()
-        
-        cursor.close()
-        conn.close()
+        # 会話スレッドも同じ文で削除する
+        await execute("""
+            WITH deleted_conversations AS (
+                DELETE FROM conversations WHERE username = %s
+            )
+            DELETE FROM chat_history WHERE username = %s
+        """, (current_user, current_user))
         
         return {"message": "チャット履歴が削除されました"}
         
@@ -319,28 +733,196 @@ async def clear_chat_history(current_user: str = Depends(verify_token)):
             detail=f"チャット履歴の削除中にエラーが発生しました: {str(e)}"
         )
 
+# 会話スレッドのAPIエンドポイント
+CONVERSATION_COLUMNS = "id, title, system_prompt, turn_count, created_at, updated_at"
+
+@app.post("/conversations", status_code=status.HTTP_201_CREATED)
+async def create_conversation(conversation: ConversationCreate, current_user: str = Depends(verify_token)):
+    """会話スレッドの作成（以降は会話 ID と新しいメッセージだけを送る）"""
+    try:
+        return await execute_returning(f"""
+            INSERT INTO conversations (username, title, system_prompt)
+            VALUES (%s, %s, %s)
+            RETURNING {CONVERSATION_COLUMNS}
+        """, (current_user, conversation.title, conversation.system_prompt))
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"会話の作成中にエラーが発生しました: {str(e)}"
+        )
+
+@app.get("/conversations")
+async def list_conversations(
+    current_user: str = Depends(verify_token),
+    limit: int = Query(CHAT_HISTORY_PAGE_SIZE, ge=1, le=CHAT_HISTORY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+):
+    """会話スレッドの一覧（更新が新しい順、cursor で続きを取得）"""
+    conditions = ["username = %s"]
+    params: list = [current_user]
+    if cursor:
+        conditions.append("(updated_at, id) < (%s, %s)")
+        params.extend(decode_history_cursor(cursor))
+    try:
+        rows = await fetch_all(f"""
+            SELECT {CONVERSATION_COLUMNS}
+            FROM conversations
+            WHERE {" AND ".join(conditions)}
+            ORDER BY updated_at DESC, id DESC
+            LIMIT %s
+        """, (*params, limit + 1))
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"会話一覧の取得中にエラーが発生しました: {str(e)}"
+        )
+    conversations = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = conversations[-1]
+        next_cursor = encode_history_cursor(last["updated_at"], last["id"])
+    return {"conversations": conversations, "next_cursor": next_cursor}
+
+async def get_transcript(conversation_id: int, username: str) -> Transcript:
+    """会話のトランスクリプト（他のユーザーの会話は存在しないものとして 404）"""
+    transcript = await get_conversation_store().get(conversation_id, username)
+    if transcript is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="会話が見つかりません"
+        )
+    return transcript
+
+@app.get("/conversations/{conversation_id}")
+async def get_conversation(conversation_id: int, current_user: str = Depends(verify_token)):
+    """会話の直近のやり取り（それより前は /chat/history?conversation_id= で取得）"""
+    transcript = await get_transcript(conversation_id, current_user)
+    return {
+        "id": conversation_id,
+        "system_prompt": transcript.system_prompt,
+        "turn_count": transcript.turn_count,
+        "messages": [
+            {"role": msg.role, "content": msg.content} for msg in transcript.messages()
+        ],
+    }
+
+@app.delete("/conversations/{conversation_id}")
+async def delete_conversation(conversation_id: int, current_user: str = Depends(verify_token)):
+    """会話の削除（紐づく履歴も削除される）"""
+    deleted = await execute(
+        "DELETE FROM conversations WHERE id = %s AND username = %s", (conversation_id, current_user)
+    )
+    if not deleted:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="会話が見つかりません"
+        )
+    get_conversation_store().evict(conversation_id)
+    return {"message": "会話が削除されました"}
+
+def conversation_chat_request(transcript: Transcript, body: ConversationChatRequest) -> ChatRequest:
+    """保存済みのやり取りに新しいメッセージを加えた ChatRequest（検証済みの内容なので再検証しない）"""
+    return ChatRequest.model_construct(
+        messages=transcript.messages(body.message),
+        max_tokens=body.max_tokens,
+        temperature=body.temperature,
+        system_prompt=transcript.system_prompt or DEFAULT_SYSTEM_PROMPT,
+    )
+
+@app.post("/conversations/{conversation_id}/chat", response_model=ChatResponse)
+async def conversation_chat(
+    conversation_id: int, body: ConversationChatRequest, current_user: str = Depends(verify_token)
+):
+    """会話スレッドでのチャット"""
+    transcript = await get_transcript(conversation_id, current_user)
+    chat_request = conversation_chat_request(transcript, body)
+    try:
+        response = await get_azure_openai_client().chat_completion(chat_request)
+    except RateLimitExceeded as e:
+        raise rate_limited_error(e)
+    except CircuitOpenError as e:
+        raise circuit_open_error(e)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"チャット処理中にエラーが発生しました: {str(e)}"
+        )
+    get_conversation_store().append(transcript, body.message, response.message)
+    await save_chat_history(current_user, chat_request.messages, response.message, conversation_id=conversation_id)
+    return response
+
+@app.post("/conversations/{conversation_id}/chat/stream")
+async def conversation_chat_stream(
+    conversation_id: int, body: ConversationChatRequest, current_user: str = Depends(verify_token)
+):
+    """会話スレッドでのストリーミングチャット"""
+    transcript = await get_transcript(conversation_id, current_user)
+    chat_request = conversation_chat_request(transcript, body)
+    store = get_conversation_store()
+    try:
+        chunks = get_azure_openai_client().chat_completion_stream(chat_request)
+        try:
+            first_chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            first_chunk = None
+
+        async def on_complete(full_response: str, truncated: bool):
+            store.append(transcript, body.message, full_response)
+            await save_chat_history(
+                current_user, chat_request.messages, full_response, truncated, conversation_id=conversation_id
+            )
+
+        def on_cancel(partial_response: str):
+            store.append(transcript, body.message, partial_response)
+            record_partial_chat_history(
+                current_user, chat_request.messages, partial_response, conversation_id=conversation_id
+            )
+
+        session = get_chat_stream_registry().create(
+            current_user, chunks, first_chunk, on_complete, on_cancel
+        )
+        return sse_response(session)
+
+    except RateLimitExceeded as e:
+        raise rate_limited_error(e)
+    except CircuitOpenError as e:
+        raise circuit_open_error(e)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"ストリーミングチャット処理中にエラーが発生しました: {str(e)}"
+        )
+
 # チャット履歴保存用の関数
-async def save_chat_history(username: str, messages: List[ChatMessage], assistant_response: str):
-    """チャット履歴をデータベースに保存"""
+def last_user_message(messages: List[ChatMessage]) -> str:
+    """最後のユーザーメッセージ"""
+    for msg in reversed(messages):
+        if msg.role == "user":
+            return msg.content
+    return ""
+
+def record_partial_chat_history(username: str, messages: List[ChatMessage], partial_response: str,
+                                conversation_id: Optional[int] = None):
+    """切断で打ち切られた応答を truncated 付きで書き込みキューに追加（待たない）"""
+    writer = get_chat_history_writer()
+    if not writer.running:
+        return
+    record = ChatHistoryRecord(username, last_user_message(messages), partial_response, truncated=True,
+                               conversation_id=conversation_id)
+    if not writer.put_nowait(record):
+        print("チャット履歴の書き込みキューが満杯のため、打ち切られた応答を保存できませんでした")
+
+async def save_chat_history(username: str, messages: List[ChatMessage], assistant_response: str,
+                            truncated: bool = False, conversation_id: Optional[int] = None):
+    """チャット履歴を書き込みキューに追加（ワーカー未起動時は直接保存）"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # 最後のユーザーメッセージを取得
-        user_message = ""
-        for msg in reversed(messages):
-            if msg.role == "user":
-                user_message = msg.content
-                break
-        
-        cursor.execute("""
-            INSERT INTO chat_history (username, user_message, assistant_message, created_at)
-            VALUES (%s, %s, %s, %s)
-        """, (username, user_message, assistant_response, datetime.now()))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+        record = ChatHistoryRecord(username, last_user_message(messages), assistant_response, truncated=truncated,
+                                   conversation_id=conversation_id)
+        writer = get_chat_history_writer()
+        if writer.running:
+            await writer.put(record)
+        else:
+            await insert_chat_history_batch([record])
         
     except Exception as e:
         print(f"チャット履歴の保存エラー: {str(e)}")
@@ -349,6 +931,21 @@ async def save_chat_history(username: str, messages: List[ChatMessage], assistan
 @app.on_event("startup")
 async def startup_event():
     init_database()
+    get_connection_pool().open()
+    await get_chat_history_writer().start()
+
+# アプリケーション終了時に履歴を書き切ってから接続を破棄
+@app.on_event("shutdown")
+async def shutdown_event():
+    await get_chat_history_writer().stop()
+    await close_shared_http_client()
+    close_semantic_cache()
+    close_history_exporter()
+    close_db_executor()
+    close_password_hasher()
+    close_connection_pool()
+    close_tracer()
+    mark_process_dead()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,157 @@
+# -------------------------------------------------
+# ・ファイル名：metrics.py
+# ・ファイル内容：Prometheus 形式のメトリクス（HTTP・DB・Azure OpenAI）
+# ・作成日時：2026/10/19 05:00:00  agent
+# -------------------------------------------------
+#
+# 複数ワーカー（uvicorn --workers / gunicorn）で動かす場合は、起動前に
+# PROMETHEUS_MULTIPROC_DIR に空のディレクトリを指定する。各ワーカーの値はそこに書き出され、
+# /metrics はどのワーカーが受けても全ワーカーの合計を返す。
+
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest,
+)
+from prometheus_client import multiprocess
+from starlette.routing import Match
+
+# メトリクス設定
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
+
+# SSE は数分続くことがあるため、上限を長めに取る
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+DB_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+TOKENS_PER_SECOND_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 250, 500)
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP リクエスト数", ["method", "route", "status"],
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP リクエストの処理時間（ストリームは終了まで）",
+    ["method", "route"], buckets=REQUEST_BUCKETS,
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "処理中の HTTP リクエスト数",
+    ["method", "route"], multiprocess_mode="livesum",
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "DB アクセスの所要時間（接続の待ち時間を含む）",
+    ["operation"], buckets=DB_BUCKETS,
+)
+LLM_REQUEST_DURATION = Histogram(
+    "llm_request_duration_seconds", "Azure OpenAI 呼び出しの所要時間（リトライを含む）",
+    ["deployment", "stream", "outcome"], buckets=LLM_BUCKETS,
+)
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds", "ストリームの最初のトークンまでの時間",
+    ["deployment"], buckets=LLM_BUCKETS,
+)
+LLM_STREAM_TOKENS_PER_SECOND = Histogram(
+    "llm_stream_tokens_per_second", "ストリームの最初のトークン以降の受信速度（差分数 / 秒）",
+    ["deployment"], buckets=TOKENS_PER_SECOND_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total", "Azure OpenAI が返した usage のトークン数",
+    ["deployment", "kind"],
+)
+
+def observe_db_query(operation: str, seconds: float):
+    if METRICS_ENABLED:
+        DB_QUERY_DURATION.labels(operation).observe(seconds)
+
+def observe_llm_request(deployment: str, stream: bool, outcome: str, seconds: float):
+    if METRICS_ENABLED:
+        LLM_REQUEST_DURATION.labels(deployment, "true" if stream else "false", outcome).observe(seconds)
+
+def observe_llm_first_token(deployment: str, seconds: float):
+    if METRICS_ENABLED:
+        LLM_TIME_TO_FIRST_TOKEN.labels(deployment).observe(seconds)
+
+def observe_llm_stream_rate(deployment: str, tokens: int, seconds: float):
+    if METRICS_ENABLED and tokens > 0 and seconds > 0:
+        LLM_STREAM_TOKENS_PER_SECOND.labels(deployment).observe(tokens / seconds)
+
+def count_llm_tokens(deployment: str, usage: Optional[Dict[str, Any]]):
+    """ChatResponse.usage の prompt_tokens・completion_tokens を加算"""
+    if not METRICS_ENABLED or not usage:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if usage.get(kind):
+            LLM_TOKENS.labels(deployment, kind.replace("_tokens", "")).inc(usage[kind])
+
+# (メソッド, パス) → ルートの定義（パスパラメータを含むパスで増え続けないよう上限付き）
+_route_cache: Dict[Tuple[str, str], str] = {}
+ROUTE_CACHE_MAX_ENTRIES = 1024
+
+def route_template(scope) -> str:
+    """パスではなくルートの定義（/chat/stream/{stream_id} など）をラベルにする"""
+    key = (scope["method"], scope["path"])
+    template = _route_cache.get(key)
+    if template is not None:
+        return template
+
+    app = scope.get("app")
+    router = getattr(app, "router", None)
+    # 存在しないパスはまとめる（ラベルの種類が増え続けないように）
+    template = "unmatched"
+    for route in getattr(router, "routes", ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            template = route.path
+            break
+        if match == Match.PARTIAL and template == "unmatched":
+            # メソッド違い（405）
+            template = route.path
+    if len(_route_cache) >= ROUTE_CACHE_MAX_ENTRIES:
+        _route_cache.clear()
+    _route_cache[key] = template
+    return template
+
+class MetricsMiddleware:
+    """リクエスト数・処理時間・処理中の件数を記録する ASGI ミドルウェア"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_template(scope)
+        status_code = 500
+        in_progress = HTTP_REQUESTS_IN_PROGRESS.labels(method, route)
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUEST_DURATION.labels(method, route).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(method, route, str(status_code)).inc()
+            in_progress.dec()
+
+def render_metrics() -> Tuple[bytes, str]:
+    """/metrics の本文と Content-Type（複数ワーカー時は全ワーカーを集計）"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+def mark_process_dead():
+    """終了するワーカーの処理中ゲージを集計から外す（複数ワーカー時のみ）"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,135 @@
+# -------------------------------------------------
+# ・ファイル名：password_hasher.py
+# ・ファイル内容：bcrypt のハッシュ化・照合を専用スレッドプールで実行（待ち行列の上限付き）
+# ・作成日時：2026/10/19 02:00:00  agent
+# -------------------------------------------------
+
+import asyncio
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+import bcrypt
+
+T = TypeVar("T")
+
+# パスワードハッシュ設定
+# bcrypt は計算中に GIL を解放するため、スレッドプールでも CPU コア数まで並列に動く
+PASSWORD_HASH_MAX_WORKERS = int(os.getenv("PASSWORD_HASH_MAX_WORKERS", str(min(4, os.cpu_count() or 1))))
+# 実行中 + 待機中の上限（超えた分は 503 で断る）
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+PASSWORD_HASH_RETRY_AFTER = float(os.getenv("PASSWORD_HASH_RETRY_AFTER", "1"))
+
+class PasswordHasherBusy(Exception):
+    """ハッシュ処理の待ち行列が満杯"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        """Retry-After ヘッダーの値（整数秒、最低 1 秒）"""
+        return str(max(1, math.ceil(self.retry_after)))
+
+def hash_password_sync(password: str) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+
+def verify_password_sync(password: str, hashed_password: str) -> bool:
+    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+class PasswordHasher:
+    """bcrypt の処理をイベントループの外で実行する
+
+    max_workers=0 の場合はイベントループ上で直接実行する（従来の動作。ベンチマークの比較用）。
+    """
+
+    def __init__(
+        self,
+        max_workers: int = PASSWORD_HASH_MAX_WORKERS,
+        max_pending: int = PASSWORD_HASH_MAX_PENDING,
+        retry_after: float = PASSWORD_HASH_RETRY_AFTER,
+    ):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.pending = 0
+
+        # 統計情報
+        self._completed = 0
+        self._rejected = 0
+        self._total_seconds = 0.0
+        self._max_pending_seen = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="bcrypt",
+                )
+            return self._executor
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        if self.max_pending > 0 and self.pending >= self.max_pending:
+            self._rejected += 1
+            raise PasswordHasherBusy("パスワード照合の処理待ちが上限に達しました", self.retry_after)
+
+        self.pending += 1
+        self._max_pending_seen = max(self._max_pending_seen, self.pending)
+        started = time.perf_counter()
+        try:
+            if self.max_workers <= 0:
+                return func(*args)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self.pending -= 1
+            self._completed += 1
+            self._total_seconds += time.perf_counter() - started
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password_sync, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password_sync, password, hashed_password)
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        """パスワード処理の統計情報"""
+        return {
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "max_pending_seen": self._max_pending_seen,
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "avg_ms": round(self._total_seconds / self._completed * 1000, 3) if self._completed else None,
+        }
+
+# グローバルインスタンス
+_password_hasher: Optional[PasswordHasher] = None
+
+def get_password_hasher() -> PasswordHasher:
+    """パスワード処理のシングルトンインスタンスを取得"""
+    global _password_hasher
+    if _password_hasher is None:
+        _password_hasher = PasswordHasher()
+    return _password_hasher
+
+def close_password_hasher():
+    """パスワード処理用のスレッドプールを停止"""
+    global _password_hasher
+    if _password_hasher is not None:
+        _password_hasher.close()
+        _password_hasher = None
@@ -0,0 +1,241 @@
+# -------------------------------------------------
+# ・ファイル名：rate_limiter.py
+# ・ファイル内容：Azure OpenAI の RPM/TPM クォータに合わせたクライアント側レート制限
+# ・作成日時：2026/10/18 20:00:00  agent
+# -------------------------------------------------
+
+import asyncio
+import math
+import os
+import time
+from typing import Any, Callable, Dict, Mapping, Optional
+
+# レート制限設定（0 はその制限を行わない）
+AZURE_OPENAI_RATE_LIMIT_ENABLED = os.getenv("AZURE_OPENAI_RATE_LIMIT_ENABLED", "true").lower() == "true"
+AZURE_OPENAI_RPM_LIMIT = int(os.getenv("AZURE_OPENAI_RPM_LIMIT", "0"))
+AZURE_OPENAI_TPM_LIMIT = int(os.getenv("AZURE_OPENAI_TPM_LIMIT", "0"))
+AZURE_OPENAI_RATE_LIMIT_BURST_SECONDS = float(os.getenv("AZURE_OPENAI_RATE_LIMIT_BURST_SECONDS", "10"))
+AZURE_OPENAI_RATE_LIMIT_MAX_WAIT = float(os.getenv("AZURE_OPENAI_RATE_LIMIT_MAX_WAIT", "10"))
+
+class RateLimitExceeded(Exception):
+    """待ち時間の上限内に送信枠を確保できなかった"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        """Retry-After ヘッダーの値（整数秒、最低 1 秒）"""
+        return str(max(1, math.ceil(self.retry_after)))
+
+class TokenBucket:
+    """1 分あたり per_minute ずつ補充され、burst_seconds 秒分まで溜まるバケット
+
+    Azure はクォータを 1 分ではなく数秒単位の窓で判定するため、
+    1 分間の上限を一度に使い切れないよう容量を絞っている。
+    """
+
+    def __init__(
+        self,
+        per_minute: float,
+        burst_seconds: float = AZURE_OPENAI_RATE_LIMIT_BURST_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = per_minute / 60.0
+        self.capacity = max(self.rate * burst_seconds, 1.0)
+        self.tokens = self.capacity
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+
+    def wait_time(self, amount: float) -> float:
+        """amount を取り出せるまでの秒数（容量を超える要求は満杯になるまで待つ）"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        """取り出す（実績が見積もりを超えた場合は負になり得る）"""
+        self._refill()
+        self.tokens -= amount
+
+    def refund(self, amount: float):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def clamp(self, remaining: float):
+        """サーバーが返した残りクォータより多く持っていたら合わせる"""
+        self._refill()
+        self.tokens = min(self.tokens, remaining)
+
+class RateLimiter:
+    """デプロイメント単位の RPM/TPM 制御
+
+    空きがあれば即座に通し、無ければ到着順に待たせる。
+    待ち時間が max_wait を超える見込みになった時点で RateLimitExceeded を送出する。
+    Azure の応答ヘッダー（x-ratelimit-remaining-* と retry-after）で残量を補正する。
+    """
+
+    def __init__(
+        self,
+        rpm: int = AZURE_OPENAI_RPM_LIMIT,
+        tpm: int = AZURE_OPENAI_TPM_LIMIT,
+        burst_seconds: float = AZURE_OPENAI_RATE_LIMIT_BURST_SECONDS,
+        max_wait: float = AZURE_OPENAI_RATE_LIMIT_MAX_WAIT,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.requests = TokenBucket(rpm, burst_seconds, clock) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm, burst_seconds, clock) if tpm > 0 else None
+        self.max_wait = max_wait
+        self._clock = clock
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self._waiting = 0
+
+        # 統計情報
+        self._admitted = 0
+        self._queued = 0
+        self._rejected = 0
+        self._throttled = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+
+    def _wait_time(self, tokens: int) -> float:
+        wait = self._paused_until - self._clock()
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens))
+        return max(wait, 0.0)
+
+    def _consume(self, tokens: int):
+        if self.requests is not None:
+            self.requests.consume(1)
+        if self.tokens is not None:
+            self.tokens.consume(tokens)
+        self._admitted += 1
+
+    def _reject(self, wait: float):
+        self._rejected += 1
+        raise RateLimitExceeded("Azure OpenAI の送信枠が不足しています", wait)
+
+    async def acquire(self, tokens: int, max_wait: Optional[float] = None):
+        """推定トークン数 tokens のリクエスト 1 件分の送信枠を確保"""
+        max_wait = self.max_wait if max_wait is None else max_wait
+        # 待っている呼び出しが無く、枠も空いていればそのまま通す
+        if self._waiting == 0 and self._wait_time(tokens) == 0:
+            self._consume(tokens)
+            return
+
+        started = self._clock()
+        deadline = started + max_wait
+        self._queued += 1
+        self._waiting += 1
+        try:
+            # asyncio.Lock は待ち順に取得されるため、先頭の呼び出しだけが枠の回復を待つ
+            try:
+                await asyncio.wait_for(self._lock.acquire(), max(deadline - self._clock(), 0))
+            except asyncio.TimeoutError:
+                self._reject(self._wait_time(tokens) or max_wait)
+            try:
+                while True:
+                    wait = self._wait_time(tokens)
+                    if wait <= 0:
+                        break
+                    if self._clock() + wait > deadline:
+                        self._reject(wait)
+                    await asyncio.sleep(wait)
+                self._consume(tokens)
+            finally:
+                self._lock.release()
+        finally:
+            self._waiting -= 1
+            waited = self._clock() - started
+            self._wait_time_total += waited
+            self._wait_time_max = max(self._wait_time_max, waited)
+
+    def record_usage(self, estimated: int, actual: Optional[int]):
+        """見積もりと実績の差をトークンバケットに反映"""
+        if self.tokens is None or actual is None:
+            return
+        if actual < estimated:
+            self.tokens.refund(estimated - actual)
+        elif actual > estimated:
+            self.tokens.consume(actual - estimated)
+
+    def update_from_headers(self, headers: Mapping[str, str]):
+        """Azure の応答ヘッダーから残りクォータと待機時間を取り込む"""
+        remaining_requests = _header_float(headers, "x-ratelimit-remaining-requests")
+        if remaining_requests is not None and self.requests is not None:
+            self.requests.clamp(remaining_requests)
+        remaining_tokens = _header_float(headers, "x-ratelimit-remaining-tokens")
+        if remaining_tokens is not None and self.tokens is not None:
+            self.tokens.clamp(remaining_tokens)
+
+        retry_after = retry_after_seconds(headers)
+        if retry_after is not None:
+            self.pause(retry_after)
+
+    def pause(self, seconds: float):
+        """429 を受けたとき、指定秒数は新しいリクエストを送らない"""
+        self._throttled += 1
+        self._paused_until = max(self._paused_until, self._clock() + seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        """レート制限の統計情報"""
+        return {
+            "requests_available": round(self.requests.available(), 2) if self.requests else None,
+            "tokens_available": round(self.tokens.available(), 2) if self.tokens else None,
+            "paused_for": round(max(self._paused_until - self._clock(), 0.0), 3),
+            "admitted": self._admitted,
+            "queued": self._queued,
+            "rejected": self._rejected,
+            "upstream_throttled": self._throttled,
+            "wait_time_total": round(self._wait_time_total, 3),
+            "wait_time_max": round(self._wait_time_max, 3),
+        }
+
+def _header_float(headers: Mapping[str, str], name: str) -> Optional[float]:
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+def retry_after_seconds(headers: Mapping[str, str]) -> Optional[float]:
+    """retry-after-ms（Azure 独自、ミリ秒）か retry-after（秒）の値"""
+    retry_after_ms = _header_float(headers, "retry-after-ms")
+    if retry_after_ms is not None:
+        return retry_after_ms / 1000
+    return _header_float(headers, "retry-after")
+
+# デプロイメント毎のインスタンス
+_rate_limiters: Dict[str, RateLimiter] = {}
+
+def get_rate_limiter(deployment: str, rpm: Optional[int] = None, tpm: Optional[int] = None) -> Optional[RateLimiter]:
+    """デプロイメントのレート制限インスタンスを取得（無効時は None）
+
+    rpm/tpm を省略したデプロイメントには AZURE_OPENAI_RPM_LIMIT/TPM_LIMIT を使う。
+    """
+    if not AZURE_OPENAI_RATE_LIMIT_ENABLED:
+        return None
+    limiter = _rate_limiters.get(deployment)
+    if limiter is None:
+        limiter = _rate_limiters[deployment] = RateLimiter(
+            rpm=AZURE_OPENAI_RPM_LIMIT if rpm is None else rpm,
+            tpm=AZURE_OPENAI_TPM_LIMIT if tpm is None else tpm,
+        )
+    return limiter
@@ -0,0 +1,175 @@
+# -------------------------------------------------
+# ・ファイル名：request_coalescer.py
+# ・ファイル内容：同一リクエストの同時実行をまとめるシングルフライト
+# ・作成日時：2026/10/18 18:00:00  agent
+# -------------------------------------------------
+
+import asyncio
+import os
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+# コアレッシング設定
+LLM_COALESCING_ENABLED = os.getenv("LLM_COALESCING_ENABLED", "true").lower() == "true"
+# 配信中のストリーム毎に保持するチャンクの上限（UTF-8 バイト数）。超えたら古いチャンクから捨て、
+# 以降の同じリクエストは相乗りさせずに新たに呼び出す
+LLM_COALESCING_MAX_BYTES = int(os.getenv("LLM_COALESCING_MAX_BYTES", "262144"))
+
+class StreamOverrun(Exception):
+    """購読者の読み出しが遅れ、未読のチャンクが上限を超えて捨てられた"""
+
+class _InflightCall:
+    """実行中の上流呼び出しと、その結果を待っている呼び出し元の数"""
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class _StreamBroadcast:
+    """1 本の上流ストリームを複数の購読者に配信する
+
+    途中から参加した購読者にも、受信済みのチャンクを先頭から再生する。保持するチャンクが max_bytes
+    を超えたら古いものから捨て、途中からの参加は受け付けない（joinable が False になる）。
+    購読者が全員いなくなったら上流ストリームを打ち切る。
+    """
+
+    def __init__(self, source: AsyncIterator[str], max_bytes: int = LLM_COALESCING_MAX_BYTES):
+        self.chunks: deque = deque()
+        # chunks[0] の通し番号と、保持しているチャンクのバイト数
+        self.base = 0
+        self.size = 0
+        self.max_bytes = max_bytes
+        self.joinable = True
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._updated = asyncio.Event()
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    def _notify(self):
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    def _append(self, chunk: str):
+        self.chunks.append(chunk)
+        self.size += len(chunk.encode("utf-8"))
+        # 最新のチャンクは残す（購読者が読み切る前に捨てられた場合は StreamOverrun）
+        while self.size > self.max_bytes and len(self.chunks) > 1:
+            self.size -= len(self.chunks.popleft().encode("utf-8"))
+            self.base += 1
+            self.joinable = False
+
+    async def _pump(self, source: AsyncIterator[str]):
+        try:
+            async for chunk in source:
+                self._append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+            await source.aclose()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        self.subscribers += 1
+        # 次に返すチャンクの通し番号（yield の間に古いチャンクが捨てられるため、毎回 base から数える）
+        index = 0
+        try:
+            while True:
+                while index < self.base + len(self.chunks):
+                    if index < self.base:
+                        raise StreamOverrun("ストリームの読み出しが遅れ、未読のチャンクが捨てられました")
+                    yield self.chunks[index - self.base]
+                    index += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._updated.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                self.task.cancel()
+
+class RequestCoalescer:
+    """同じキーの呼び出しが実行中なら、新たに呼び出さずその結果を共有する"""
+
+    def __init__(self, max_stream_bytes: int = LLM_COALESCING_MAX_BYTES):
+        self.max_stream_bytes = max_stream_bytes
+        self._calls: Dict[str, _InflightCall] = {}
+        self._streams: Dict[str, _StreamBroadcast] = {}
+        self._upstream_calls = 0
+        self._coalesced_calls = 0
+        self._upstream_streams = 0
+        self._coalesced_streams = 0
+        self._unjoinable_streams = 0
+
+    async def run(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """factory() を実行（同じキーが実行中ならその結果を待つ）"""
+        entry = self._calls.get(key)
+        if entry is None:
+            entry = _InflightCall(asyncio.ensure_future(factory()))
+            self._calls[key] = entry
+            entry.task.add_done_callback(lambda _: self._forget(self._calls, key, entry))
+            self._upstream_calls += 1
+        else:
+            self._coalesced_calls += 1
+
+        entry.waiters += 1
+        try:
+            return await asyncio.shield(entry.task)
+        except asyncio.CancelledError:
+            # 最後の待ち手がキャンセルされたら上流呼び出しも止める
+            if entry.waiters == 1 and not entry.task.done():
+                entry.task.cancel()
+            raise
+        finally:
+            entry.waiters -= 1
+
+    def stream(self, key: str, factory: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """factory() のストリームを購読（同じキーが配信中ならそれに相乗りする）"""
+        broadcast = self._streams.get(key)
+        if broadcast is not None and not broadcast.done and not broadcast.joinable:
+            # 先頭のチャンクを捨て済みで再生できない
+            self._unjoinable_streams += 1
+        if broadcast is None or broadcast.done or not broadcast.joinable:
+            broadcast = _StreamBroadcast(factory(), self.max_stream_bytes)
+            self._streams[key] = broadcast
+            broadcast.task.add_done_callback(lambda _: self._forget(self._streams, key, broadcast))
+            self._upstream_streams += 1
+        else:
+            self._coalesced_streams += 1
+        return broadcast.subscribe()
+
+    @staticmethod
+    def _forget(table: dict, key: str, entry):
+        if table.get(key) is entry:
+            del table[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """コアレッシングの統計情報"""
+        return {
+            "inflight_calls": len(self._calls),
+            "inflight_streams": len(self._streams),
+            "upstream_calls": self._upstream_calls,
+            "coalesced_calls": self._coalesced_calls,
+            "upstream_streams": self._upstream_streams,
+            "coalesced_streams": self._coalesced_streams,
+            "unjoinable_streams": self._unjoinable_streams,
+        }
+
+# グローバルインスタンス
+_request_coalescer: Optional[RequestCoalescer] = None
+
+def get_request_coalescer() -> Optional[RequestCoalescer]:
+    """コアレッサーのシングルトンインスタンスを取得（無効時は None）"""
+    global _request_coalescer
+    if not LLM_COALESCING_ENABLED:
+        return None
+    if _request_coalescer is None:
+        _request_coalescer = RequestCoalescer()
+    return _request_coalescer
@@ -0,0 +1,245 @@
+# -------------------------------------------------
+# ・ファイル名：resilience.py
+# ・ファイル内容：Azure OpenAI 呼び出しのリトライとサーキットブレーカー
+# ・作成日時：2026/10/18 21:00:00  agent
+# -------------------------------------------------
+
+import asyncio
+import math
+import os
+import random
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, TypeVar
+
+import httpx
+import openai
+from rate_limiter import RateLimitExceeded
+
+# リトライ設定
+AZURE_OPENAI_MAX_RETRIES = int(os.getenv("AZURE_OPENAI_MAX_RETRIES", "2"))
+AZURE_OPENAI_RETRY_BASE_DELAY = float(os.getenv("AZURE_OPENAI_RETRY_BASE_DELAY", "0.5"))
+AZURE_OPENAI_RETRY_MAX_DELAY = float(os.getenv("AZURE_OPENAI_RETRY_MAX_DELAY", "8"))
+
+# タイムアウト設定（接続は AZURE_OPENAI_CONNECT_TIMEOUT）
+AZURE_OPENAI_FIRST_TOKEN_TIMEOUT = float(os.getenv("AZURE_OPENAI_FIRST_TOKEN_TIMEOUT", "30"))
+AZURE_OPENAI_TOTAL_TIMEOUT = float(os.getenv("AZURE_OPENAI_TOTAL_TIMEOUT", "120"))
+
+# サーキットブレーカー設定
+CIRCUIT_BREAKER_ENABLED = os.getenv("CIRCUIT_BREAKER_ENABLED", "true").lower() == "true"
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_BREAKER_FAILURE_THRESHOLD", "5"))
+CIRCUIT_BREAKER_RESET_TIMEOUT = float(os.getenv("CIRCUIT_BREAKER_RESET_TIMEOUT", "30"))
+CIRCUIT_BREAKER_HALF_OPEN_MAX_CALLS = int(os.getenv("CIRCUIT_BREAKER_HALF_OPEN_MAX_CALLS", "1"))
+
+T = TypeVar("T")
+
+class UpstreamTimeout(Exception):
+    """最初のトークンまで、または応答全体が制限時間を超えた"""
+
+class CircuitOpenError(Exception):
+    """サーキットブレーカーが開いているため呼び出さなかった"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        """Retry-After ヘッダーの値（整数秒、最低 1 秒）"""
+        return str(max(1, math.ceil(self.retry_after)))
+
+def is_upstream_failure(exc: BaseException) -> bool:
+    """上流の障害とみなす例外か（リトライとブレーカーの対象）
+
+    接続エラー・タイムアウト・5xx が対象。4xx はリクエスト側の問題で、
+    429 はレート制限側で待ち合わせるため対象外とする。
+    """
+    if isinstance(exc, (UpstreamTimeout, asyncio.TimeoutError, httpx.TransportError)):
+        return True
+    if isinstance(exc, openai.APIConnectionError):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code >= 500 or exc.status_code == 408
+    return False
+
+class RetryPolicy:
+    """decorrelated jitter による指数バックオフ
+
+    待ち時間は min(max_delay, uniform(base_delay, 直前の待ち時間 × 3))。
+    同時に失敗した呼び出しのリトライ時刻がばらけるため、復旧直後に集中しない。
+    """
+
+    def __init__(
+        self,
+        max_retries: int = AZURE_OPENAI_MAX_RETRIES,
+        base_delay: float = AZURE_OPENAI_RETRY_BASE_DELAY,
+        max_delay: float = AZURE_OPENAI_RETRY_MAX_DELAY,
+        rng: Optional[random.Random] = None,
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._rng = rng or random.Random()
+
+    def delays(self) -> Iterator[float]:
+        """リトライ毎の待ち時間（max_retries 個）"""
+        delay = self.base_delay
+        for _ in range(self.max_retries):
+            delay = min(self.max_delay, self._rng.uniform(self.base_delay, delay * 3))
+            yield delay
+
+class CircuitBreaker:
+    """closed → open → half_open の 3 状態を持つサーキットブレーカー
+
+    closed: 連続失敗が failure_threshold に達したら open。
+    open: reset_timeout 秒間は呼び出さずに CircuitOpenError。経過後 half_open。
+    half_open: half_open_max_calls 件だけ試し、成功すれば closed、失敗すれば再び open。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str = "azure_openai",
+        failure_threshold: int = CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+        reset_timeout: float = CIRCUIT_BREAKER_RESET_TIMEOUT,
+        half_open_max_calls: int = CIRCUIT_BREAKER_HALF_OPEN_MAX_CALLS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._listeners: List[Callable[[str, str, str], None]] = []
+
+        # 統計情報
+        self._rejected = 0
+        self._transitions: deque = deque(maxlen=20)
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._transition(self.HALF_OPEN)
+        return self._state
+
+    def add_listener(self, listener: Callable[[str, str, str], None]):
+        """状態遷移の通知先を登録（引数は名前・遷移前・遷移後）"""
+        self._listeners.append(listener)
+
+    def _transition(self, new_state: str):
+        old_state, self._state = self._state, new_state
+        self._probes = 0
+        if new_state == self.OPEN:
+            self._opened_at = self._clock()
+        if new_state == self.CLOSED:
+            self._failures = 0
+        self._transitions.append({
+            "from": old_state,
+            "to": new_state,
+            "at": datetime.now().isoformat(),
+        })
+        print(f"サーキットブレーカー[{self.name}]: {old_state} → {new_state}")
+        for listener in self._listeners:
+            listener(self.name, old_state, new_state)
+
+    def before_call(self):
+        """呼び出してよいか判定（だめなら CircuitOpenError）"""
+        state = self.state
+        if state == self.OPEN:
+            self._rejected += 1
+            retry_after = self.reset_timeout - (self._clock() - self._opened_at)
+            raise CircuitOpenError("Azure OpenAI が応答しないため一時的に呼び出しを停止しています", retry_after)
+        if state == self.HALF_OPEN:
+            if self._probes >= self.half_open_max_calls:
+                self._rejected += 1
+                raise CircuitOpenError("Azure OpenAI の復旧を確認中です", self.reset_timeout)
+            self._probes += 1
+
+    def record_success(self):
+        if self._state == self.HALF_OPEN:
+            self._transition(self.CLOSED)
+        self._failures = 0
+
+    def record_failure(self):
+        self._failures += 1
+        if self._state == self.HALF_OPEN:
+            self._transition(self.OPEN)
+        elif self._state == self.CLOSED and self._failures >= self.failure_threshold:
+            self._transition(self.OPEN)
+
+    def release(self):
+        """成功とも失敗とも判定しない結果（429 など）で試行枠だけ返す"""
+        if self._state == self.HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def record_outcome(self, exc: Optional[BaseException] = None):
+        """呼び出し結果を分類して記録（上流障害のみ失敗として数える）"""
+        if exc is None:
+            self.record_success()
+        elif isinstance(exc, (asyncio.CancelledError, openai.RateLimitError, RateLimitExceeded)):
+            self.release()
+        elif is_upstream_failure(exc):
+            self.record_failure()
+        else:
+            # 4xx は上流が応答できている
+            self.record_success()
+
+    def stats(self) -> Dict[str, Any]:
+        """サーキットブレーカーの状態"""
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "rejected": self._rejected,
+            "transitions": list(self._transitions),
+        }
+
+async def call_with_retries(
+    attempt: Callable[[], Awaitable[T]],
+    retry_policy: RetryPolicy,
+    breaker: Optional[CircuitBreaker] = None,
+    sleep: Callable[[float], Awaitable[Any]] = asyncio.sleep,
+) -> T:
+    """attempt() を上流障害の間だけリトライしながら実行
+
+    ストリーミングでは attempt() が最初のトークンを受け取るまでを担当するため、
+    ユーザーに何か返した後にリトライすることはない。
+    """
+    delays = retry_policy.delays()
+    while True:
+        if breaker is not None:
+            breaker.before_call()
+        try:
+            result = await attempt()
+        except BaseException as e:
+            if breaker is not None:
+                breaker.record_outcome(e)
+            if not isinstance(e, Exception) or not is_upstream_failure(e):
+                raise
+            delay = next(delays, None)
+            if delay is None:
+                raise
+            await sleep(delay)
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return result
+
+# デプロイメント毎のインスタンス
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+
+def get_circuit_breaker(deployment: str) -> Optional[CircuitBreaker]:
+    """デプロイメントのサーキットブレーカーを取得（無効時は None）"""
+    if not CIRCUIT_BREAKER_ENABLED:
+        return None
+    breaker = _circuit_breakers.get(deployment)
+    if breaker is None:
+        breaker = _circuit_breakers[deployment] = CircuitBreaker(name=deployment)
+    return breaker
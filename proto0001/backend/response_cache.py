@@ -0,0 +1,122 @@
+# -------------------------------------------------
+# ・ファイル名：response_cache.py
+# ・ファイル内容：LLM 応答の完全一致キャッシュ（TTL・LRU）
+# ・作成日時：2026/10/18 17:00:00  agent
+# -------------------------------------------------
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Optional
+
+# キャッシュ設定
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "false").lower() == "true"
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", "3600"))
+LLM_CACHE_ALLOW_NONZERO_TEMPERATURE = os.getenv("LLM_CACHE_ALLOW_NONZERO_TEMPERATURE", "false").lower() == "true"
+LLM_CACHE_STREAM_CHUNK_CHARS = int(os.getenv("LLM_CACHE_STREAM_CHUNK_CHARS", "16"))
+# ストリーミングの応答をキャッシュ用に組み立てる上限（UTF-8 バイト数。超えた応答はキャッシュしない）
+LLM_CACHE_MAX_RESPONSE_BYTES = int(os.getenv("LLM_CACHE_MAX_RESPONSE_BYTES", "262144"))
+
+def request_cache_key(chat_request, deployment: str) -> str:
+    """ChatRequest を正規化した JSON のハッシュ"""
+    canonical = {
+        "deployment": deployment,
+        "system_prompt": chat_request.system_prompt,
+        "messages": [[msg.role, msg.content] for msg in chat_request.messages],
+        "temperature": chat_request.temperature,
+        "max_tokens": chat_request.max_tokens,
+    }
+    raw = json.dumps(canonical, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+async def replay_stream(message: str, chunk_chars: int = LLM_CACHE_STREAM_CHUNK_CHARS) -> AsyncIterator[str]:
+    """キャッシュ済みの応答を疑似ストリームとして返す"""
+    for start in range(0, len(message), chunk_chars):
+        yield message[start:start + chunk_chars]
+        # 他のリクエストに処理を譲る
+        await asyncio.sleep(0)
+
+class ResponseCache:
+    """サイズ上限付き LRU と、エントリ毎の TTL を持つ応答キャッシュ"""
+
+    def __init__(
+        self,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        ttl: float = LLM_CACHE_TTL_SECONDS,
+        allow_nonzero_temperature: bool = LLM_CACHE_ALLOW_NONZERO_TEMPERATURE,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.allow_nonzero_temperature = allow_nonzero_temperature
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._bypassed = 0
+        self._evictions = 0
+        self._expired = 0
+
+    def is_cacheable(self, chat_request) -> bool:
+        """temperature > 0 は応答が毎回変わるため、明示的に許可された場合のみ対象"""
+        if self.allow_nonzero_temperature or not chat_request.temperature:
+            return True
+        self._bypassed += 1
+        return False
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self._misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self._expired += 1
+            self._misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self._hits += 1
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """キャッシュの統計情報"""
+        lookups = self._hits + self._misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+            "bypassed": self._bypassed,
+            "evictions": self._evictions,
+            "expired": self._expired,
+        }
+
+# グローバルインスタンス
+_response_cache: Optional[ResponseCache] = None
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """応答キャッシュのシングルトンインスタンスを取得（無効時は None）"""
+    global _response_cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+    return _response_cache
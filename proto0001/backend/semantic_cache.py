@@ -0,0 +1,432 @@
+# -------------------------------------------------
+# ・ファイル名：semantic_cache.py
+# ・ファイル内容：LLM 応答の意味的キャッシュ（質問の埋め込みベクトルの類似度で検索）
+# ・作成日時：2026/10/19 07:00:00  agent
+# -------------------------------------------------
+#
+# 完全一致キャッシュ（response_cache.py）では拾えない言い換えの質問に、過去の応答を返す。
+# 最後のユーザーメッセージを埋め込み、同じシステムプロンプト（とデプロイメント・生成パラメータ）の
+# 過去の質問のうち、コサイン類似度が閾値以上で最も近いものの応答を使う。
+# 索引は NumPy の行列の全件検索（数万件程度までは 1 回数ミリ秒）。
+
+import hashlib
+import json
+import os
+import time
+import unicodedata
+import zlib
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+# 意味的キャッシュ設定
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+# 空なら埋め込み関数毎の既定値（hashing は 0.99、azure は 0.9）
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD") or 0) or None
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "10000"))
+SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "86400"))
+# 空なら保存しない。指定すると起動時に読み込み、終了時に保存する（.npz）
+SEMANTIC_CACHE_INDEX_PATH = os.getenv("SEMANTIC_CACHE_INDEX_PATH", "")
+# hashing: 文字 n-gram のハッシュ（外部呼び出しなし）/ azure: Azure OpenAI の埋め込みデプロイメント
+SEMANTIC_CACHE_EMBEDDING = os.getenv("SEMANTIC_CACHE_EMBEDDING", "azure")
+SEMANTIC_CACHE_EMBEDDING_DEPLOYMENT = os.getenv("SEMANTIC_CACHE_EMBEDDING_DEPLOYMENT", "text-embedding-3-small")
+SEMANTIC_CACHE_HASHING_DIM = int(os.getenv("SEMANTIC_CACHE_HASHING_DIM", "1024"))
+# hashing は表記の近さしか測れず、1 語だけ違う長い質問（「交通費」と「宿泊費」など）も 0.9 を超える。
+# 空白・記号・全角半角などの表記揺れを拾う用途と理解したうえで明示的に有効にする
+SEMANTIC_CACHE_ALLOW_HASHING = os.getenv("SEMANTIC_CACHE_ALLOW_HASHING", "false").lower() == "true"
+# 前の会話に依存する質問（「それはなぜ？」など）を取り違えないよう、既定では 1 往復目のみ対象
+SEMANTIC_CACHE_SINGLE_TURN_ONLY = os.getenv("SEMANTIC_CACHE_SINGLE_TURN_ONLY", "true").lower() == "true"
+SEMANTIC_CACHE_MAX_QUESTION_CHARS = int(os.getenv("SEMANTIC_CACHE_MAX_QUESTION_CHARS", "2000"))
+SEMANTIC_CACHE_ALLOW_NONZERO_TEMPERATURE = os.getenv(
+    "SEMANTIC_CACHE_ALLOW_NONZERO_TEMPERATURE", "false"
+).lower() == "true"
+
+def normalize_question(text: str) -> str:
+    """全角・半角と大文字・小文字を揃え、空白と記号を除く"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(ch for ch in text if unicodedata.category(ch)[0] in "LN")
+
+class HashingEmbedder:
+    """文字 2・3-gram を固定次元にハッシュした埋め込み（オフラインで動作、表記の近さを測る）
+
+    日本語は単語の区切りが無いため文字 n-gram を使う。ハッシュは crc32（プロセスをまたいで同じ値）。
+    意味は測れないため、1 語だけ違う質問を取り違えないよう閾値は高くする（表記揺れのみ拾う）。
+    """
+
+    default_threshold = 0.99
+
+    def __init__(self, dim: int = SEMANTIC_CACHE_HASHING_DIM, ngrams=(2, 3)):
+        self.dim = dim
+        self.ngrams = tuple(ngrams)
+        self.name = f"hashing-{dim}-{'-'.join(map(str, self.ngrams))}"
+
+    def embed_sync(self, text: str) -> np.ndarray:
+        text = normalize_question(text)
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for n in self.ngrams:
+            for start in range(max(len(text) - n + 1, 1 if text else 0)):
+                h = zlib.crc32(text[start:start + n].encode("utf-8"))
+                vector[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
+
+    async def embed(self, text: str) -> np.ndarray:
+        return self.embed_sync(text)
+
+class AzureEmbedder:
+    """Azure OpenAI の埋め込みデプロイメント（言い換えに強いが、問い合わせ毎に API を呼ぶ）"""
+
+    default_threshold = 0.9
+
+    def __init__(self, deployment: str = SEMANTIC_CACHE_EMBEDDING_DEPLOYMENT, client=None):
+        if client is None:
+            from openai import AsyncAzureOpenAI
+            endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+            api_key = os.getenv("AZURE_OPENAI_API_KEY")
+            if not endpoint or not api_key:
+                raise ValueError("SEMANTIC_CACHE_EMBEDDING=azure には AZURE_OPENAI_ENDPOINT・AZURE_OPENAI_API_KEY が必要です")
+            client = AsyncAzureOpenAI(
+                azure_endpoint=endpoint,
+                api_key=api_key,
+                api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-01"),
+            )
+        self.client = client
+        self.deployment = deployment
+        self.name = f"azure-{deployment}"
+
+    async def embed(self, text: str) -> np.ndarray:
+        response = await self.client.embeddings.create(model=self.deployment, input=text)
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
+
+def create_embedder(kind: str = SEMANTIC_CACHE_EMBEDDING):
+    """SEMANTIC_CACHE_EMBEDDING に応じた埋め込み関数"""
+    if kind == "hashing":
+        return HashingEmbedder()
+    if kind == "azure":
+        return AzureEmbedder()
+    raise ValueError("SEMANTIC_CACHE_EMBEDDING は hashing・azure のいずれかを指定してください")
+
+class VectorIndex:
+    """正規化済みベクトルの行列と、行毎の名前空間・有効期限・最終利用順
+
+    削除は末尾の行を空いた位置へ移して詰める（行列は常に先頭 size 行が有効）。
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.size = 0
+        self._vectors = np.zeros((16, dim), dtype=np.float32)
+        self._namespace_ids = np.zeros(16, dtype=np.int32)
+        self._expires_at = np.zeros(16, dtype=np.float64)
+        self._last_used = np.zeros(16, dtype=np.int64)
+        self._namespaces: Dict[str, int] = {}
+        self.questions: List[str] = []
+        self.answers: List[str] = []
+        self._clock = 0
+
+    def _tick(self) -> int:
+        self._clock += 1
+        return self._clock
+
+    def _grow(self):
+        capacity = len(self._vectors) * 2
+        self._vectors = np.resize(self._vectors, (capacity, self.dim))
+        for name in ("_namespace_ids", "_expires_at", "_last_used"):
+            setattr(self, name, np.resize(getattr(self, name), capacity))
+
+    def namespace_id(self, namespace: str, create: bool = False) -> Optional[int]:
+        ns_id = self._namespaces.get(namespace)
+        if ns_id is None and create:
+            ns_id = self._namespaces[namespace] = len(self._namespaces)
+        return ns_id
+
+    def add(self, namespace: str, vector: np.ndarray, question: str, answer: str, expires_at: float) -> int:
+        if self.size == len(self._vectors):
+            self._grow()
+        row = self.size
+        self._vectors[row] = vector
+        self._namespace_ids[row] = self.namespace_id(namespace, create=True)
+        self._expires_at[row] = expires_at
+        self._last_used[row] = self._tick()
+        self.questions.append(question)
+        self.answers.append(answer)
+        self.size += 1
+        return row
+
+    def remove(self, row: int):
+        last = self.size - 1
+        if row != last:
+            self._vectors[row] = self._vectors[last]
+            self._namespace_ids[row] = self._namespace_ids[last]
+            self._expires_at[row] = self._expires_at[last]
+            self._last_used[row] = self._last_used[last]
+            self.questions[row] = self.questions[last]
+            self.answers[row] = self.answers[last]
+        self.questions.pop()
+        self.answers.pop()
+        self.size = last
+
+    def search(self, namespace: str, vector: np.ndarray, now: float):
+        """同じ名前空間で有効期限内の最も近い行と類似度（無ければ (None, None)）"""
+        ns_id = self.namespace_id(namespace)
+        if ns_id is None or self.size == 0:
+            return None, None
+        scores = self._vectors[:self.size] @ vector
+        valid = (self._namespace_ids[:self.size] == ns_id) & (self._expires_at[:self.size] > now)
+        if not valid.any():
+            return None, None
+        scores = np.where(valid, scores, -np.inf)
+        row = int(np.argmax(scores))
+        return row, float(scores[row])
+
+    def touch(self, row: int):
+        self._last_used[row] = self._tick()
+
+    def least_recently_used(self) -> int:
+        return int(np.argmin(self._last_used[:self.size]))
+
+    def expired_rows(self, now: float) -> List[int]:
+        return np.flatnonzero(self._expires_at[:self.size] <= now).tolist()
+
+    def find_question(self, namespace: str, question: str) -> Optional[int]:
+        ns_id = self.namespace_id(namespace)
+        if ns_id is None:
+            return None
+        for row in np.flatnonzero(self._namespace_ids[:self.size] == ns_id).tolist():
+            if self.questions[row] == question:
+                return row
+        return None
+
+    def save(self, path: str, embedder_name: str):
+        """一時ファイルに書いてから置き換える（書き込み途中で落ちても前回の索引が残る）"""
+        n = self.size
+        meta = {
+            "embedder": embedder_name,
+            "dim": self.dim,
+            "namespaces": sorted(self._namespaces, key=self._namespaces.get),
+            "questions": self.questions,
+            "answers": self.answers,
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                vectors=self._vectors[:n],
+                namespace_ids=self._namespace_ids[:n],
+                expires_at=self._expires_at[:n],
+                last_used=self._last_used[:n],
+                meta=np.array(json.dumps(meta, ensure_ascii=False)),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, embedder_name: str, dim: Optional[int] = None) -> "VectorIndex":
+        """保存した索引を読み込む（埋め込み関数や次元が違う場合は ValueError）"""
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta["embedder"] != embedder_name or (dim is not None and meta["dim"] != dim):
+                raise ValueError(f"埋め込み関数が異なる索引です（{meta['embedder']} / {meta['dim']} 次元）")
+            index = cls(meta["dim"])
+            n = len(meta["questions"])
+            while len(index._vectors) < n:
+                index._grow()
+            index._vectors[:n] = data["vectors"]
+            index._namespace_ids[:n] = data["namespace_ids"]
+            index._expires_at[:n] = data["expires_at"]
+            index._last_used[:n] = data["last_used"]
+        index._namespaces = {namespace: i for i, namespace in enumerate(meta["namespaces"])}
+        index.questions = list(meta["questions"])
+        index.answers = list(meta["answers"])
+        index.size = n
+        index._clock = int(index._last_used[:n].max()) if n else 0
+        return index
+
+@dataclass
+class SemanticQuery:
+    """検索と登録で使い回す、リクエストの名前空間と質問のベクトル"""
+    namespace: str
+    question: str
+    vector: np.ndarray
+
+@dataclass
+class SemanticHit:
+    message: str
+    similarity: float
+    question: str
+
+def semantic_namespace(chat_request, deployment: str) -> str:
+    """質問以外で応答を左右するもの（デプロイメント・システムプロンプト・生成パラメータ）"""
+    canonical = [deployment, chat_request.system_prompt, chat_request.temperature, chat_request.max_tokens]
+    raw = json.dumps(canonical, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class SemanticCache:
+    """質問の埋め込みの類似度で引く応答キャッシュ（件数上限を超えたら最も古く使われたものを捨てる）"""
+
+    def __init__(
+        self,
+        embedder=None,
+        threshold: Optional[float] = SEMANTIC_CACHE_THRESHOLD,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+        ttl: float = SEMANTIC_CACHE_TTL_SECONDS,
+        index_path: str = SEMANTIC_CACHE_INDEX_PATH,
+        single_turn_only: bool = SEMANTIC_CACHE_SINGLE_TURN_ONLY,
+        max_question_chars: int = SEMANTIC_CACHE_MAX_QUESTION_CHARS,
+        allow_nonzero_temperature: bool = SEMANTIC_CACHE_ALLOW_NONZERO_TEMPERATURE,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.embedder = embedder if embedder is not None else HashingEmbedder()
+        self.threshold = threshold if threshold is not None else getattr(self.embedder, "default_threshold", 0.9)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.index_path = index_path
+        self.single_turn_only = single_turn_only
+        self.max_question_chars = max_question_chars
+        self.allow_nonzero_temperature = allow_nonzero_temperature
+        self._clock = clock
+        self.index: Optional[VectorIndex] = None
+
+        # 統計情報
+        self._hits = 0
+        self._misses = 0
+        self._bypassed = 0
+        self._evictions = 0
+        self._expired = 0
+        self._embed_errors = 0
+        self._hit_similarity = 0.0
+        self._embed_seconds = 0.0
+        self._search_seconds = 0.0
+        self._searches = 0
+
+        if index_path and os.path.exists(index_path):
+            self.load()
+
+    def question_of(self, chat_request) -> Optional[str]:
+        """対象のリクエストなら最後のユーザーメッセージを返す（対象外は None）"""
+        if chat_request.temperature and not self.allow_nonzero_temperature:
+            return None
+        turns = [msg for msg in chat_request.messages if msg.role != "system"]
+        if not turns or turns[-1].role != "user":
+            return None
+        if self.single_turn_only and len(turns) > 1:
+            return None
+        question = turns[-1].content.strip()
+        if not question or len(question) > self.max_question_chars:
+            return None
+        return question
+
+    async def query_for(self, chat_request, deployment: str) -> Optional[SemanticQuery]:
+        """検索用のクエリを作る（対象外・埋め込みに失敗した場合は None）"""
+        question = self.question_of(chat_request)
+        if question is None:
+            self._bypassed += 1
+            return None
+        started = time.perf_counter()
+        try:
+            vector = await self.embedder.embed(question)
+        except Exception as e:
+            # 埋め込みの失敗でチャットを失敗させない
+            self._embed_errors += 1
+            print(f"意味的キャッシュの埋め込みエラー: {str(e)}")
+            return None
+        finally:
+            self._embed_seconds += time.perf_counter() - started
+        if self.index is None:
+            self.index = VectorIndex(len(vector))
+        return SemanticQuery(semantic_namespace(chat_request, deployment), question, vector)
+
+    def search(self, query: SemanticQuery) -> Optional[SemanticHit]:
+        """閾値以上で最も近い質問の応答"""
+        started = time.perf_counter()
+        row, similarity = self.index.search(query.namespace, query.vector, self._clock())
+        self._search_seconds += time.perf_counter() - started
+        self._searches += 1
+        if row is None or similarity < self.threshold:
+            self._misses += 1
+            return None
+        self.index.touch(row)
+        self._hits += 1
+        self._hit_similarity += similarity
+        return SemanticHit(self.index.answers[row], similarity, self.index.questions[row])
+
+    def add(self, query: SemanticQuery, message: str):
+        """応答を登録する（同じ質問が登録済みなら置き換える）"""
+        if not message:
+            return
+        now = self._clock()
+        index = self.index
+        for row in sorted(index.expired_rows(now), reverse=True):
+            index.remove(row)
+            self._expired += 1
+        row = index.find_question(query.namespace, query.question)
+        if row is not None:
+            index.remove(row)
+        while index.size >= self.max_entries > 0:
+            index.remove(index.least_recently_used())
+            self._evictions += 1
+        if self.max_entries > 0:
+            index.add(query.namespace, query.vector, query.question, message, now + self.ttl)
+
+    def save(self):
+        """索引をファイルに保存（index_path 未指定・未登録なら何もしない）"""
+        if not self.index_path or self.index is None:
+            return
+        self.index.save(self.index_path, self.embedder.name)
+
+    def load(self):
+        """保存した索引を読み込む（読めない場合は空の索引から始める）"""
+        try:
+            self.index = VectorIndex.load(self.index_path, self.embedder.name, getattr(self.embedder, "dim", None))
+        except Exception as e:
+            print(f"意味的キャッシュの索引を読み込めませんでした: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """キャッシュの統計情報"""
+        lookups = self._hits + self._misses
+        embeds = lookups + self._embed_errors
+        return {
+            "entries": self.index.size if self.index else 0,
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "embedder": self.embedder.name,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+            "hit_avg_similarity": round(self._hit_similarity / self._hits, 4) if self._hits else None,
+            "bypassed": self._bypassed,
+            "evictions": self._evictions,
+            "expired": self._expired,
+            "embed_errors": self._embed_errors,
+            "embed_avg_ms": round(self._embed_seconds / embeds * 1000, 3) if embeds else None,
+            "search_avg_ms": round(self._search_seconds / self._searches * 1000, 3) if self._searches else None,
+        }
+
+# グローバルインスタンス
+_semantic_cache: Optional[SemanticCache] = None
+_hashing_refused = False
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """意味的キャッシュのシングルトンインスタンスを取得（無効時は None）"""
+    global _semantic_cache, _hashing_refused
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    if SEMANTIC_CACHE_EMBEDDING == "hashing" and not SEMANTIC_CACHE_ALLOW_HASHING:
+        if not _hashing_refused:
+            _hashing_refused = True
+            print("SEMANTIC_CACHE_EMBEDDING=hashing は SEMANTIC_CACHE_ALLOW_HASHING=true の場合のみ有効です"
+                  "（意味的キャッシュは無効のまま）")
+        return None
+    if _semantic_cache is None:
+        _semantic_cache = SemanticCache(create_embedder())
+    return _semantic_cache
+
+def close_semantic_cache():
+    """索引を保存する"""
+    if _semantic_cache is not None:
+        try:
+            _semantic_cache.save()
+        except Exception as e:
+            print(f"意味的キャッシュの索引を保存できませんでした: {str(e)}")
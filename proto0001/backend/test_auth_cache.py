@@ -0,0 +1,84 @@
+# -------------------------------------------------
+# ・ファイル名：test_auth_cache.py
+# ・ファイル内容：検証済み JWT・ユーザー情報のキャッシュの単体テスト
+# ・作成日時：2026/10/19 03:00:00  agent
+# -------------------------------------------------
+
+import time
+import pytest
+import jwt
+from unittest.mock import AsyncMock
+from auth_cache import AuthCache
+
+SECRET = "test-secret"
+
+def make_token(sub="testAI", exp_in=60.0) -> str:
+    return jwt.encode({"sub": sub, "exp": int(time.time() + exp_in)}, SECRET, algorithm="HS256")
+
+class CountingDecoder:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, token: str) -> dict:
+        self.calls += 1
+        return jwt.decode(token, SECRET, algorithms=["HS256"])
+
+class TestTokenCache:
+    def test_verified_token_is_cached(self):
+        """2 回目以降は署名検証をせずにユーザー名を返すこと"""
+        cache = AuthCache(token_enabled=True)
+        decode = CountingDecoder()
+        token = make_token()
+        assert cache.verify(token, decode) == "testAI"
+        assert cache.verify(token, decode) == "testAI"
+        assert cache.verify(token, decode) == "testAI"
+        assert decode.calls == 1
+        stats = cache.stats()
+        assert stats["tokens"]["hits"] == 2
+        assert stats["verify_count"] == 3
+        assert stats["verify_hit_avg_us"] is not None
+
+    def test_cache_expires_with_token(self):
+        """キャッシュの有効期限がトークンの exp に揃い、期限切れのトークンは保持しないこと"""
+        cache = AuthCache(token_enabled=True)
+        token = make_token(exp_in=30)
+        exp = jwt.decode(token, SECRET, algorithms=["HS256"])["exp"]
+        cache.verify(token, CountingDecoder())
+        expires_at, _ = next(iter(cache.tokens._entries.values()))
+        assert expires_at - time.monotonic() == pytest.approx(exp - time.time(), abs=1)
+
+        # 検証時点で exp を過ぎている（時計のずれなど）場合はキャッシュしない
+        late = AuthCache(token_enabled=True, clock=lambda: exp + 1)
+        assert late.verify(token, CountingDecoder()) == "testAI"
+        assert late.stats()["tokens"]["entries"] == 0
+
+        with pytest.raises(jwt.ExpiredSignatureError):
+            cache.verify(make_token(exp_in=-10), CountingDecoder())
+
+    def test_invalid_token_is_not_cached(self):
+        """署名が不正なトークンはキャッシュされず、毎回エラーになること"""
+        cache = AuthCache(token_enabled=True)
+        forged = jwt.encode({"sub": "testAI", "exp": int(time.time() + 60)}, "other", algorithm="HS256")
+        for _ in range(2):
+            with pytest.raises(jwt.InvalidSignatureError):
+                cache.verify(forged, CountingDecoder())
+        assert cache.stats()["tokens"]["entries"] == 0
+
+class TestUserCache:
+    @pytest.mark.asyncio
+    async def test_user_record_is_cached_when_enabled(self):
+        """有効時は 2 回目以降 DB を参照しないこと"""
+        cache = AuthCache(user_enabled=True)
+        load = AsyncMock(return_value={"id": 1, "username": "testAI"})
+        assert await cache.get_user("testAI", load) == {"id": 1, "username": "testAI"}
+        assert await cache.get_user("testAI", load) == {"id": 1, "username": "testAI"}
+        assert load.await_count == 1
+
+    @pytest.mark.asyncio
+    async def test_user_cache_disabled_always_loads(self):
+        """無効時は毎回取得し、見つからないユーザーはキャッシュしないこと"""
+        cache = AuthCache(user_enabled=False)
+        load = AsyncMock(return_value=None)
+        assert await cache.get_user("ghost", load) is None
+        assert await cache.get_user("ghost", load) is None
+        assert load.await_count == 2
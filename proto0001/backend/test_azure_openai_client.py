@@ -0,0 +1,114 @@
+# -------------------------------------------------
+# ・ファイル名：test_azure_openai_client.py
+# ・ファイル内容：Azure OpenAI クライアントの単体テスト
+# ・作成日時：2026/10/18 12:00:00  agent
+# -------------------------------------------------
+
+import json
+import asyncio
+import pytest
+import httpx
+from azure_openai_client import AzureOpenAIClient, ChatRequest, ChatMessage
+
+def completion_body(content: str) -> dict:
+    """chat.completions の非ストリーミング応答"""
+    return {
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "gpt-35-turbo",
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 5, "completion_tokens": 3, "total_tokens": 8},
+    }
+
+def stream_body(pieces) -> bytes:
+    """chat.completions のストリーミング応答（SSE）"""
+    events = [
+        # Azure はコンテンツフィルター結果のみのチャンクを先頭に送る
+        {"id": "", "object": "", "created": 0, "model": "", "choices": [], "prompt_filter_results": []},
+    ]
+    for piece in pieces:
+        events.append({
+            "id": "chatcmpl-test",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": "gpt-35-turbo",
+            "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+        })
+    lines = [f"data: {json.dumps(event)}\n\n" for event in events]
+    lines.append("data: [DONE]\n\n")
+    return "".join(lines).encode("utf-8")
+
+def make_client(handler) -> AzureOpenAIClient:
+    return AzureOpenAIClient(
+        endpoint="https://example.openai.azure.com/",
+        api_key="test-key",
+        api_version="2024-02-15-preview",
+        model_name="gpt-35-turbo",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+
+def make_request(content: str = "こんにちは") -> ChatRequest:
+    return ChatRequest(
+        messages=[ChatMessage(role="user", content=content)],
+        system_prompt="テスト用システムプロンプト",
+    )
+
+class TestAzureOpenAIClient:
+    @pytest.mark.asyncio
+    async def test_chat_completion(self):
+        """非ストリーミング応答が ChatResponse に変換されること"""
+        requests = []
+
+        def handler(request: httpx.Request):
+            requests.append(json.loads(request.content))
+            return httpx.Response(200, json=completion_body("こんにちは！"))
+
+        client = make_client(handler)
+        response = await client.chat_completion(make_request())
+
+        assert response.message == "こんにちは！"
+        assert response.usage["total_tokens"] == 8
+        assert requests[0]["messages"][0] == {"role": "system", "content": "テスト用システムプロンプト"}
+        assert requests[0]["stream"] is False
+
+    @pytest.mark.asyncio
+    async def test_chat_completion_stream(self):
+        """ストリーミング応答の差分だけが順に返ること"""
+        def handler(request: httpx.Request):
+            return httpx.Response(
+                200,
+                content=stream_body(["こん", "にち", "は"]),
+                headers={"content-type": "text/event-stream"},
+            )
+
+        client = make_client(handler)
+        chunks = [chunk async for chunk in client.chat_completion_stream(make_request())]
+        assert chunks == ["こん", "にち", "は"]
+
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_do_not_block(self):
+        """応答待ちの間もイベントループが他の呼び出しを処理できること"""
+        async def handler(request: httpx.Request):
+            await asyncio.sleep(0.2)
+            return httpx.Response(200, json=completion_body("ok"))
+
+        client = make_client(handler)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await asyncio.gather(*(client.chat_completion(make_request(f"質問{i}")) for i in range(10)))
+        assert loop.time() - started < 1.0
+
+    @pytest.mark.asyncio
+    async def test_error_is_wrapped(self):
+        """API エラーが日本語メッセージ付きの例外になること"""
+        def handler(request: httpx.Request):
+            return httpx.Response(400, json={"error": {"message": "bad request", "code": "400"}})
+
+        client = make_client(handler)
+        with pytest.raises(Exception, match="Azure OpenAI APIの呼び出しでエラーが発生しました"):
+            await client.chat_completion(make_request())
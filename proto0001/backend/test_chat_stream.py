@@ -0,0 +1,199 @@
+# -------------------------------------------------
+# ・ファイル名：test_chat_stream.py
+# ・ファイル内容：SSE 配信（結合・ハートビート・再接続）の単体テスト
+# ・作成日時：2026/10/19 00:00:00  agent
+# -------------------------------------------------
+
+import asyncio
+import json
+import pytest
+from chat_stream import ChatStreamRegistry, ReplayUnavailable, ResponseBuffer
+
+async def upstream(pieces, delay=0.0, closed=None):
+    try:
+        for piece in pieces:
+            if delay:
+                await asyncio.sleep(delay)
+            yield piece
+    finally:
+        if closed is not None:
+            closed.set()
+
+def parse_events(frames):
+    """SSE のテキストを (id, data) の一覧に変換"""
+    events = []
+    for frame in frames:
+        fields = dict(line.split(": ", 1) for line in frame.strip().splitlines() if not line.startswith(":"))
+        if "data" in fields:
+            events.append((int(fields["id"]), json.loads(fields["data"])))
+    return events
+
+def make_session(registry, chunks, first=None):
+    saved = []
+    partial = []
+
+    async def on_complete(text, truncated):
+        saved.append((text, True) if truncated else text)
+
+    session = registry.create("testAI", chunks, first, on_complete, partial.append)
+    return session, saved, partial
+
+class TestChatStream:
+    @pytest.mark.asyncio
+    async def test_coalesces_deltas_and_assigns_ids(self):
+        """差分がバイト数で結合され、連番の id 付きイベントになること"""
+        registry = ChatStreamRegistry(coalesce_ms=1000, coalesce_bytes=6)
+        session, saved, _ = make_session(registry, upstream(["ab", "cd", "ef", "gh"]), first="x")
+        frames = [frame async for frame in session.subscribe()]
+        assert frames[0].startswith("retry:")
+        events = parse_events(frames)
+        assert events == [
+            (1, {"chunk": "xabcdef"}),
+            (2, {"chunk": "gh"}),
+            (3, {"done": True}),
+        ]
+        await session.task
+        assert saved == ["xabcdefgh"]
+        assert registry.stats()["completed"] == 1
+
+    @pytest.mark.asyncio
+    async def test_time_window_flushes_slow_deltas(self):
+        """上流が遅い場合は時間窓で区切って送ること"""
+        registry = ChatStreamRegistry(coalesce_ms=20, coalesce_bytes=10_000)
+        session, _, _ = make_session(registry, upstream(["a", "b", "c"], delay=0.05))
+        events = parse_events([frame async for frame in session.subscribe()])
+        assert [data for _, data in events] == [{"chunk": "a"}, {"chunk": "b"}, {"chunk": "c"}, {"done": True}]
+
+    @pytest.mark.asyncio
+    async def test_heartbeat_while_idle(self):
+        """イベントが無い間はハートビートのコメント行を送ること"""
+        registry = ChatStreamRegistry(coalesce_ms=0, heartbeat=0.02)
+        session, _, _ = make_session(registry, upstream(["a", "b"], delay=0.1))
+        frames = [frame async for frame in session.subscribe()]
+        assert ": ping\n\n" in frames
+
+    @pytest.mark.asyncio
+    async def test_resume_replays_after_last_event_id(self):
+        """再接続すると Last-Event-ID より後のイベントから受け取れること"""
+        registry = ChatStreamRegistry(coalesce_ms=0, resume_grace=5)
+        session, saved, _ = make_session(registry, upstream([f"c{i}" for i in range(6)], delay=0.01))
+
+        received = []
+        first = session.subscribe()
+        async for frame in first:
+            received.extend(parse_events([frame]))
+            if len(received) == 2:
+                break
+        await first.aclose()
+        assert session.subscribers == 0 and not session.done
+
+        resumed = registry.get(session.id, "testAI")
+        frames = [frame async for frame in resumed.subscribe(received[-1][0])]
+        received.extend(parse_events(frames))
+        assert [event_id for event_id, _ in received] == list(range(1, 8))
+        assert "".join(data.get("chunk", "") for _, data in received) == "c0c1c2c3c4c5"
+        await session.task
+        assert saved == ["c0c1c2c3c4c5"]
+        assert registry.get(session.id, "otherUser") is None
+
+    @pytest.mark.asyncio
+    async def test_abandoned_stream_is_cancelled_after_grace(self):
+        """猶予時間内に再接続が無ければ上流を閉じて途中までの応答を渡すこと"""
+        registry = ChatStreamRegistry(coalesce_ms=0, resume_grace=0.05)
+        closed = asyncio.Event()
+        session, saved, partial = make_session(registry, upstream(["a"] * 1000, delay=0.01, closed=closed))
+        subscriber = session.subscribe()
+        async for frame in subscriber:
+            if frame.startswith("id: 2"):
+                break
+        await subscriber.aclose()
+        await asyncio.wait_for(closed.wait(), 1)
+        await asyncio.gather(session.task, return_exceptions=True)
+        assert session.outcome == "cancelled"
+        assert saved == []
+        assert partial and 2 <= len(partial[0]) < 1000
+
+    @pytest.mark.asyncio
+    async def test_replay_unavailable_outside_buffer(self):
+        """バッファから消えた位置からの再接続は ReplayUnavailable になること"""
+        registry = ChatStreamRegistry(coalesce_ms=0, max_events=2)
+        session, _, _ = make_session(registry, upstream(["a", "b", "c", "d"]))
+        await session.task
+        with pytest.raises(ReplayUnavailable):
+            session.replay_from(1)
+        assert session.replay_from(3) == 3
+
+    @pytest.mark.asyncio
+    async def test_replay_buffer_is_bounded_by_bytes(self):
+        """再送バッファがバイト数の上限を超えたら古いイベントから捨て、完了通知は残ること"""
+        registry = ChatStreamRegistry(coalesce_ms=0, replay_max_bytes=100)
+        session, saved, _ = make_session(registry, upstream(["あ" * 10] * 20))
+        await session.task
+        assert saved == ["あ" * 200]
+        assert session.event_bytes <= 100
+        assert session.event_bytes == sum(size for _, _, size in session.events)
+        assert registry.stats()["replay_bytes"] == session.event_bytes
+        last_id = session.events[-1][0]
+        assert json.loads(session.events[-1][1]) == {"done": True}
+        with pytest.raises(ReplayUnavailable):
+            session.replay_from(1)
+        assert session.replay_from(last_id - 1) == last_id - 1
+
+    @pytest.mark.asyncio
+    async def test_slow_subscriber_stops_when_events_are_dropped(self):
+        """未送信のイベントが捨てられたら、飛ばして送らずに打ち切ること"""
+        registry = ChatStreamRegistry(coalesce_ms=0, replay_max_bytes=100, resume_grace=10)
+        session, _, _ = make_session(registry, upstream(["a" * 30] * 20, delay=0.001))
+        subscriber = session.subscribe()
+        frames = [await subscriber.__anext__(), await subscriber.__anext__()]
+        await session.task
+        frames += [frame async for frame in subscriber]
+        assert [event_id for event_id, _ in parse_events(frames)] == [1]
+        assert registry.stats()["overrun"] == 1
+
+    @pytest.mark.asyncio
+    async def test_upstream_error_becomes_error_event(self):
+        """上流のエラーが error イベントとして送られること"""
+        async def failing():
+            yield "a"
+            raise Exception("boom")
+
+        registry = ChatStreamRegistry(coalesce_ms=0)
+        session, saved, _ = make_session(registry, failing())
+        events = parse_events([frame async for frame in session.subscribe()])
+        assert events[0][1] == {"chunk": "a"}
+        assert "boom" in events[-1][1]["error"]
+        assert saved == []
+        assert registry.stats()["failed"] == 1
+
+    @pytest.mark.asyncio
+    async def test_response_over_cap_is_streamed_but_saved_truncated(self):
+        """上限を超えた応答もクライアントには全て送り、履歴には上限までを truncated で渡すこと"""
+        registry = ChatStreamRegistry(coalesce_ms=0, max_response_chars=5)
+        session, saved, _ = make_session(registry, upstream(["ab", "cd", "ef"]))
+        events = parse_events([frame async for frame in session.subscribe()])
+        assert "".join(data.get("chunk", "") for _, data in events) == "abcdef"
+        await session.task
+        assert saved == [("abcde", True)]
+        assert registry.stats()["response_capped"] == 1
+
+class TestResponseBuffer:
+    def test_joins_parts_once(self):
+        """チャンクを結合した値を返し、結合結果を使い回すこと"""
+        buffer = ResponseBuffer(max_chars=0)
+        for piece in ["こん", "にち", "は"]:
+            buffer.append(piece)
+        value = buffer.getvalue()
+        assert value == "こんにちは"
+        assert buffer.getvalue() is value
+        assert buffer.size == 5
+        assert not buffer.truncated
+
+    def test_cap_keeps_prefix(self):
+        """上限までの部分だけを保持し、以降のチャンクは捨てること"""
+        buffer = ResponseBuffer(max_chars=3)
+        buffer.append("あい")
+        buffer.append("うえ")
+        buffer.append("お")
+        assert buffer.getvalue() == "あいう"
+        assert buffer.truncated
@@ -0,0 +1,92 @@
+# -------------------------------------------------
+# ・ファイル名：test_context_window.py
+# ・ファイル内容：会話履歴トリミングの単体テスト
+# ・作成日時：2026/10/18 19:00:00  agent
+# -------------------------------------------------
+
+import json
+import pytest
+import httpx
+from context_window import ContextWindowManager, count_tokens, message_tokens, SUMMARY_PREFIX
+from azure_openai_client import AzureOpenAIClient, ChatRequest, ChatMessage
+from test_azure_openai_client import completion_body
+
+def conversation(turns: int, length: int = 200):
+    """user / assistant が交互に並ぶ会話"""
+    messages = []
+    for i in range(turns):
+        messages.append(ChatMessage(role="user", content=f"質問{i}" + "あ" * length))
+        messages.append(ChatMessage(role="assistant", content=f"回答{i}" + "い" * length))
+    messages.append(ChatMessage(role="user", content="最新の質問"))
+    return messages
+
+class TestContextWindow:
+    def test_count_tokens(self):
+        """日本語と英語でトークン数が概算されること"""
+        assert count_tokens("") == 0
+        assert count_tokens("こんにちは") >= 3
+        assert count_tokens("hello world") >= 2
+
+    def test_message_tokens_are_cached(self):
+        """同じメッセージのトークン数は再計算されないこと"""
+        message_tokens.cache_clear()
+        message_tokens("user", "キャッシュ確認")
+        message_tokens("user", "キャッシュ確認")
+        assert message_tokens.cache_info().hits == 1
+
+    def test_short_conversation_is_untouched(self):
+        """予算内なら削除しないこと"""
+        manager = ContextWindowManager(context_tokens=4096)
+        messages = conversation(2, length=10)
+        result = manager.trim(messages, "システム", 100)
+        assert result.messages == messages
+        assert result.prompt_tokens_saved == 0
+
+    def test_old_turns_are_dropped(self):
+        """古い会話から削除され、最新の質問とシステムプロンプト分は残ること"""
+        manager = ContextWindowManager(context_tokens=1200, safety_margin=0)
+        messages = conversation(10)
+        result = manager.trim(messages, "システム", 200)
+        assert result.messages[-1].content == "最新の質問"
+        assert result.messages[0].role == "user"
+        assert result.dropped_messages > 0
+        assert result.prompt_tokens_after <= manager.budget_for(200)
+        assert result.prompt_tokens_saved > 0
+
+    def test_latest_message_is_always_kept(self):
+        """予算を超えていても最新のメッセージは残すこと"""
+        manager = ContextWindowManager(context_tokens=50, safety_margin=0)
+        messages = [ChatMessage(role="user", content="あ" * 500)]
+        result = manager.trim(messages, None, 10)
+        assert result.messages == messages
+
+    def test_summary_replaces_dropped_turns(self):
+        """要約有効時は削除した発言の要約が付くこと"""
+        manager = ContextWindowManager(context_tokens=1500, safety_margin=0, summary_enabled=True, summary_max_tokens=100)
+        result = manager.trim(conversation(10), "システム", 200)
+        assert result.summary.startswith(SUMMARY_PREFIX)
+        assert "質問0" in result.summary
+
+class TestClientTrimming:
+    @pytest.mark.asyncio
+    async def test_client_sends_trimmed_messages_and_reports_savings(self):
+        """Azure には削減後のメッセージが送られ、usage に削減量が含まれること"""
+        sent = []
+
+        def handler(request):
+            sent.append(json.loads(request.content))
+            return httpx.Response(200, json=completion_body("ok"))
+
+        client = AzureOpenAIClient(
+            endpoint="https://example.openai.azure.com/",
+            api_key="test-key",
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+            context_window=ContextWindowManager(context_tokens=1200, safety_margin=0),
+        )
+        messages = conversation(10)
+        response = await client.chat_completion(ChatRequest(messages=messages, max_tokens=200))
+
+        assert len(sent[0]["messages"]) < len(messages)
+        assert sent[0]["messages"][-1]["content"] == "最新の質問"
+        assert response.usage["prompt_tokens_saved"] > 0
+        assert response.usage["trimmed_messages"] == len(messages) - len(sent[0]["messages"])
@@ -0,0 +1,98 @@
+# -------------------------------------------------
+# ・ファイル名：test_conversation_store.py
+# ・ファイル内容：会話スレッドのトランスクリプトの単体テスト
+# ・作成日時：2026/10/19 08:00:00  agent
+# -------------------------------------------------
+
+from datetime import datetime, timedelta
+import pytest
+from conversation_store import ConversationStore, conversation_title
+from history_writer import ChatHistoryRecord, conversation_updates
+
+class FakeDb:
+    """conversations と chat_history の代わり"""
+
+    def __init__(self, turn_count: int = 0, rows=(), owner: str = "testAI"):
+        self.turn_count = turn_count
+        self.rows = list(rows)
+        self.owner = owner
+        self.history_reads = 0
+
+    async def fetch_one(self, query, params):
+        conversation_id, username = params
+        if username != self.owner:
+            return None
+        return {"system_prompt": "社内ヘルプデスク", "turn_count": self.turn_count}
+
+    async def fetch_all(self, query, params):
+        self.history_reads += 1
+        conversation_id, limit = params
+        # 新しい順で返す
+        return [
+            {"user_message": user, "assistant_message": assistant}
+            for user, assistant in reversed(self.rows)
+        ][:limit]
+
+def make_store(db: FakeDb, **kwargs) -> ConversationStore:
+    return ConversationStore(fetch_one=db.fetch_one, fetch_all=db.fetch_all, **kwargs)
+
+class TestConversationStore:
+    @pytest.mark.asyncio
+    async def test_transcript_is_built_once_and_appended(self):
+        """2 ターン目以降は履歴を読み直さず、差分の追加だけで済むこと"""
+        db = FakeDb(turn_count=1, rows=[("質問1", "回答1")])
+        store = make_store(db)
+        transcript = await store.get(1, "testAI")
+        assert [(m.role, m.content) for m in transcript.messages("質問2")] == [
+            ("user", "質問1"), ("assistant", "回答1"), ("user", "質問2"),
+        ]
+        store.append(transcript, "質問2", "回答2")
+
+        # 履歴の書き込みが DB に届く前でもキャッシュを使う
+        again = await store.get(1, "testAI")
+        assert again.turn_count == 2
+        assert list(again.turns)[-1] == ("質問2", "回答2")
+        assert db.history_reads == 1
+        assert store.stats()["reloads"] == 1
+
+    @pytest.mark.asyncio
+    async def test_reload_when_another_worker_advanced(self):
+        """DB の turn_count がキャッシュより進んでいれば読み直すこと"""
+        db = FakeDb(turn_count=1, rows=[("質問1", "回答1")])
+        store = make_store(db)
+        await store.get(1, "testAI")
+        db.rows.append(("別ワーカーの質問", "別ワーカーの回答"))
+        db.turn_count = 2
+        transcript = await store.get(1, "testAI")
+        assert list(transcript.turns)[-1] == ("別ワーカーの質問", "別ワーカーの回答")
+        assert db.history_reads == 2
+
+    @pytest.mark.asyncio
+    async def test_other_users_conversation_is_not_found(self):
+        store = make_store(FakeDb(owner="someone"))
+        assert await store.get(1, "testAI") is None
+
+    @pytest.mark.asyncio
+    async def test_only_recent_turns_are_kept(self):
+        db = FakeDb(turn_count=5, rows=[(f"質問{i}", f"回答{i}") for i in range(5)])
+        store = make_store(db, max_turns=3)
+        transcript = await store.get(1, "testAI")
+        assert [user for user, _ in transcript.turns] == ["質問2", "質問3", "質問4"]
+        store.append(transcript, "質問5", "回答5")
+        assert [user for user, _ in transcript.turns] == ["質問3", "質問4", "質問5"]
+        assert transcript.turn_count == 6
+
+class TestConversationUpdates:
+    def test_batch_is_grouped_per_conversation(self):
+        """書き込みバッチ毎に会話の往復数・更新日時・タイトルがまとめられること"""
+        now = datetime(2026, 10, 19, 8, 0, 0)
+        records = [
+            ChatHistoryRecord("testAI", "最初の質問", "回答", created_at=now, conversation_id=1),
+            ChatHistoryRecord("testAI", "次の質問", "回答", created_at=now + timedelta(seconds=5), conversation_id=1),
+            ChatHistoryRecord("testAI", "会話なし", "回答", created_at=now),
+        ]
+        assert conversation_updates(records) == [(1, 2, now + timedelta(seconds=5), "最初の質問")]
+
+    def test_title_is_shortened(self):
+        assert conversation_title("a  b\nc") == "a b c"
+        assert conversation_title("あ" * 60, max_chars=10) == "あ" * 9 + "…"
@@ -0,0 +1,150 @@
+# -------------------------------------------------
+# ・ファイル名：test_database.py
+# ・ファイル内容：コネクションプールの単体テスト
+# ・作成日時：2026/10/18 10:00:00  agent
+# -------------------------------------------------
+
+import threading
+import pytest
+import database
+from unittest.mock import MagicMock
+import psycopg2
+import psycopg2.extensions
+from database import ConnectionPool, PoolTimeoutError, fetch_one, fetch_all, execute
+
+def make_connection():
+    """psycopg2 接続のモック"""
+    conn = MagicMock()
+    conn.closed = 0
+    conn.get_transaction_status.return_value = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    return conn
+
+class TestConnectionPool:
+    def test_connection_is_reused(self):
+        """返却した接続が再利用されること"""
+        connect = MagicMock(side_effect=make_connection)
+        pool = ConnectionPool(connect=connect, min_size=0, max_size=2)
+
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+
+        assert first is second
+        assert connect.call_count == 1
+        stats = pool.stats()
+        assert stats["checkouts"] == 2
+        assert stats["idle"] == 1
+        assert stats["in_use"] == 0
+
+    def test_open_creates_min_size(self):
+        """open で最小サイズまで接続が作られること"""
+        connect = MagicMock(side_effect=make_connection)
+        pool = ConnectionPool(connect=connect, min_size=3, max_size=5)
+        pool.open()
+        assert connect.call_count == 3
+        assert pool.stats()["idle"] == 3
+
+    def test_checkout_timeout(self):
+        """上限まで貸し出し中なら指定時間で PoolTimeoutError になること"""
+        pool = ConnectionPool(connect=make_connection, min_size=0, max_size=1, timeout=0.05)
+        conn = pool.getconn()
+        with pytest.raises(PoolTimeoutError):
+            pool.getconn()
+        assert pool.stats()["timeouts"] == 1
+        pool.putconn(conn)
+
+    def test_waiter_receives_returned_connection(self):
+        """待機中のスレッドが返却された接続を受け取ること"""
+        pool = ConnectionPool(connect=make_connection, min_size=0, max_size=1, timeout=2)
+        conn = pool.getconn()
+        result = {}
+
+        def borrow():
+            result["conn"] = pool.getconn()
+
+        thread = threading.Thread(target=borrow)
+        thread.start()
+        pool.putconn(conn)
+        thread.join(timeout=2)
+        assert result["conn"] is conn
+
+    def test_recycle_after_max_uses(self):
+        """使用回数の上限に達した接続が作り直されること"""
+        connect = MagicMock(side_effect=make_connection)
+        pool = ConnectionPool(connect=connect, min_size=0, max_size=1, max_uses=2)
+        for _ in range(3):
+            with pool.connection():
+                pass
+        assert connect.call_count == 2
+        assert pool.stats()["connections_recycled"] == 1
+
+    def test_health_check_failure_replaces_connection(self):
+        """ヘルスチェックに失敗した接続は破棄されること"""
+        broken = make_connection()
+        broken.cursor.return_value.execute.side_effect = psycopg2.OperationalError("gone")
+        connect = MagicMock(side_effect=[broken, make_connection()])
+        pool = ConnectionPool(connect=connect, min_size=0, max_size=1, health_check_idle=0)
+
+        with pool.connection():
+            pass
+        with pool.connection() as conn:
+            assert conn is not broken
+
+        assert broken.close.called
+        assert pool.stats()["health_check_failures"] == 1
+
+    def test_operational_error_discards_connection(self):
+        """接続エラーが発生した接続はプールに戻らないこと"""
+        pool = ConnectionPool(connect=make_connection, min_size=0, max_size=1)
+        with pytest.raises(psycopg2.OperationalError):
+            with pool.connection():
+                raise psycopg2.OperationalError("connection lost")
+        assert pool.stats()["size"] == 0
+
+    def test_open_transaction_is_rolled_back(self):
+        """未完了トランザクションは返却時にロールバックされること"""
+        conn = make_connection()
+        conn.get_transaction_status.return_value = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        pool = ConnectionPool(connect=lambda: conn, min_size=0, max_size=1)
+        with pool.connection():
+            pass
+        assert conn.rollback.called
+
+class TestAsyncAccess:
+    @pytest.fixture
+    def conn(self, monkeypatch):
+        conn = make_connection()
+        pool = ConnectionPool(connect=lambda: conn, min_size=0, max_size=1)
+        monkeypatch.setattr(database, "get_connection_pool", lambda: pool)
+        return conn
+
+    @pytest.mark.asyncio
+    async def test_fetch_one_runs_off_event_loop(self, conn):
+        """クエリがイベントループ以外のスレッドで実行されること"""
+        threads = []
+        cursor = conn.cursor.return_value
+        cursor.execute.side_effect = lambda *args: threads.append(threading.current_thread())
+        cursor.fetchone.return_value = {"id": 1, "username": "testAI"}
+
+        row = await fetch_one("SELECT * FROM users WHERE username = %s", ("testAI",))
+
+        assert row == {"id": 1, "username": "testAI"}
+        assert threads and threads[0] is not threading.main_thread()
+        assert "cursor_factory" in conn.cursor.call_args.kwargs
+        assert cursor.close.called
+
+    @pytest.mark.asyncio
+    async def test_fetch_all(self, conn):
+        """全行が取得できること"""
+        conn.cursor.return_value.fetchall.return_value = [{"id": 1}, {"id": 2}]
+        rows = await fetch_all("SELECT id FROM chat_history")
+        assert rows == [{"id": 1}, {"id": 2}]
+
+    @pytest.mark.asyncio
+    async def test_execute_commits(self, conn):
+        """更新系クエリがコミットされ影響行数が返ること"""
+        conn.cursor.return_value.rowcount = 3
+        count = await execute("DELETE FROM chat_history WHERE username = %s", ("testAI",))
+        assert count == 3
+        assert conn.commit.called
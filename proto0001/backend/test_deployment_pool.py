@@ -0,0 +1,141 @@
+# -------------------------------------------------
+# ・ファイル名：test_deployment_pool.py
+# ・ファイル内容：複数デプロイメントへの負荷分散の単体テスト
+# ・作成日時：2026/10/18 22:00:00  agent
+# -------------------------------------------------
+
+import asyncio
+import pytest
+import httpx
+from azure_openai_client import AzureOpenAIClient
+from deployment_pool import Deployment, DeploymentConfig, DeploymentPool, load_deployment_configs
+from rate_limiter import RateLimiter, RateLimitExceeded
+from resilience import CircuitBreaker, RetryPolicy
+from test_azure_openai_client import completion_body, stream_body, make_request
+
+def make_deployment(name: str, handler, **kwargs) -> Deployment:
+    return Deployment(
+        DeploymentConfig(
+            name=name,
+            endpoint=f"https://{name}.openai.azure.com/",
+            api_key="test-key",
+            deployment="gpt-35-turbo",
+            api_version="2024-02-15-preview",
+            weight=kwargs.pop("weight", 1.0),
+        ),
+        httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        rate_limiter=kwargs.pop("rate_limiter", RateLimiter(rpm=0, tpm=0)),
+        circuit_breaker=CircuitBreaker(name=name, failure_threshold=100),
+        **kwargs,
+    )
+
+def make_client(pool: DeploymentPool) -> AzureOpenAIClient:
+    return AzureOpenAIClient(
+        pool=pool,
+        retry_policy=RetryPolicy(max_retries=2, base_delay=0.001, max_delay=0.01),
+    )
+
+def recording_handler(name: str, calls: list, response=None):
+    async def handler(request: httpx.Request):
+        calls.append(name)
+        await asyncio.sleep(0.05)
+        if response is not None:
+            return response()
+        if b'"stream": true' in request.content or b'"stream":true' in request.content:
+            return httpx.Response(200, content=stream_body(["ok"]), headers={"content-type": "text/event-stream"})
+        return httpx.Response(200, json=completion_body(name))
+    return handler
+
+class TestDeploymentConfig:
+    def test_load_configs(self):
+        """JSON 配列から設定を読み込み、不足項目はエラーになること"""
+        configs = load_deployment_configs(
+            '[{"endpoint": "https://a/", "api_key": "k", "deployment": "gpt", "weight": 2, "tpm": 1000},'
+            ' {"name": "b", "endpoint": "https://b/", "api_key": "k", "deployment": "gpt"}]',
+            "2024-02-15-preview",
+        )
+        assert [c.name for c in configs] == ["gpt@0", "b"]
+        assert configs[0].weight == 2 and configs[0].tpm == 1000
+        assert configs[1].api_version == "2024-02-15-preview"
+
+        with pytest.raises(ValueError):
+            load_deployment_configs('[{"endpoint": "https://a/"}]', "v")
+        with pytest.raises(ValueError):
+            load_deployment_configs("not json", "v")
+
+class TestRouting:
+    @pytest.mark.asyncio
+    async def test_least_outstanding_spreads_concurrent_calls(self):
+        """同時呼び出しが処理中件数の少ないデプロイメントへ分散されること"""
+        calls = []
+        pool = DeploymentPool([
+            make_deployment("east", recording_handler("east", calls)),
+            make_deployment("west", recording_handler("west", calls)),
+        ])
+        client = make_client(pool)
+        await asyncio.gather(*(client.chat_completion(make_request(f"質問{i}")) for i in range(10)))
+        assert calls.count("east") == 5
+        assert calls.count("west") == 5
+        stats = pool.stats()["deployments"]
+        assert stats["east"]["outstanding"] == 0
+        assert stats["east"]["latency_ewma_ms"] > 0
+
+    def test_latency_routing_prefers_fast_deployment(self):
+        """latency 方式では応答の速いデプロイメントが選ばれること"""
+        slow = make_deployment("slow", recording_handler("slow", []))
+        fast = make_deployment("fast", recording_handler("fast", []))
+        slow.latency_ewma, fast.latency_ewma = 2.0, 0.5
+        fast.outstanding = 2
+        pool = DeploymentPool([slow, fast], routing="latency")
+        assert pool.select().name == "fast"
+        fast.outstanding = 4
+        assert pool.select().name == "slow"
+
+class TestEjection:
+    @pytest.mark.asyncio
+    async def test_server_error_ejects_and_retries_elsewhere(self):
+        """5xx を返したデプロイメントが外され、リトライが別のデプロイメントへ行くこと"""
+        calls = []
+        pool = DeploymentPool([
+            make_deployment("east", recording_handler(
+                "east", calls, lambda: httpx.Response(500, json={"error": {"message": "down"}}))),
+            make_deployment("west", recording_handler("west", calls)),
+        ])
+        client = make_client(pool)
+        for i in range(3):
+            response = await client.chat_completion(make_request(f"質問{i}"))
+            assert response.message == "west"
+        assert calls.count("east") == 1
+        stats = pool.stats()["deployments"]["east"]
+        assert stats["available"] is False
+        assert stats["failures"] == 1
+
+    @pytest.mark.asyncio
+    async def test_throttled_deployment_fails_over(self):
+        """429 を返したデプロイメントから、待たずに別のデプロイメントへ切り替えること"""
+        calls = []
+        pool = DeploymentPool([
+            make_deployment("east", recording_handler(
+                "east", calls,
+                lambda: httpx.Response(429, json={"error": {"message": "busy"}}, headers={"retry-after": "5"}))),
+            make_deployment("west", recording_handler("west", calls)),
+        ])
+        client = make_client(pool)
+        chunks = [chunk async for chunk in client.chat_completion_stream(make_request())]
+        assert chunks == ["ok"]
+        assert calls == ["east", "west"]
+        assert pool.stats()["deployments"]["east"]["throttled"] == 1
+        assert pool.stats()["deployments"]["west"]["outstanding"] == 0
+
+    @pytest.mark.asyncio
+    async def test_all_throttled_raises_rate_limit(self):
+        """全デプロイメントの送信枠が無ければ RateLimitExceeded になること"""
+        pool = DeploymentPool([
+            make_deployment(name, recording_handler(name, []), rate_limiter=RateLimiter(rpm=6, burst_seconds=10, max_wait=0))
+            for name in ("east", "west")
+        ])
+        client = make_client(pool)
+        await client.chat_completion(make_request("1"))
+        await client.chat_completion(make_request("2"))
+        with pytest.raises(RateLimitExceeded):
+            await client.chat_completion(make_request("3"))
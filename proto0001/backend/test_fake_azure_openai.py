@@ -0,0 +1,72 @@
+# -------------------------------------------------
+# ・ファイル名：test_fake_azure_openai.py
+# ・ファイル内容：Azure OpenAI 擬似サーバーの単体テスト
+# ・作成日時：2026/10/18 13:00:00  agent
+# -------------------------------------------------
+
+import pytest
+import httpx
+from fastapi.testclient import TestClient
+from fake_azure_openai import create_app, FakeServerConfig
+from azure_openai_client import AzureOpenAIClient, ChatRequest, ChatMessage
+
+CHAT_PATH = "/openai/deployments/gpt-35-turbo/chat/completions?api-version=2024-02-15-preview"
+
+def fast_config(**overrides) -> FakeServerConfig:
+    values = dict(latency_ms=0, ttft_ms=0, tokens_per_sec=0, response_tokens=6, seed=1)
+    values.update(overrides)
+    return FakeServerConfig(**values)
+
+def make_client(app) -> AzureOpenAIClient:
+    """擬似サーバーへ ASGI で接続するクライアント"""
+    return AzureOpenAIClient(
+        endpoint="http://fake-azure",
+        api_key="dummy",
+        http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=app)),
+    )
+
+def make_request() -> ChatRequest:
+    return ChatRequest(messages=[ChatMessage(role="user", content="こんにちは")], max_tokens=100)
+
+class TestFakeAzureOpenAI:
+    @pytest.mark.asyncio
+    async def test_chat_completion_through_sdk(self):
+        """SDK から非ストリーミング応答を受け取れること"""
+        client = make_client(create_app(fast_config()))
+        response = await client.chat_completion(make_request())
+        assert response.message
+        assert response.usage["completion_tokens"] == 6
+
+    @pytest.mark.asyncio
+    async def test_stream_through_sdk(self):
+        """SDK からストリーミング応答を受け取れること"""
+        client = make_client(create_app(fast_config()))
+        chunks = [chunk async for chunk in client.chat_completion_stream(make_request())]
+        assert len([c for c in chunks if c]) == 6
+
+    def test_max_tokens_limits_response(self):
+        """max_tokens で応答トークン数が制限されること"""
+        client = TestClient(create_app(fast_config(response_tokens=20)))
+        response = client.post(CHAT_PATH, json={"messages": [], "max_tokens": 3})
+        assert response.json()["usage"]["completion_tokens"] == 3
+
+    def test_rate_limit_injection(self):
+        """429 が retry-after ヘッダー付きで返ること"""
+        client = TestClient(create_app(fast_config(rate_limit_rate=1.0, retry_after=2)))
+        response = client.post(CHAT_PATH, json={"messages": []})
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == "2"
+
+    def test_rpm_limit(self):
+        """RPM 上限を超えると 429 になること"""
+        client = TestClient(create_app(fast_config(rpm_limit=2)))
+        statuses = [client.post(CHAT_PATH, json={"messages": []}).status_code for _ in range(3)]
+        assert statuses == [200, 200, 429]
+
+    def test_error_injection(self):
+        """エラー率 1.0 で常に 500 が返ること"""
+        app = create_app(fast_config(error_rate=1.0))
+        client = TestClient(app)
+        response = client.post(CHAT_PATH, json={"messages": []})
+        assert response.status_code == 500
+        assert app.state.stats["errors"] == 1
@@ -0,0 +1,272 @@
+# -------------------------------------------------
+# ・ファイル名：test_history_export.py
+# ・ファイル内容：チャット履歴の一括エクスポートの単体テスト
+# ・作成日時：2026/10/19 10:00:00  agent
+# -------------------------------------------------
+
+import gzip
+import json
+import os
+from contextlib import contextmanager
+from datetime import datetime
+import anyio
+import pytest
+from history_export import ChunkSink, ExportBusy, ExportFilter, HistoryExporter, write_export
+
+def history_row(i):
+    return (i, "testAI", None, datetime(2026, 10, 19, 10, 0, i % 60), False, f"質問{i}", f"回答\\{i}")
+
+class FakeCursor:
+    def __init__(self, rows, name=None):
+        self.rows = rows
+        self.name = name
+        self.executed = None
+        self.copied = None
+        self.closed = False
+
+    def mogrify(self, sql, params):
+        return (sql.replace("%s", "{}").format(*(repr(p) for p in params))).encode("utf-8")
+
+    def execute(self, sql, params):
+        self.executed = (sql, params)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def copy_expert(self, sql, file):
+        self.copied = sql
+        file.write("id,username\n")
+        for row in self.rows:
+            file.write(f"{row[0]},{row[1]}\n")
+
+    def close(self):
+        self.closed = True
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.rows = rows
+        self.cursors = []
+        self.rolled_back = False
+
+    def cursor(self, name=None):
+        cursor = FakeCursor(self.rows, name)
+        self.cursors.append(cursor)
+        return cursor
+
+    def rollback(self):
+        self.rolled_back = True
+
+def collect(fmt, rows, export_filter=ExportFilter(), **sink_options):
+    chunks = []
+    conn = FakeConnection(rows)
+    sink = ChunkSink(chunks.append, **sink_options)
+    count = write_export(conn, sink, fmt, export_filter)
+    sink.close()
+    return conn, chunks, count
+
+class TestWriteExport:
+    def test_ndjson_uses_server_side_cursor(self):
+        """名前付きカーソルで読み、1 行 1 JSON で書き出すこと"""
+        conn, chunks, count = collect("ndjson", [history_row(i) for i in range(3)],
+                                      ExportFilter(usernames=["testAI"], since=datetime(2026, 10, 1)))
+        cursor = conn.cursors[0]
+        assert cursor.name and cursor.closed and conn.rolled_back
+        assert "username = ANY(%s) AND created_at >= %s" in cursor.executed[0]
+        assert "ORDER BY created_at, id" in cursor.executed[0]
+        assert cursor.executed[1] == [["testAI"], datetime(2026, 10, 1)]
+
+        lines = b"".join(chunks).decode("utf-8").splitlines()
+        assert count == 3 and len(lines) == 4
+        assert json.loads(lines[-1]) == {"_export": "complete", "rows": 3}
+        record = json.loads(lines[1])
+        assert record["user_message"] == "質問1"
+        assert record["assistant_message"] == "回答\\1"
+        assert record["created_at"] == "2026-10-19T10:00:01"
+
+    def test_csv_uses_copy(self):
+        conn, chunks, count = collect("csv", [history_row(i) for i in range(2)],
+                                      ExportFilter(until=datetime(2026, 11, 1)))
+        copied = conn.cursors[0].copied
+        assert copied.startswith("COPY (") and copied.endswith("TO STDOUT WITH (FORMAT csv, HEADER)")
+        assert "created_at < datetime.datetime(2026, 11, 1, 0, 0)" in copied
+        assert b"".join(chunks) == b"id,username\n0,testAI\n1,testAI\n"
+        assert count == -1
+
+    def test_ndjson_failure_is_marked_incomplete(self):
+        """読み出しの途中で失敗したら、incomplete の行を書いてから例外を送出すること"""
+        def rows():
+            yield history_row(0)
+            yield history_row(1)
+            raise RuntimeError("server closed the connection unexpectedly")
+
+        chunks = []
+        sink = ChunkSink(chunks.append)
+        with pytest.raises(RuntimeError):
+            write_export(FakeConnection(rows()), sink, "ndjson", ExportFilter())
+        sink.close()
+        lines = b"".join(chunks).decode("utf-8").splitlines()
+        assert len(lines) == 3
+        assert json.loads(lines[-1]) == {
+            "_export": "incomplete", "rows": 2, "error": "server closed the connection unexpectedly",
+        }
+
+    def test_unknown_format(self):
+        with pytest.raises(ValueError):
+            collect("xml", [])
+
+class TestChunkSink:
+    def test_output_is_chunked(self):
+        """chunk_size 毎にまとめて渡し、最後の端数は close で渡すこと"""
+        chunks = []
+        sink = ChunkSink(chunks.append, chunk_size=100)
+        for _ in range(25):
+            sink.write("0123456789")
+        assert [len(c) for c in chunks] == [100, 100]
+        sink.close()
+        assert [len(c) for c in chunks] == [100, 100, 50]
+        assert sink.bytes_in == 250
+
+    def test_gzip_round_trip(self):
+        _, chunks, _ = collect("ndjson", [history_row(i) for i in range(20000)], gzip=True, chunk_size=1024)
+        assert len(chunks) > 1
+        lines = gzip.decompress(b"".join(chunks)).decode("utf-8").splitlines()
+        assert len(lines) == 20001
+
+class TestHistoryExporter:
+    def exporter(self, rows, **options):
+        @contextmanager
+        def connection():
+            yield FakeConnection(rows)
+        return HistoryExporter(connection=connection, **options)
+
+    @pytest.mark.asyncio
+    async def test_stream_yields_all_chunks(self):
+        exporter = self.exporter([history_row(i) for i in range(1000)], queue_chunks=2)
+        body = b"".join([chunk async for chunk in exporter.stream("ndjson", ExportFilter())])
+        assert len(body.splitlines()) == 1001
+        stats = exporter.stats()
+        assert stats["completed"] == 1 and stats["running"] == 0
+        assert stats["bytes_sent"] == len(body)
+        exporter.close()
+
+    @pytest.mark.asyncio
+    async def test_closing_stream_stops_producer(self):
+        """受信側が途中で閉じたら、DB の読み出しも止まること"""
+        produced = []
+
+        def rows():
+            for i in range(1_000_000):
+                produced.append(i)
+                yield history_row(i)
+
+        exporter = self.exporter(rows(), queue_chunks=1)
+        stream = exporter.stream("ndjson", ExportFilter())
+        await stream.__anext__()
+        # aclose は producer の終了を待つ
+        await stream.aclose()
+        assert len(produced) < 1_000_000
+        assert exporter.stats()["cancelled"] == 1 and exporter.stats()["running"] == 0
+        exporter.close()
+
+    @pytest.mark.asyncio
+    async def test_disconnect_cancellation_releases_slot(self):
+        """StreamingResponse と同じくタスクグループで取り消されても、実行中の枠が返されること"""
+        def rows():
+            for i in range(1_000_000):
+                yield history_row(i)
+
+        exporter = self.exporter(rows(), max_concurrent=2, queue_chunks=1)
+        for _ in range(2):
+            exporter.check_capacity()
+            received = anyio.Event()
+
+            async def consume():
+                async for _ in exporter.stream("ndjson", ExportFilter()):
+                    received.set()
+
+            async with anyio.create_task_group() as task_group:
+                task_group.start_soon(consume)
+                await received.wait()
+                # 切断の検知で StreamingResponse がタスクグループを取り消すのと同じ
+                task_group.cancel_scope.cancel()
+
+        stats = exporter.stats()
+        assert stats["running"] == 0 and stats["cancelled"] == 2
+        exporter.check_capacity()
+        exporter.close()
+
+    @pytest.mark.asyncio
+    async def test_producer_error_is_raised(self):
+        @contextmanager
+        def broken():
+            raise RuntimeError("connection refused")
+            yield
+
+        exporter = HistoryExporter(connection=broken)
+        with pytest.raises(RuntimeError):
+            async for _ in exporter.stream("ndjson", ExportFilter()):
+                pass
+        assert exporter.stats()["failed"] == 1
+        exporter.close()
+
+    @pytest.mark.asyncio
+    async def test_failure_after_start_sends_marker_then_raises(self):
+        """送信開始後の失敗は、途中までの行と incomplete の行を送ってから例外になること（接続を切らせる）"""
+        def rows():
+            for i in range(3):
+                yield history_row(i)
+            raise RuntimeError("connection lost")
+
+        exporter = self.exporter(rows(), queue_chunks=2)
+        received = []
+        with pytest.raises(RuntimeError):
+            async for chunk in exporter.stream("ndjson", ExportFilter(), gzip=True):
+                received.append(chunk)
+        lines = gzip.decompress(b"".join(received)).decode("utf-8").splitlines()
+        assert json.loads(lines[-1])["_export"] == "incomplete"
+        assert len(lines) == 4
+        assert exporter.stats()["failed"] == 1
+        exporter.close()
+
+    @pytest.mark.asyncio
+    async def test_capacity(self):
+        exporter = self.exporter([history_row(i) for i in range(1000)], max_concurrent=1, queue_chunks=1)
+        exporter.check_capacity()
+        stream = exporter.stream("ndjson", ExportFilter())
+        await stream.__anext__()
+        with pytest.raises(ExportBusy):
+            exporter.check_capacity()
+        await stream.aclose()
+        exporter.check_capacity()
+        assert exporter.stats()["rejected"] == 1
+        exporter.close()
+
+    @pytest.mark.asyncio
+    async def test_csv_gzip_failure_leaves_stream_truncated(self):
+        """CSV の gzip は失敗時に閉じず、展開時に途中切れと分かること"""
+        class FailingCopyConnection(FakeConnection):
+            def cursor(self, name=None):
+                cursor = super().cursor(name)
+
+                def copy_expert(sql, file):
+                    # 圧縮しても複数チャンクになる量
+                    for _ in range(2000):
+                        file.write(os.urandom(64).hex() + "\n")
+                    raise RuntimeError("connection lost")
+
+                cursor.copy_expert = copy_expert
+                return cursor
+
+        @contextmanager
+        def connection():
+            yield FailingCopyConnection([])
+
+        exporter = HistoryExporter(connection=connection)
+        received = []
+        with pytest.raises(RuntimeError):
+            async for chunk in exporter.stream("csv", ExportFilter(), gzip=True):
+                received.append(chunk)
+        assert received
+        with pytest.raises(EOFError):
+            gzip.decompress(b"".join(received))
+        exporter.close()
@@ -0,0 +1,76 @@
+# -------------------------------------------------
+# ・ファイル名：test_history_search.py
+# ・ファイル内容：チャット履歴の全文検索の単体テスト
+# ・作成日時：2026/10/19 09:00:00  agent
+# -------------------------------------------------
+
+from datetime import datetime
+import pytest
+from history_search import (
+    TRIGRAM_DOCUMENT, TSVECTOR_DOCUMENT, build_search_query, build_snippet, decode_search_cursor,
+    encode_search_cursor, escape_like, parse_terms, schema_statements, search_mode_for,
+)
+
+class TestSearchQuery:
+    def test_mode_follows_script(self):
+        """日本語を含めばトライグラム、英数字だけなら全文検索になること"""
+        assert search_mode_for("経費精算") == "trigram"
+        assert search_mode_for("docker エラー") == "trigram"
+        assert search_mode_for("docker compose") == "fts"
+        assert search_mode_for("docker", "trigram") == "trigram"
+
+    def test_terms_follow_websearch_syntax(self):
+        assert parse_terms('"connection refused" -docker postgres OR mysql') == [
+            "connection refused", "postgres", "mysql",
+        ]
+        assert parse_terms("経費  経費 精算") == ["経費", "精算"]
+
+    def test_like_wildcards_are_escaped(self):
+        assert escape_like("100%_a\\b") == "100\\%\\_a\\\\b"
+
+    def test_fts_query_is_ranked(self):
+        sql, params = build_search_query("testAI", "docker", "fts", 20, cursor=(0.5, 10))
+        assert "websearch_to_tsquery('simple', %s)" in sql
+        assert "ORDER BY rank DESC, id DESC" in sql
+        assert f"{TSVECTOR_DOCUMENT} @@ query" in sql
+        assert params == ["docker", "testAI", 0.5, 10, 21]
+
+    def test_trigram_query_uses_indexed_expression(self):
+        """インデックスと同じ式で、検索語毎に ILIKE を重ねること"""
+        sql, params = build_search_query("testAI", "経費 精算", "trigram", 20, conversation_id=3)
+        assert sql.count(f"{TRIGRAM_DOCUMENT} ILIKE %s") == 2
+        assert params == ["testAI", "%経費%", "%精算%", 3, 21]
+
+    def test_schema_does_not_rewrite_table(self):
+        """インデックスは式インデックスで、既定では書き込みを止めずに作成すること"""
+        statements = schema_statements()
+        assert not any("ALTER TABLE" in statement for statement in statements)
+        assert all("CONCURRENTLY" in statement for statement in statements if "CREATE INDEX" in statement)
+        assert any(TSVECTOR_DOCUMENT in statement for statement in statements)
+        assert not any("CONCURRENTLY" in statement for statement in schema_statements(concurrently=False))
+
+    def test_cursor_round_trip_and_mode_check(self):
+        created_at = datetime(2026, 10, 19, 9, 0, 0)
+        cursor = encode_search_cursor("trigram", created_at.isoformat(), 5)
+        assert decode_search_cursor(cursor, "trigram") == (created_at, 5)
+        with pytest.raises(ValueError):
+            decode_search_cursor(cursor, "fts")
+        with pytest.raises(ValueError):
+            decode_search_cursor("!!", "fts")
+
+class TestSnippet:
+    def test_window_around_first_match_with_highlights(self):
+        """最初の一致箇所の周辺を切り出し、一致箇所の位置を返すこと"""
+        text = "あ" * 200 + "経費精算の締め日は25日です" + "い" * 200
+        snippet = build_snippet(text, ["経費", "締め日"], width=40)
+        assert snippet["text"].startswith("…") and snippet["text"].endswith("…")
+        for start, end in snippet["highlights"]:
+            assert snippet["text"][start:end] in ("経費", "締め日")
+        assert len(snippet["highlights"]) == 2
+
+    def test_case_insensitive_and_overlaps_merged(self):
+        snippet = build_snippet("Docker compose up", ["docker", "dock", "COMPOSE"])
+        assert snippet == {"text": "Docker compose up", "highlights": [[0, 6], [7, 14]]}
+
+    def test_no_match_returns_head(self):
+        assert build_snippet("abc" * 100, ["zzz"], width=10) == {"text": "abcabcabca…", "highlights": []}
@@ -0,0 +1,139 @@
+# -------------------------------------------------
+# ・ファイル名：test_history_writer.py
+# ・ファイル内容：チャット履歴ライトビハインドの単体テスト
+# ・作成日時：2026/10/18 15:00:00  agent
+# -------------------------------------------------
+
+import asyncio
+import pytest
+from history_writer import ChatHistoryWriter, ChatHistoryRecord
+
+def make_record(index: int) -> ChatHistoryRecord:
+    return ChatHistoryRecord("testAI", f"質問{index}", f"回答{index}")
+
+class RecordingInserter:
+    """書き込まれたバッチを記録する"""
+
+    def __init__(self, fail: bool = False):
+        self.batches = []
+        self.fail = fail
+
+    async def __call__(self, records):
+        if self.fail:
+            raise RuntimeError("db down")
+        self.batches.append(list(records))
+
+class TestChatHistoryWriter:
+    @pytest.mark.asyncio
+    async def test_flush_on_batch_size(self):
+        """バッチサイズに達したらまとめて書き込まれること"""
+        inserter = RecordingInserter()
+        writer = ChatHistoryWriter(insert_batch=inserter, batch_size=3, flush_interval=10)
+        await writer.start()
+        for i in range(3):
+            await writer.put(make_record(i))
+        await asyncio.sleep(0.05)
+        assert [len(b) for b in inserter.batches] == [3]
+        await writer.stop()
+
+    @pytest.mark.asyncio
+    async def test_flush_on_interval(self):
+        """バッチサイズ未満でも一定時間で書き込まれること"""
+        inserter = RecordingInserter()
+        writer = ChatHistoryWriter(insert_batch=inserter, batch_size=100, flush_interval=0.05)
+        await writer.start()
+        await writer.put(make_record(0))
+        await asyncio.sleep(0.15)
+        assert [len(b) for b in inserter.batches] == [1]
+        await writer.stop()
+
+    @pytest.mark.asyncio
+    async def test_stop_drains_queue(self):
+        """停止時にキューの残りが書き切られること"""
+        inserter = RecordingInserter()
+        writer = ChatHistoryWriter(insert_batch=inserter, batch_size=4, flush_interval=10)
+        await writer.start()
+        for i in range(10):
+            await writer.put(make_record(i))
+        await writer.stop()
+        assert sum(len(b) for b in inserter.batches) == 10
+        assert writer.stats()["written"] == 10
+        assert not writer.running
+
+    @pytest.mark.asyncio
+    async def test_put_nowait_rejects_when_full(self):
+        """キューが満杯なら put_nowait が False を返すこと"""
+        writer = ChatHistoryWriter(insert_batch=RecordingInserter(), queue_size=1)
+        writer._queue = asyncio.Queue(maxsize=1)
+        assert writer.put_nowait(make_record(0)) is True
+        assert writer.put_nowait(make_record(1)) is False
+        assert writer.stats()["rejected"] == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_batch_is_counted(self):
+        """書き込み失敗でもワーカーが止まらないこと"""
+        writer = ChatHistoryWriter(insert_batch=RecordingInserter(fail=True), batch_size=2, flush_interval=0.01)
+        await writer.start()
+        await writer.put(make_record(0))
+        await writer.put(make_record(1))
+        await writer.stop()
+        assert writer.stats()["failed"] == 2
+
+    @pytest.mark.asyncio
+    async def test_bad_record_does_not_drop_batch(self):
+        """書き込めない行が混ざっても、他の行は書き込まれること"""
+        written = []
+
+        async def insert(records):
+            # psycopg2 は NUL 文字を含む文字列で ValueError を送出する
+            if any("\x00" in record.user_message for record in records):
+                raise ValueError("A string literal cannot contain NUL (0x00) characters.")
+            written.extend(records)
+
+        writer = ChatHistoryWriter(insert_batch=insert, batch_size=8, flush_interval=10)
+        await writer.start()
+        for i in range(8):
+            record = make_record(i)
+            if i == 5:
+                record.user_message = "質問\x00"
+            await writer.put(record)
+        await writer.stop()
+        assert sorted(record.user_message for record in written) == [f"質問{i}" for i in range(8) if i != 5]
+        assert writer.stats()["written"] == 7
+        assert writer.stats()["failed"] == 1
+
+    @pytest.mark.asyncio
+    async def test_transient_error_is_retried(self):
+        """接続断は間隔を空けて再試行されること"""
+        import psycopg2
+        calls = []
+
+        async def insert(records):
+            calls.append(len(records))
+            if len(calls) < 3:
+                raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+        writer = ChatHistoryWriter(insert_batch=insert, batch_size=4, flush_interval=10, retry_backoff=0.001)
+        await writer.start()
+        for i in range(4):
+            await writer.put(make_record(i))
+        await writer.stop()
+        assert calls == [4, 4, 4]
+        assert writer.stats()["written"] == 4
+        assert writer.stats()["retries"] == 2
+
+    @pytest.mark.asyncio
+    async def test_stop_times_out_when_queue_is_full(self):
+        """キューが満杯で DB が応答しなくても、timeout で停止すること"""
+        blocked = asyncio.Event()
+
+        async def insert(records):
+            await blocked.wait()
+
+        writer = ChatHistoryWriter(insert_batch=insert, queue_size=1, batch_size=1, flush_interval=10)
+        await writer.start()
+        await writer.put(make_record(0))
+        await asyncio.sleep(0.01)
+        await writer.put(make_record(1))
+        await asyncio.wait_for(writer.stop(timeout=0.05), 1)
+        assert not writer.running
@@ -0,0 +1,161 @@
+# -------------------------------------------------
+# ・ファイル名：test_login_throttle.py
+# ・ファイル内容：ログイン試行制限の単体テスト
+# ・作成日時：2026/10/19 04:00:00  agent
+# -------------------------------------------------
+
+import pytest
+from login_throttle import (
+    LocalSortedSetClient, LoginThrottle, LoginThrottled, MemoryThrottleStore, SortedSetThrottleStore,
+    ThrottleStore, client_ip_from,
+)
+from tracing import parse_networks
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+def make_stores(clock):
+    return [MemoryThrottleStore(), SortedSetThrottleStore(LocalSortedSetClient(clock))]
+
+class TestLoginThrottle:
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("store_index", [0, 1])
+    async def test_user_failures_slide_out_of_window(self, store_index):
+        """ユーザー名毎の失敗が上限に達すると断り、古い失敗がウィンドウから外れると再開できること"""
+        clock = FakeClock()
+        throttle = LoginThrottle(make_stores(clock)[store_index], user_limit=3, user_window=60,
+                                 ip_limit=0, clock=clock)
+        for _ in range(3):
+            await throttle.check("testAI", "10.0.0.1")
+            await throttle.record_failure("testAI")
+            clock.now += 10
+
+        with pytest.raises(LoginThrottled) as excinfo:
+            await throttle.check("TestAI", "10.0.0.2")
+        assert excinfo.value.scope == "user"
+        # 最初の失敗（30 秒前）がウィンドウから外れるまで
+        assert excinfo.value.retry_after == pytest.approx(30)
+
+        clock.now += 30
+        await throttle.check("testAI", "10.0.0.1")
+        assert throttle.stats()["rejected_user"] == 1
+
+    @pytest.mark.asyncio
+    async def test_success_resets_user_failures(self):
+        """ログインに成功したら、そのユーザー名の失敗回数をリセットすること"""
+        clock = FakeClock()
+        throttle = LoginThrottle(user_limit=2, ip_limit=0, clock=clock)
+        await throttle.check("testAI", "10.0.0.1")
+        await throttle.record_failure("testAI")
+        await throttle.check("testAI", "10.0.0.1")
+        await throttle.record_success("testAI")
+        await throttle.check("testAI", "10.0.0.1")
+        await throttle.record_failure("testAI")
+        await throttle.check("testAI", "10.0.0.1")
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("store_index", [0, 1])
+    async def test_ip_limit_counts_attempts_across_usernames(self, store_index):
+        """IP 毎の制限はユーザー名を変えた試行もまとめて数え、断った試行は数えないこと"""
+        clock = FakeClock()
+        throttle = LoginThrottle(make_stores(clock)[store_index], user_limit=0, ip_limit=3, ip_window=60, clock=clock)
+        for i in range(3):
+            await throttle.check(f"user{i}", "10.0.0.1")
+        for _ in range(5):
+            with pytest.raises(LoginThrottled) as excinfo:
+                await throttle.check("other", "10.0.0.1")
+            assert excinfo.value.scope == "ip"
+        await throttle.check("other", "10.0.0.2")
+
+        clock.now += 60
+        await throttle.check("other", "10.0.0.1")
+        assert throttle.stats()["rejected_ip"] == 5
+
+    @pytest.mark.asyncio
+    async def test_disabled_allows_everything(self):
+        """無効時は記録も制限もしないこと"""
+        store = MemoryThrottleStore()
+        throttle = LoginThrottle(store, user_limit=1, ip_limit=1, enabled=False)
+        for _ in range(3):
+            await throttle.check("testAI", "10.0.0.1")
+            await throttle.record_failure("testAI")
+        assert len(store) == 0
+
+    @pytest.mark.asyncio
+    async def test_memory_store_is_bounded(self):
+        """保持するキー数が max_keys を超えたら古いものから捨てること"""
+        store = MemoryThrottleStore(max_keys=2)
+        for key in ("a", "b", "c"):
+            await store.acquire(key, 1, 60, 0.0)
+        assert len(store) == 2
+        # 捨てられたキーはもう一度試行できる
+        attempt_id, _ = await store.acquire("a", 1, 60, 1.0)
+        assert attempt_id is not None
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("store_index", [0, 1])
+    async def test_concurrent_burst_is_limited(self, store_index):
+        """照合中の試行も数え、同時に届いた試行が上限を超えて通らないこと"""
+        import asyncio
+        clock = FakeClock()
+        throttle = LoginThrottle(make_stores(clock)[store_index], user_limit=5, user_window=300,
+                                 ip_limit=0, clock=clock)
+
+        async def guess(i):
+            try:
+                await throttle.check("victim", f"10.0.{i}.1")
+            except LoginThrottled:
+                return False
+            # bcrypt の照合中に他の試行が届く
+            await asyncio.sleep(0.01)
+            await throttle.record_failure("victim")
+            return True
+
+        results = await asyncio.gather(*(guess(i) for i in range(32)))
+        assert results.count(True) == 5
+        assert throttle.stats()["rejected_user"] == 27
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("store_index", [0, 1])
+    async def test_cancel_releases_attempt(self, store_index):
+        """照合まで進まなかった試行は数えないこと"""
+        clock = FakeClock()
+        throttle = LoginThrottle(make_stores(clock)[store_index], user_limit=1, ip_limit=1, clock=clock)
+        attempt = await throttle.check("testAI", "10.0.0.1")
+        await throttle.cancel(attempt)
+        await throttle.check("testAI", "10.0.0.1")
+        with pytest.raises(LoginThrottled):
+            await throttle.check("testAI", "10.0.0.1")
+
+    def test_incomplete_store_fails_on_creation(self):
+        """必要なメソッドが揃っていない保存先は作成時にエラーになること"""
+        class AcquireOnlyStore(ThrottleStore):
+            async def acquire(self, key, limit, window, now):
+                return "id", 0.0
+
+        with pytest.raises(TypeError):
+            AcquireOnlyStore()
+
+    def test_client_ip(self):
+        """X-Forwarded-For は信頼するプロキシからの場合のみ、信頼するプロキシを除いた最も右の値を使うこと"""
+        proxies = parse_networks("10.0.0.0/8")
+        headers = {"x-forwarded-for": "198.51.100.7, 203.0.113.5, 10.0.0.2"}
+        assert client_ip_from(headers, "10.0.0.1", trusted_proxies=[]) == "10.0.0.1"
+        assert client_ip_from(headers, "192.0.2.1", trusted_proxies=proxies) == "192.0.2.1"
+        assert client_ip_from(headers, "10.0.0.1", trusted_proxies=proxies) == "203.0.113.5"
+        assert client_ip_from({}, "10.0.0.1", trusted_proxies=proxies) == "10.0.0.1"
+        assert client_ip_from({}, None) == "unknown"
+
+    def test_spoofed_forwarded_for_is_ignored(self):
+        """クライアントが先頭に付けた値を変えても、制限に使う IP は変わらないこと"""
+        proxies = parse_networks("10.0.0.0/8")
+        ips = {
+            client_ip_from({"x-forwarded-for": f"192.0.2.{i}, 203.0.113.5"}, "10.0.0.1", trusted_proxies=proxies)
+            for i in range(10)
+        }
+        assert ips == {"203.0.113.5"}
+        assert client_ip_from({"x-forwarded-for": "not-an-ip"}, "10.0.0.1", trusted_proxies=proxies) == "10.0.0.1"
@@ -25,14 +25,10 @@ class TestAPI:
         assert response.status_code == 200
         assert response.json() == {"message": "WebApp API is running"}
 
-    @patch('main.get_db_connection')
+    @patch('main.fetch_one', new_callable=AsyncMock)
     @patch('main.hash_password')
-    def test_login_success(self, mock_hash, mock_db):
+    def test_login_success(self, mock_hash, mock_fetch_one):
         """ログイン成功のテスト"""
-        mock_conn = MagicMock()
-        mock_cursor = MagicMock()
-        mock_db.return_value = mock_conn
-        mock_conn.cursor.return_value = mock_cursor
         
         # 実際のパスワードハッシュを生成
         actual_hash = '$2b$12$EhKjNQoGFjKmZgGZgJqwxuJyWQVBQWCgJ9oL7.HJYZKlJFDpqFJgK'
@@ -40,7 +36,7 @@ class TestAPI:
         actual_hash = bcrypt.hashpw('testAI00!'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
         
         # テストユーザーのデータをモック
-        mock_cursor.fetchone.return_value = {
+        mock_fetch_one.return_value = {
             'username': 'testAI',
             'password_hash': actual_hash
         }
@@ -55,16 +51,11 @@ class TestAPI:
         assert "access_token" in data
         assert data["token_type"] == "bearer"
 
-    @patch('main.get_db_connection')
-    def test_login_failure(self, mock_db):
+    @patch('main.fetch_one', new_callable=AsyncMock)
+    def test_login_failure(self, mock_fetch_one):
         """ログイン失敗のテスト"""
-        mock_conn = MagicMock()
-        mock_cursor = MagicMock()
-        mock_db.return_value = mock_conn
-        mock_conn.cursor.return_value = mock_cursor
-        
         # 存在しないユーザー
-        mock_cursor.fetchone.return_value = None
+        mock_fetch_one.return_value = None
         
         response = client.post("/login", json={
             "username": "wronguser",
@@ -74,8 +65,39 @@ class TestAPI:
         assert response.status_code == 401
         assert "ユーザー名またはパスワードが間違っています" in response.json()["detail"]
 
-    @patch('main.get_db_connection')
-    def test_dashboard_with_valid_token(self, mock_db):
+    @patch('main.fetch_one', new_callable=AsyncMock)
+    def test_login_password_hasher_busy(self, mock_fetch_one):
+        """パスワード照合の待ち行列が満杯なら 503 と Retry-After を返すこと"""
+        from password_hasher import PasswordHasherBusy
+        mock_fetch_one.return_value = {'username': 'testAI', 'password_hash': 'hash'}
+        hasher = MagicMock()
+        hasher.verify = AsyncMock(side_effect=PasswordHasherBusy("busy", 1.5))
+
+        with patch('main.get_password_hasher', return_value=hasher):
+            response = client.post("/login", json={"username": "testAI", "password": "testAI00!"})
+
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "2"
+
+    @patch('main.fetch_one', new_callable=AsyncMock)
+    def test_login_throttled_before_db(self, mock_fetch_one):
+        """失敗が続いたユーザー名は DB を参照せずに 429 を返すこと"""
+        from login_throttle import LoginThrottle
+        mock_fetch_one.return_value = None
+
+        with patch('main.get_login_throttle', return_value=LoginThrottle(user_limit=2, ip_limit=100)):
+            statuses = [
+                client.post("/login", json={"username": "victim", "password": "guess"}).status_code
+                for _ in range(3)
+            ]
+            response = client.post("/login", json={"username": "victim", "password": "guess"})
+
+        assert statuses == [401, 401, 429]
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) > 0
+        assert mock_fetch_one.await_count == 2
+
+    def test_dashboard_with_valid_token(self):
         """有効なトークンでダッシュボードアクセスのテスト"""
         token = jwt.encode(
             {"sub": "testAI", "exp": datetime.utcnow() + timedelta(minutes=30)},
@@ -104,16 +126,11 @@ class TestAPI:
         })
         assert response.status_code == 401
 
-    @patch('main.get_db_connection')
-    def test_profile_endpoint(self, mock_db):
+    @patch('main.fetch_one', new_callable=AsyncMock)
+    def test_profile_endpoint(self, mock_fetch_one):
         """プロフィールエンドポイントのテスト"""
-        mock_conn = MagicMock()
-        mock_cursor = MagicMock()
-        mock_db.return_value = mock_conn
-        mock_conn.cursor.return_value = mock_cursor
-        
         # ユーザーデータをモック
-        mock_cursor.fetchone.return_value = {
+        mock_fetch_one.return_value = {
             'id': 1,
             'username': 'testAI',
             'created_at': datetime.now()
@@ -179,16 +196,11 @@ class TestAPI:
         assert "usage" in data
         assert "timestamp" in data
 
-    @patch('main.get_db_connection')
-    def test_chat_history_endpoint(self, mock_db):
+    @patch('main.fetch_all', new_callable=AsyncMock)
+    def test_chat_history_endpoint(self, mock_fetch_all):
         """チャット履歴取得エンドポイントのテスト"""
-        mock_conn = MagicMock()
-        mock_cursor = MagicMock()
-        mock_db.return_value = mock_conn
-        mock_conn.cursor.return_value = mock_cursor
-        
         # 履歴データのモック
-        mock_cursor.fetchall.return_value = [
+        mock_fetch_all.return_value = [
             {
                 'id': 1,
                 'user_message': 'こんにちは',
@@ -212,13 +224,64 @@ class TestAPI:
         assert "history" in data
         assert len(data["history"]) == 1
 
-    @patch('main.get_db_connection')
-    def test_clear_chat_history_endpoint(self, mock_db):
+    @patch('main.fetch_all', new_callable=AsyncMock)
+    def test_chat_history_pagination(self, mock_fetch_all):
+        """次ページがある場合にカーソルが返り、続きの取得に使えること"""
+        rows = [
+            {'id': 10 - i, 'user_message': f'質問{i}', 'assistant_message': f'回答{i}',
+             'created_at': datetime(2025, 7, 7, 12, 0, 0) - timedelta(minutes=i)}
+            for i in range(3)
+        ]
+        mock_fetch_all.return_value = rows
+        headers = {"Authorization": f"Bearer {self._token()}"}
+
+        response = client.get("/chat/history?limit=2", headers=headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["history"]) == 2
+        assert data["next_cursor"]
+
+        mock_fetch_all.return_value = rows[2:]
+        response = client.get(f"/chat/history?limit=2&cursor={data['next_cursor']}", headers=headers)
+        assert response.status_code == 200
+        assert response.json()["next_cursor"] is None
+        query, params = mock_fetch_all.await_args.args
+        assert "(created_at, id) < (%s, %s)" in query
+        assert params[1:3] == (datetime(2025, 7, 7, 11, 59, 0), 9)
+        assert params[-1] == 3
+
+    @patch('main.fetch_all', new_callable=AsyncMock)
+    def test_chat_history_filters_and_preview(self, mock_fetch_all):
+        """日付範囲とプレビュー指定が SQL に反映されること"""
+        mock_fetch_all.return_value = []
+        response = client.get(
+            "/chat/history?since=2025-07-01T00:00:00&until=2025-07-08T00:00:00&preview=true&preview_length=20",
+            headers={"Authorization": f"Bearer {self._token()}"}
+        )
+        assert response.status_code == 200
+        query, params = mock_fetch_all.await_args.args
+        assert "LEFT(assistant_message, %s)" in query
+        assert "created_at >= %s" in query and "created_at < %s" in query
+        assert params[:3] == (20, 20, "testAI")
+
+    def test_chat_history_invalid_cursor(self):
+        """不正なカーソルは 400 になること"""
+        response = client.get(
+            "/chat/history?cursor=not-a-cursor",
+            headers={"Authorization": f"Bearer {self._token()}"}
+        )
+        assert response.status_code == 400
+
+    def _token(self):
+        return jwt.encode(
+            {"sub": "testAI", "exp": datetime.utcnow() + timedelta(minutes=30)},
+            "your-secret-key-here",
+            algorithm="HS256"
+        )
+
+    @patch('main.execute', new_callable=AsyncMock)
+    def test_clear_chat_history_endpoint(self, mock_execute):
         """チャット履歴削除エンドポイントのテスト"""
-        mock_conn = MagicMock()
-        mock_cursor = MagicMock()
-        mock_db.return_value = mock_conn
-        mock_conn.cursor.return_value = mock_cursor
         
         token = jwt.encode(
             {"sub": "testAI", "exp": datetime.utcnow() + timedelta(minutes=30)},
@@ -233,6 +296,7 @@ class TestAPI:
         assert response.status_code == 200
         data = response.json()
         assert data["message"] == "チャット履歴が削除されました"
+        mock_execute.assert_awaited_once()
 
     def test_chat_without_token(self):
         """トークンなしでチャットアクセスのテスト"""
@@ -265,4 +329,285 @@ class TestAPI:
         )
         
         assert response.status_code == 500
-        assert "チャット処理中にエラーが発生しました" in response.json()["detail"]
\ No newline at end of file
+        assert "チャット処理中にエラーが発生しました" in response.json()["detail"]
+
+    @patch('main.get_azure_openai_client')
+    def test_chat_rate_limited(self, mock_get_client):
+        """送信枠不足は Retry-After 付きの 429 になること"""
+        from rate_limiter import RateLimitExceeded
+        mock_client = MagicMock()
+        mock_get_client.return_value = mock_client
+        mock_client.chat_completion = AsyncMock(side_effect=RateLimitExceeded("busy", 2.5))
+
+        token = jwt.encode(
+            {"sub": "testAI", "exp": datetime.utcnow() + timedelta(minutes=30)},
+            "your-secret-key-here",
+            algorithm="HS256"
+        )
+        response = client.post("/chat",
+            json={"messages": [{"role": "user", "content": "テスト"}]},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == "3"
+
+    @patch('main.get_azure_openai_client')
+    def test_chat_stream_rate_limited_before_first_chunk(self, mock_get_client):
+        """ストリーミングでも最初のチャンク前の送信枠不足は 429 になること"""
+        from rate_limiter import RateLimitExceeded
+
+        async def stream(_):
+            raise RateLimitExceeded("busy", 1)
+            yield ""
+
+        mock_client = MagicMock()
+        mock_get_client.return_value = mock_client
+        mock_client.chat_completion_stream = stream
+
+        token = jwt.encode(
+            {"sub": "testAI", "exp": datetime.utcnow() + timedelta(minutes=30)},
+            "your-secret-key-here",
+            algorithm="HS256"
+        )
+        response = client.post("/chat/stream",
+            json={"messages": [{"role": "user", "content": "テスト"}]},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == "1"
+
+class TestChatStreamDisconnect:
+    @pytest.mark.asyncio
+    async def test_disconnect_cancels_upstream_and_saves_partial(self):
+        """クライアント切断で上流ストリームが閉じられ、途中までの応答が truncated で保存されること"""
+        import asyncio
+        import main
+        upstream_closed = asyncio.Event()
+
+        async def upstream(_):
+            try:
+                for i in range(1000):
+                    yield f"c{i}"
+                    await asyncio.sleep(0.01)
+            finally:
+                upstream_closed.set()
+
+        mock_client = MagicMock()
+        mock_client.chat_completion_stream = upstream
+        writer = MagicMock()
+        writer.running = True
+        writer.put_nowait = MagicMock(return_value=True)
+        token = jwt.encode(
+            {"sub": "testAI", "exp": datetime.utcnow() + timedelta(minutes=30)},
+            "your-secret-key-here",
+            algorithm="HS256"
+        )
+        body = json.dumps({"messages": [{"role": "user", "content": "長い質問"}]}).encode("utf-8")
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": "POST", "scheme": "http", "path": "/chat/stream", "raw_path": b"/chat/stream",
+            "query_string": b"", "root_path": "", "server": ("test", 80), "client": ("test", 1234),
+            "headers": [
+                (b"authorization", f"Bearer {token}".encode("ascii")),
+                (b"content-type", b"application/json"),
+            ],
+        }
+        received = []
+        enough = asyncio.Event()
+
+        async def receive():
+            if not received:
+                received.append(True)
+                return {"type": "http.request", "body": body, "more_body": False}
+            await enough.wait()
+            return {"type": "http.disconnect"}
+
+        sent_chunks = []
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                sent_chunks.append(message["body"])
+                if len(sent_chunks) >= 3:
+                    enough.set()
+
+        registry = main.get_chat_stream_registry()
+        cancelled_before = registry.stats_counts["cancelled"]
+        with patch('main.get_azure_openai_client', return_value=mock_client), \
+                patch('main.get_chat_history_writer', return_value=writer), \
+                patch('main.save_chat_history', new_callable=AsyncMock) as mock_save, \
+                patch.object(registry, "resume_grace", 0), \
+                patch.object(registry, "coalesce_ms", 0):
+            await asyncio.wait_for(app(scope, receive, send), 5)
+            await asyncio.wait_for(upstream_closed.wait(), 1)
+
+        assert len(sent_chunks) < 10
+        assert registry.stats_counts["cancelled"] == cancelled_before + 1
+        mock_save.assert_not_awaited()
+        record = writer.put_nowait.call_args.args[0]
+        assert record.truncated is True
+        assert record.user_message == "長い質問"
+        assert record.assistant_message.startswith("c0c1")
+
+class TestChatHistoryPersistence:
+    @pytest.mark.asyncio
+    @patch('main.insert_chat_history_batch', new_callable=AsyncMock)
+    async def test_save_without_writer_inserts_directly(self, mock_insert):
+        """ワーカー未起動時は直接保存されること"""
+        from main import save_chat_history
+        from azure_openai_client import ChatMessage
+        await save_chat_history("testAI", [ChatMessage(role="user", content="質問")], "回答")
+        record = mock_insert.await_args.args[0][0]
+        assert record.user_message == "質問"
+        assert record.assistant_message == "回答"
+
+    @pytest.mark.asyncio
+    async def test_save_enqueues_when_writer_running(self):
+        """ワーカー起動中はキューに積まれること"""
+        from main import save_chat_history
+        from azure_openai_client import ChatMessage
+        writer = MagicMock()
+        writer.running = True
+        writer.put = AsyncMock()
+        with patch('main.get_chat_history_writer', return_value=writer), \
+                patch('main.insert_chat_history_batch', new_callable=AsyncMock) as mock_insert:
+            await save_chat_history("testAI", [ChatMessage(role="user", content="質問")], "回答")
+        writer.put.assert_awaited_once()
+        mock_insert.assert_not_awaited()
+
+class TestConversations:
+    def auth_headers(self):
+        token = jwt.encode(
+            {"sub": "testAI", "exp": datetime.utcnow() + timedelta(minutes=30)},
+            "your-secret-key-here",
+            algorithm="HS256"
+        )
+        return {"Authorization": f"Bearer {token}"}
+
+    def test_chat_sends_only_new_message(self):
+        """新しいメッセージだけを送り、過去のやり取りはサーバー側で補われること"""
+        from conversation_store import ConversationStore
+        from azure_openai_client import ChatResponse
+
+        async def fetch_one(query, params):
+            return {"system_prompt": None, "turn_count": 1}
+
+        fetch_all = AsyncMock(return_value=[{"user_message": "質問1", "assistant_message": "回答1"}])
+        store = ConversationStore(fetch_one=fetch_one, fetch_all=fetch_all)
+        mock_client = MagicMock()
+        mock_client.chat_completion = AsyncMock(side_effect=lambda request: ChatResponse(
+            message=f"回答{len(request.messages) // 2 + 1}", timestamp=datetime.now().isoformat()
+        ))
+
+        with patch('main.get_conversation_store', return_value=store), \
+                patch('main.get_azure_openai_client', return_value=mock_client), \
+                patch('main.save_chat_history', new_callable=AsyncMock) as mock_save:
+            for i in (2, 3):
+                response = client.post("/conversations/7/chat", json={"message": f"質問{i}"},
+                                       headers=self.auth_headers())
+                assert response.status_code == 200
+                assert response.json()["message"] == f"回答{i}"
+
+        sent = mock_client.chat_completion.await_args.args[0]
+        assert [m.content for m in sent.messages] == ["質問1", "回答1", "質問2", "回答2", "質問3"]
+        assert sent.system_prompt
+        # 2 ターン目は履歴を読み直さない
+        assert fetch_all.await_count == 1
+        assert mock_save.await_args.kwargs["conversation_id"] == 7
+
+    def test_unknown_conversation_is_404(self):
+        from conversation_store import ConversationStore
+        store = ConversationStore(fetch_one=AsyncMock(return_value=None), fetch_all=AsyncMock())
+        with patch('main.get_conversation_store', return_value=store):
+            response = client.post("/conversations/7/chat", json={"message": "質問"}, headers=self.auth_headers())
+        assert response.status_code == 404
+
+    @patch('main.execute_returning', new_callable=AsyncMock)
+    def test_create_conversation(self, mock_execute_returning):
+        mock_execute_returning.return_value = {
+            "id": 1, "title": None, "system_prompt": None, "turn_count": 0,
+            "created_at": datetime.now(), "updated_at": datetime.now(),
+        }
+        response = client.post("/conversations", json={}, headers=self.auth_headers())
+        assert response.status_code == 201
+        assert response.json()["id"] == 1
+        assert mock_execute_returning.await_args.args[1][0] == "testAI"
+
+class TestChatHistorySearch:
+    @patch('main.fetch_all', new_callable=AsyncMock)
+    def test_search_returns_snippets_and_cursor(self, mock_fetch_all):
+        """スニペットと次ページのカーソルが返ること"""
+        token = jwt.encode(
+            {"sub": "testAI", "exp": datetime.utcnow() + timedelta(minutes=30)},
+            "your-secret-key-here",
+            algorithm="HS256"
+        )
+        mock_fetch_all.return_value = [
+            {"id": i, "user_message": f"経費精算について{i}", "assistant_message": "締め日は25日です",
+             "created_at": datetime(2026, 10, 19, 9, 0, i), "truncated": False, "conversation_id": None,
+             "rank": None}
+            for i in (3, 2, 1)
+        ]
+        response = client.get("/chat/history/search", params={"q": "経費", "limit": 2},
+                              headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["mode"] == "trigram"
+        assert [r["id"] for r in data["results"]] == [3, 2]
+        assert data["results"][0]["user_snippet"]["highlights"] == [[0, 2]]
+        assert data["next_cursor"]
+
+        # 続きのページはカーソルの位置より後ろを検索する
+        response = client.get("/chat/history/search", params={"q": "経費", "cursor": data["next_cursor"]},
+                              headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200
+        assert mock_fetch_all.await_args.args[1][-3:] == [datetime(2026, 10, 19, 9, 0, 2), 2, 21]
+
+        response = client.get("/chat/history/search", params={"q": "docker", "cursor": data["next_cursor"]},
+                              headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 400
+
+class TestChatHistoryExport:
+    def test_export_streams_own_history(self):
+        """ログイン中のユーザーの履歴だけを、ダウンロード用のヘッダー付きで返すこと"""
+        token = jwt.encode(
+            {"sub": "testAI", "exp": datetime.utcnow() + timedelta(minutes=30)},
+            "your-secret-key-here",
+            algorithm="HS256"
+        )
+        exporter = MagicMock()
+
+        async def stream(fmt, export_filter, gzip):
+            exporter.called_with = (fmt, export_filter, gzip)
+            yield b'{"id": 1}\n'
+            yield b'{"id": 2}\n'
+
+        exporter.stream = stream
+        with patch('main.get_history_exporter', return_value=exporter):
+            response = client.get("/chat/history/export", params={"since": "2026-10-01T00:00:00"},
+                                  headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        assert response.headers["content-disposition"].startswith('attachment; filename="chat_history_')
+        assert response.content == b'{"id": 1}\n{"id": 2}\n'
+        fmt, export_filter, gzip = exporter.called_with
+        assert (fmt, gzip) == ("ndjson", False)
+        assert export_filter.usernames == ["testAI"]
+        assert export_filter.since == datetime(2026, 10, 1)
+
+    def test_export_busy(self):
+        """同時実行数の上限では 503 を返すこと"""
+        from history_export import ExportBusy
+        token = jwt.encode(
+            {"sub": "testAI", "exp": datetime.utcnow() + timedelta(minutes=30)},
+            "your-secret-key-here",
+            algorithm="HS256"
+        )
+        exporter = MagicMock()
+        exporter.check_capacity.side_effect = ExportBusy("busy")
+        with patch('main.get_history_exporter', return_value=exporter):
+            response = client.get("/chat/history/export", params={"format": "csv", "gzip": "true"},
+                                  headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "5"
@@ -0,0 +1,90 @@
+# -------------------------------------------------
+# ・ファイル名：test_metrics.py
+# ・ファイル内容：Prometheus メトリクスの単体テスト
+# ・作成日時：2026/10/19 05:00:00  agent
+# -------------------------------------------------
+
+import pytest
+import httpx
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from main import app
+from test_azure_openai_client import completion_body, stream_body, make_client, make_request
+
+client = TestClient(app)
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+class TestHttpMetrics:
+    def test_requests_are_labelled_by_route_template(self):
+        """パスではなくルートの定義と状態コードでリクエストが数えられること"""
+        before_root = sample("http_requests_total", method="GET", route="/", status="200")
+        before_unmatched = sample("http_requests_total", method="GET", route="unmatched", status="404")
+        before_hist = sample("http_request_duration_seconds_count", method="GET", route="/")
+
+        assert client.get("/").status_code == 200
+        assert client.get("/no/such/path/123").status_code == 404
+
+        assert sample("http_requests_total", method="GET", route="/", status="200") == before_root + 1
+        assert sample("http_requests_total", method="GET", route="unmatched", status="404") == before_unmatched + 1
+        assert sample("http_request_duration_seconds_count", method="GET", route="/") == before_hist + 1
+        assert sample("http_requests_in_progress", method="GET", route="/") == 0
+
+    def test_metrics_endpoint_exposes_text_format(self):
+        """/metrics が Prometheus のテキスト形式を返すこと"""
+        client.get("/")
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert 'http_requests_total{method="GET",route="/",status="200"}' in response.text
+
+class TestDbMetrics:
+    @pytest.mark.asyncio
+    async def test_db_access_is_timed_per_operation(self):
+        """DB アクセスの所要時間が operation 毎に記録されること"""
+        import database
+        before = sample("db_query_duration_seconds_count", operation="fetch_one")
+        with patch.object(database, "db_connection") as connection:
+            connection.return_value.__enter__.return_value.cursor.return_value.fetchone.return_value = {"id": 1}
+            assert await database.fetch_one("SELECT 1") == {"id": 1}
+        assert sample("db_query_duration_seconds_count", operation="fetch_one") == before + 1
+
+class TestLlmMetrics:
+    @pytest.mark.asyncio
+    async def test_completion_records_latency_and_usage(self):
+        """呼び出し時間と usage のトークン数が記録されること"""
+        llm = make_client(lambda request: httpx.Response(200, json=completion_body("ok")))
+        name = llm.pool.deployments[0].name
+        before_prompt = sample("llm_tokens_total", deployment=name, kind="prompt")
+        before_completion = sample("llm_tokens_total", deployment=name, kind="completion")
+        before_calls = sample("llm_request_duration_seconds_count", deployment=name, stream="false", outcome="ok")
+
+        await llm.chat_completion(make_request("メトリクス"))
+
+        assert sample("llm_tokens_total", deployment=name, kind="prompt") == before_prompt + 5
+        assert sample("llm_tokens_total", deployment=name, kind="completion") == before_completion + 3
+        assert sample(
+            "llm_request_duration_seconds_count", deployment=name, stream="false", outcome="ok"
+        ) == before_calls + 1
+
+    @pytest.mark.asyncio
+    async def test_stream_records_first_token_and_rate(self):
+        """ストリームで最初のトークンまでの時間と受信速度が記録されること"""
+        llm = make_client(lambda request: httpx.Response(
+            200, content=stream_body(["a", "b", "c"]), headers={"content-type": "text/event-stream"}
+        ))
+        name = llm.pool.deployments[0].name
+        before_ttft = sample("llm_time_to_first_token_seconds_count", deployment=name)
+        before_rate = sample("llm_stream_tokens_per_second_count", deployment=name)
+        before_calls = sample("llm_request_duration_seconds_count", deployment=name, stream="true", outcome="ok")
+
+        chunks = [chunk async for chunk in llm.chat_completion_stream(make_request("ストリーム"))]
+
+        assert chunks == ["a", "b", "c"]
+        assert sample("llm_time_to_first_token_seconds_count", deployment=name) == before_ttft + 1
+        assert sample("llm_stream_tokens_per_second_count", deployment=name) == before_rate + 1
+        assert sample(
+            "llm_request_duration_seconds_count", deployment=name, stream="true", outcome="ok"
+        ) == before_calls + 1
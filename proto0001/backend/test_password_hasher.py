@@ -0,0 +1,77 @@
+# -------------------------------------------------
+# ・ファイル名：test_password_hasher.py
+# ・ファイル内容：bcrypt 専用スレッドプールの単体テスト
+# ・作成日時：2026/10/19 02:00:00  agent
+# -------------------------------------------------
+
+import asyncio
+import threading
+import time
+import pytest
+import bcrypt
+from password_hasher import PasswordHasher, PasswordHasherBusy
+
+class TestPasswordHasher:
+    @pytest.mark.asyncio
+    async def test_hash_and_verify(self):
+        """スレッドプールでハッシュ化・照合できること"""
+        hasher = PasswordHasher(max_workers=2)
+        try:
+            hashed = await hasher.hash("testAI00!")
+            assert bcrypt.checkpw(b"testAI00!", hashed.encode("utf-8"))
+            assert await hasher.verify("testAI00!", hashed) is True
+            assert await hasher.verify("wrong", hashed) is False
+            stats = hasher.stats()
+            assert stats["completed"] == 3 and stats["pending"] == 0
+        finally:
+            hasher.close()
+
+    @pytest.mark.asyncio
+    async def test_does_not_block_event_loop(self):
+        """照合中もイベントループが他の処理を進められること"""
+        hasher = PasswordHasher(max_workers=1)
+        hasher_thread = []
+
+        def slow_verify(password, hashed):
+            hasher_thread.append(threading.current_thread().name)
+            time.sleep(0.2)
+            return True
+
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        try:
+            assert await hasher._run(slow_verify, "p", "h") is True
+        finally:
+            task.cancel()
+            hasher.close()
+        assert ticks >= 10
+        assert hasher_thread[0].startswith("bcrypt")
+
+    @pytest.mark.asyncio
+    async def test_rejects_when_queue_is_full(self):
+        """実行中 + 待機中が上限に達したら PasswordHasherBusy になること"""
+        hasher = PasswordHasher(max_workers=1, max_pending=2, retry_after=3)
+        release = threading.Event()
+
+        def blocked(password, hashed):
+            release.wait(1)
+            return True
+
+        try:
+            running = [asyncio.create_task(hasher._run(blocked, "p", "h")) for _ in range(2)]
+            await asyncio.sleep(0.01)
+            with pytest.raises(PasswordHasherBusy) as excinfo:
+                await hasher.verify("p", "h")
+            assert excinfo.value.retry_after_header == "3"
+            release.set()
+            assert await asyncio.gather(*running) == [True, True]
+        finally:
+            hasher.close()
+        assert hasher.stats()["rejected"] == 1
@@ -0,0 +1,155 @@
+# -------------------------------------------------
+# ・ファイル名：test_rate_limiter.py
+# ・ファイル内容：レート制限の単体テスト
+# ・作成日時：2026/10/18 20:00:00  agent
+# -------------------------------------------------
+
+import asyncio
+import pytest
+import httpx
+from rate_limiter import RateLimiter, RateLimitExceeded, TokenBucket
+from azure_openai_client import AzureOpenAIClient
+from test_azure_openai_client import completion_body, make_request
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+class TestTokenBucket:
+    def test_refill_and_wait_time(self):
+        """消費した分が毎分の上限に比例して補充されること"""
+        clock = FakeClock()
+        bucket = TokenBucket(per_minute=60, burst_seconds=10, clock=clock)
+        assert bucket.capacity == 10
+        bucket.consume(10)
+        assert bucket.wait_time(1) == pytest.approx(1.0)
+        clock.now = 3
+        assert bucket.available() == pytest.approx(3)
+        clock.now = 100
+        assert bucket.available() == 10
+
+    def test_oversized_request_waits_for_full_bucket(self):
+        """容量を超える要求も満杯になれば通ること"""
+        clock = FakeClock()
+        bucket = TokenBucket(per_minute=600, burst_seconds=1, clock=clock)
+        assert bucket.wait_time(10_000) == 0.0
+
+class TestRateLimiter:
+    @pytest.mark.asyncio
+    async def test_admits_within_quota(self):
+        """枠内の呼び出しは待たずに通ること"""
+        limiter = RateLimiter(rpm=600, tpm=60000, burst_seconds=1)
+        for _ in range(10):
+            await limiter.acquire(100)
+        stats = limiter.stats()
+        assert stats["admitted"] == 10
+        assert stats["queued"] == 0
+
+    @pytest.mark.asyncio
+    async def test_rejects_when_wait_exceeds_deadline(self):
+        """待ち時間が上限を超える見込みなら即座に 429 相当の例外になること"""
+        limiter = RateLimiter(rpm=60, tpm=0, burst_seconds=1, max_wait=0.5)
+        await limiter.acquire(1)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        with pytest.raises(RateLimitExceeded) as excinfo:
+            await limiter.acquire(1)
+        assert loop.time() - started < 0.1
+        assert excinfo.value.retry_after == pytest.approx(1.0, abs=0.1)
+        assert excinfo.value.retry_after_header == "1"
+        assert limiter.stats()["rejected"] == 1
+
+    @pytest.mark.asyncio
+    async def test_queued_callers_are_served_in_order(self):
+        """枠待ちの呼び出しが到着順に通ること"""
+        limiter = RateLimiter(rpm=1200, tpm=0, burst_seconds=0.05, max_wait=5)
+        order = []
+
+        async def call(i):
+            await limiter.acquire(1)
+            order.append(i)
+
+        await asyncio.gather(*(call(i) for i in range(5)))
+        assert order == list(range(5))
+        assert limiter.stats()["queued"] >= 4
+
+    @pytest.mark.asyncio
+    async def test_token_budget_and_usage_correction(self):
+        """実績トークン数が見積もりより少なければ差分が戻ること"""
+        limiter = RateLimiter(rpm=0, tpm=6000, burst_seconds=1, max_wait=0)
+        await limiter.acquire(100)
+        with pytest.raises(RateLimitExceeded):
+            await limiter.acquire(100)
+        limiter.record_usage(100, 20)
+        await limiter.acquire(80)
+
+    @pytest.mark.asyncio
+    async def test_headers_tune_remaining_quota(self):
+        """残りクォータと retry-after のヘッダーが反映されること"""
+        limiter = RateLimiter(rpm=600, tpm=0, burst_seconds=1, max_wait=0)
+        limiter.update_from_headers({"x-ratelimit-remaining-requests": "0"})
+        with pytest.raises(RateLimitExceeded):
+            await limiter.acquire(1)
+
+        limiter = RateLimiter(rpm=0, tpm=0, max_wait=0)
+        limiter.update_from_headers({"retry-after-ms": "1500", "retry-after": "2"})
+        with pytest.raises(RateLimitExceeded) as excinfo:
+            await limiter.acquire(1)
+        assert excinfo.value.retry_after == pytest.approx(1.5, abs=0.1)
+        assert limiter.stats()["upstream_throttled"] == 1
+
+class TestClientIntegration:
+    @pytest.mark.asyncio
+    async def test_azure_429_becomes_rate_limit_exceeded(self):
+        """Azure の 429 で以降の送信が止まり、RateLimitExceeded になること"""
+        calls = []
+
+        def handler(request: httpx.Request):
+            calls.append(request)
+            return httpx.Response(
+                429,
+                json={"error": {"message": "rate limited", "code": "429"}},
+                headers={"retry-after": "3"},
+            )
+
+        limiter = RateLimiter(rpm=0, tpm=0, max_wait=0)
+        client = AzureOpenAIClient(
+            endpoint="https://example.openai.azure.com/",
+            api_key="test-key",
+            api_version="2024-02-15-preview",
+            model_name="gpt-35-turbo",
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+            rate_limiter=limiter,
+        )
+        with pytest.raises(RateLimitExceeded) as excinfo:
+            await client.chat_completion(make_request("1"))
+        assert excinfo.value.retry_after == 3
+        # 待機中は Azure に送らずに失敗する
+        with pytest.raises(RateLimitExceeded):
+            await client.chat_completion(make_request("2"))
+        assert len(calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_remaining_headers_are_read(self):
+        """正常応答の x-ratelimit-remaining-tokens が取り込まれること"""
+        def handler(request: httpx.Request):
+            return httpx.Response(
+                200,
+                json=completion_body("ok"),
+                headers={"x-ratelimit-remaining-tokens": "5"},
+            )
+
+        limiter = RateLimiter(rpm=0, tpm=600000, burst_seconds=1)
+        client = AzureOpenAIClient(
+            endpoint="https://example.openai.azure.com/",
+            api_key="test-key",
+            api_version="2024-02-15-preview",
+            model_name="gpt-35-turbo",
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+            rate_limiter=limiter,
+        )
+        await client.chat_completion(make_request())
+        assert limiter.tokens.available() < 100
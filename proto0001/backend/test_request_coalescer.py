@@ -0,0 +1,155 @@
+# -------------------------------------------------
+# ・ファイル名：test_request_coalescer.py
+# ・ファイル内容：リクエストコアレッシングの単体テスト
+# ・作成日時：2026/10/18 18:00:00  agent
+# -------------------------------------------------
+
+import asyncio
+import pytest
+import httpx
+from request_coalescer import RequestCoalescer, StreamOverrun
+from azure_openai_client import AzureOpenAIClient, ChatRequest, ChatMessage
+from test_azure_openai_client import completion_body
+
+async def slow_stream(pieces, delay=0.01):
+    for piece in pieces:
+        await asyncio.sleep(delay)
+        yield piece
+
+class TestRequestCoalescer:
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_share_one_upstream_call(self):
+        """同時に実行された同じキーの呼び出しが 1 回にまとまること"""
+        coalescer = RequestCoalescer()
+        calls = []
+
+        async def factory():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "answer"
+
+        results = await asyncio.gather(*(coalescer.run("k", factory) for _ in range(5)))
+        assert results == ["answer"] * 5
+        assert len(calls) == 1
+        assert coalescer.stats()["coalesced_calls"] == 4
+        assert coalescer.stats()["inflight_calls"] == 0
+
+    @pytest.mark.asyncio
+    async def test_error_is_shared(self):
+        """上流のエラーが全員に伝わること"""
+        coalescer = RequestCoalescer()
+
+        async def factory():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upstream failed")
+
+        results = await asyncio.gather(*(coalescer.run("k", factory) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_does_not_cancel_others(self):
+        """1 人がキャンセルしても他の待ち手は結果を受け取れること"""
+        coalescer = RequestCoalescer()
+
+        async def factory():
+            await asyncio.sleep(0.05)
+            return "answer"
+
+        first = asyncio.ensure_future(coalescer.run("k", factory))
+        second = asyncio.ensure_future(coalescer.run("k", factory))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == "answer"
+
+    @pytest.mark.asyncio
+    async def test_stream_fan_out_with_late_joiner(self):
+        """途中から参加した購読者にも全チャンクが届くこと"""
+        coalescer = RequestCoalescer()
+        starts = []
+
+        def factory():
+            starts.append(1)
+            return slow_stream(["a", "b", "c", "d"])
+
+        async def consume():
+            return [chunk async for chunk in coalescer.stream("k", factory)]
+
+        first = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.025)
+        second = asyncio.ensure_future(consume())
+        assert await first == await second == ["a", "b", "c", "d"]
+        assert len(starts) == 1
+        assert coalescer.stats()["coalesced_streams"] == 1
+
+    @pytest.mark.asyncio
+    async def test_stream_cancelled_when_all_subscribers_leave(self):
+        """購読者がいなくなったら上流ストリームが閉じられること"""
+        coalescer = RequestCoalescer()
+        closed = []
+
+        async def source():
+            try:
+                while True:
+                    await asyncio.sleep(0.01)
+                    yield "x"
+            finally:
+                closed.append(True)
+
+        subscription = coalescer.stream("k", source)
+        assert await subscription.__anext__() == "x"
+        await subscription.aclose()
+        await asyncio.sleep(0.02)
+        assert closed == [True]
+
+    @pytest.mark.asyncio
+    async def test_stream_over_byte_limit_is_not_joined(self):
+        """保持するチャンクが上限を超えたら古いものを捨て、以降の同じリクエストは新たに呼び出すこと"""
+        coalescer = RequestCoalescer(max_stream_bytes=8)
+        starts = []
+        pieces = ["aaaa", "bbbb", "cccc", "dddd"]
+
+        def factory():
+            starts.append(1)
+            return slow_stream(pieces)
+
+        async def consume():
+            return [chunk async for chunk in coalescer.stream("k", factory)]
+
+        first = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.035)
+        second = asyncio.ensure_future(consume())
+        assert await first == await second == pieces
+        assert len(starts) == 2
+        assert coalescer.stats()["unjoinable_streams"] == 1
+
+    @pytest.mark.asyncio
+    async def test_slow_subscriber_is_overrun(self):
+        """読み出しが遅れて未読のチャンクが捨てられた購読者は StreamOverrun になること"""
+        coalescer = RequestCoalescer(max_stream_bytes=8)
+        subscription = coalescer.stream("k", lambda: slow_stream(["aaaa", "bbbb", "cccc", "dddd"], delay=0))
+        assert await subscription.__anext__() == "aaaa"
+        await asyncio.sleep(0.01)
+        with pytest.raises(StreamOverrun):
+            await subscription.__anext__()
+
+class TestCoalescedClient:
+    @pytest.mark.asyncio
+    async def test_identical_requests_hit_azure_once(self):
+        """同じ ChatRequest の同時呼び出しで Azure が 1 回だけ呼ばれること"""
+        calls = []
+
+        async def handler(request):
+            calls.append(request)
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, json=completion_body("共有された回答"))
+
+        client = AzureOpenAIClient(
+            endpoint="https://example.openai.azure.com/",
+            api_key="test-key",
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+            coalescer=RequestCoalescer(),
+        )
+        request = ChatRequest(messages=[ChatMessage(role="user", content="共通の質問")])
+        responses = await asyncio.gather(*(client.chat_completion(request) for _ in range(4)))
+        assert len(calls) == 1
+        assert {r.message for r in responses} == {"共有された回答"}
@@ -0,0 +1,170 @@
+# -------------------------------------------------
+# ・ファイル名：test_resilience.py
+# ・ファイル内容：リトライとサーキットブレーカーの単体テスト
+# ・作成日時：2026/10/18 21:00:00  agent
+# -------------------------------------------------
+
+import asyncio
+import random
+import pytest
+import httpx
+from azure_openai_client import AzureOpenAIClient
+from resilience import CircuitBreaker, CircuitOpenError, RetryPolicy
+from test_azure_openai_client import completion_body, stream_body, make_request
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+def make_client(handler, breaker=None, **kwargs) -> AzureOpenAIClient:
+    return AzureOpenAIClient(
+        endpoint="https://example.openai.azure.com/",
+        api_key="test-key",
+        api_version="2024-02-15-preview",
+        model_name="gpt-35-turbo",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        retry_policy=RetryPolicy(max_retries=2, base_delay=0.001, max_delay=0.01),
+        circuit_breaker=breaker or CircuitBreaker(failure_threshold=100),
+        **kwargs,
+    )
+
+def server_error():
+    return httpx.Response(500, json={"error": {"message": "internal error", "code": "500"}})
+
+class TestRetryPolicy:
+    def test_delays_are_bounded_and_jittered(self):
+        """待ち時間が base_delay 以上 max_delay 以下で、回数が max_retries であること"""
+        policy = RetryPolicy(max_retries=50, base_delay=0.1, max_delay=2.0, rng=random.Random(1))
+        delays = list(policy.delays())
+        assert len(delays) == 50
+        assert all(0.1 <= d <= 2.0 for d in delays)
+        assert len(set(delays)) > 40
+
+class TestCircuitBreaker:
+    def test_state_transitions(self):
+        """closed → open → half_open → closed / open の遷移が通知されること"""
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+        transitions = []
+        breaker.add_listener(lambda name, old, new: transitions.append((old, new)))
+
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.CLOSED
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+        with pytest.raises(CircuitOpenError) as excinfo:
+            breaker.before_call()
+        assert excinfo.value.retry_after == pytest.approx(10)
+
+        clock.now = 10
+        breaker.before_call()
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        # 試行中は他の呼び出しを通さない
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+
+        clock.now = 20
+        breaker.before_call()
+        breaker.record_success()
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert transitions == [
+            ("closed", "open"), ("open", "half_open"), ("half_open", "open"),
+            ("open", "half_open"), ("half_open", "closed"),
+        ]
+        assert breaker.stats()["rejected"] == 2
+
+class TestClientRetries:
+    @pytest.mark.asyncio
+    async def test_retries_server_errors(self):
+        """5xx はリトライされ、成功すればそのまま返ること"""
+        calls = []
+
+        def handler(request: httpx.Request):
+            calls.append(request)
+            if len(calls) < 3:
+                return server_error()
+            return httpx.Response(200, json=completion_body("ok"))
+
+        response = await make_client(handler).chat_completion(make_request())
+        assert response.message == "ok"
+        assert len(calls) == 3
+
+    @pytest.mark.asyncio
+    async def test_does_not_retry_client_errors(self):
+        """4xx はリトライしないこと"""
+        calls = []
+
+        def handler(request: httpx.Request):
+            calls.append(request)
+            return httpx.Response(400, json={"error": {"message": "bad request", "code": "400"}})
+
+        with pytest.raises(Exception, match="Azure OpenAI APIの呼び出しでエラーが発生しました"):
+            await make_client(handler).chat_completion(make_request())
+        assert len(calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_stream_retries_before_first_token(self):
+        """最初のトークン前の 5xx はストリームでもリトライされること"""
+        calls = []
+
+        def handler(request: httpx.Request):
+            calls.append(request)
+            if len(calls) == 1:
+                return server_error()
+            return httpx.Response(
+                200,
+                content=stream_body(["こん", "にちは"]),
+                headers={"content-type": "text/event-stream"},
+            )
+
+        chunks = [chunk async for chunk in make_client(handler).chat_completion_stream(make_request())]
+        assert chunks == ["こん", "にちは"]
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_first_token_timeout_is_retried(self):
+        """最初のトークンが遅すぎる呼び出しは打ち切ってリトライすること"""
+        calls = []
+
+        async def handler(request: httpx.Request):
+            calls.append(request)
+            if len(calls) == 1:
+                await asyncio.sleep(1)
+            return httpx.Response(
+                200,
+                content=stream_body(["ok"]),
+                headers={"content-type": "text/event-stream"},
+            )
+
+        client = make_client(handler, first_token_timeout=0.1)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        chunks = [chunk async for chunk in client.chat_completion_stream(make_request())]
+        assert chunks == ["ok"]
+        assert len(calls) == 2
+        assert loop.time() - started < 0.5
+
+    @pytest.mark.asyncio
+    async def test_open_circuit_fails_fast(self):
+        """連続失敗でブレーカーが開き、以降は Azure を呼ばずに失敗すること"""
+        calls = []
+
+        def handler(request: httpx.Request):
+            calls.append(request)
+            return server_error()
+
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+        client = make_client(handler, breaker=breaker)
+        with pytest.raises(Exception, match="Azure OpenAI APIの呼び出しでエラーが発生しました"):
+            await client.chat_completion(make_request("1"))
+        assert breaker.state == CircuitBreaker.OPEN
+        assert len(calls) == 3
+
+        with pytest.raises(CircuitOpenError):
+            await client.chat_completion(make_request("2"))
+        assert len(calls) == 3
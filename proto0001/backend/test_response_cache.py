@@ -0,0 +1,121 @@
+# -------------------------------------------------
+# ・ファイル名：test_response_cache.py
+# ・ファイル内容：LLM 応答キャッシュの単体テスト
+# ・作成日時：2026/10/18 17:00:00  agent
+# -------------------------------------------------
+
+import pytest
+import httpx
+import azure_openai_client
+from response_cache import ResponseCache, request_cache_key
+from azure_openai_client import AzureOpenAIClient, ChatRequest, ChatMessage
+from test_azure_openai_client import completion_body, stream_body
+
+def make_request(content: str = "こんにちは", temperature: float = 0.0) -> ChatRequest:
+    return ChatRequest(
+        messages=[ChatMessage(role="user", content=content)],
+        temperature=temperature,
+        system_prompt="テスト用システムプロンプト",
+    )
+
+def make_client(handler, cache: ResponseCache) -> AzureOpenAIClient:
+    return AzureOpenAIClient(
+        endpoint="https://example.openai.azure.com/",
+        api_key="test-key",
+        model_name="gpt-35-turbo",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        cache=cache,
+    )
+
+class TestResponseCache:
+    def test_key_ignores_timestamp_but_not_content(self):
+        """キーはタイムスタンプに依存せず、内容の違いで変わること"""
+        a = make_request()
+        b = make_request()
+        b.messages[0].timestamp = "2025-07-07T12:00:00"
+        assert request_cache_key(a, "d") == request_cache_key(b, "d")
+        assert request_cache_key(a, "d") != request_cache_key(make_request("別の質問"), "d")
+        assert request_cache_key(a, "d") != request_cache_key(a, "other-deployment")
+
+    def test_lru_eviction(self):
+        """上限を超えると最も古く使われたエントリから削除されること"""
+        cache = ResponseCache(max_entries=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.stats()["evictions"] == 1
+
+    def test_ttl_expiry(self):
+        """TTL を過ぎたエントリはミスになること"""
+        cache = ResponseCache(ttl=-1)
+        cache.set("a", 1)
+        assert cache.get("a") is None
+        assert cache.stats()["expired"] == 1
+
+    def test_nonzero_temperature_bypass(self):
+        """temperature > 0 は許可されない限りキャッシュしないこと"""
+        assert not ResponseCache().is_cacheable(make_request(temperature=0.7))
+        assert ResponseCache(allow_nonzero_temperature=True).is_cacheable(make_request(temperature=0.7))
+
+class TestCachedClient:
+    @pytest.mark.asyncio
+    async def test_second_call_is_served_from_cache(self):
+        """同じリクエストの 2 回目は API を呼ばないこと"""
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, json=completion_body("キャッシュ対象"))
+
+        cache = ResponseCache()
+        client = make_client(handler, cache)
+        first = await client.chat_completion(make_request())
+        second = await client.chat_completion(make_request())
+
+        assert len(calls) == 1
+        assert second.message == first.message
+        assert second.usage["cached"] is True
+        assert cache.stats()["hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_stream_is_cached_and_replayed(self):
+        """ストリーミング応答がキャッシュされ、疑似ストリームで再生されること"""
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, content=stream_body(["キャッシュ", "された", "応答"]),
+                                  headers={"content-type": "text/event-stream"})
+
+        client = make_client(handler, ResponseCache())
+        first = [c async for c in client.chat_completion_stream(make_request())]
+        second = [c async for c in client.chat_completion_stream(make_request())]
+        assert len(calls) == 1
+        assert "".join(second) == "".join(first) == "キャッシュされた応答"
+
+        # 非ストリーミングの呼び出しも同じキャッシュを使う
+        response = await client.chat_completion(make_request())
+        assert response.message == "キャッシュされた応答"
+        assert len(calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_stream_over_size_limit_is_not_cached(self, monkeypatch):
+        """キャッシュ用の上限を超えた応答は、配信はするがキャッシュしないこと"""
+        monkeypatch.setattr(azure_openai_client, "LLM_CACHE_MAX_RESPONSE_BYTES", 10)
+
+        def handler(request):
+            return httpx.Response(200, content=stream_body(["長い", "長い", "応答"]),
+                                  headers={"content-type": "text/event-stream"})
+
+        cache = ResponseCache()
+        client = make_client(handler, cache)
+        assert "".join([c async for c in client.chat_completion_stream(make_request())]) == "長い長い応答"
+        assert cache.get(request_cache_key(make_request(), "gpt-35-turbo")) is None
+
+    def test_max_tokens_is_bounded(self):
+        """max_tokens は上限を超えて指定できないこと"""
+        with pytest.raises(ValueError):
+            ChatRequest(messages=[], max_tokens=azure_openai_client.AZURE_OPENAI_MAX_TOKENS_LIMIT + 1)
@@ -0,0 +1,221 @@
+# -------------------------------------------------
+# ・ファイル名：test_semantic_cache.py
+# ・ファイル内容：LLM 応答の意味的キャッシュの単体テスト
+# ・作成日時：2026/10/19 07:00:00  agent
+# -------------------------------------------------
+
+import numpy as np
+import pytest
+import httpx
+from semantic_cache import HashingEmbedder, SemanticCache, VectorIndex, normalize_question
+from azure_openai_client import AzureOpenAIClient, ChatRequest, ChatMessage
+from test_azure_openai_client import completion_body, stream_body
+
+QUESTION = "経費精算の締め日はいつですか？"
+PARAPHRASE = "経費精算の締め日は、いつですか"
+
+def make_request(content: str = QUESTION, system_prompt: str = "社内ヘルプデスク",
+                 temperature: float = 0.0, history=()) -> ChatRequest:
+    return ChatRequest(
+        messages=[*history, ChatMessage(role="user", content=content)],
+        temperature=temperature,
+        system_prompt=system_prompt,
+    )
+
+def make_client(handler, semantic_cache: SemanticCache) -> AzureOpenAIClient:
+    return AzureOpenAIClient(
+        endpoint="https://example.openai.azure.com/",
+        api_key="test-key",
+        model_name="gpt-35-turbo",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        semantic_cache=semantic_cache,
+    )
+
+class KeywordEmbedder:
+    """テスト用の埋め込み（キーワード毎に 1 次元）"""
+
+    name = "keyword"
+    dim = 3
+
+    async def embed(self, text: str) -> np.ndarray:
+        vector = np.array([text.count("締め日"), text.count("有給"), text.count("天気")], dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+async def store(cache: SemanticCache, request: ChatRequest, answer: str):
+    query = await cache.query_for(request, "d")
+    cache.add(query, answer)
+
+class TestHashingEmbedder:
+    def test_normalization_ignores_width_case_and_punctuation(self):
+        assert normalize_question("ＡＢＣ、 abc？") == "abcabc"
+
+    def test_similar_questions_are_close(self):
+        embedder = HashingEmbedder()
+        question = embedder.embed_sync(QUESTION)
+        assert float(question @ embedder.embed_sync(PARAPHRASE)) == pytest.approx(1.0)
+        assert float(question @ embedder.embed_sync("有給休暇の申請方法を教えてください")) < 0.3
+        assert np.linalg.norm(question) == pytest.approx(1.0)
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("stored, asked", [
+        ("出張時の交通費の精算方法と申請期限、必要な領収書の種類について教えてください",
+         "出張時の宿泊費の精算方法と申請期限、必要な領収書の種類について教えてください"),
+        ("2023年度の売上高の推移と前年比の増減要因を部門別にまとめてください",
+         "2024年度の売上高の推移と前年比の増減要因を部門別にまとめてください"),
+        ("How do I configure the PostgreSQL connection pool size and timeout for production workloads?",
+         "How do I configure the Redis connection pool size and timeout for production workloads?"),
+    ])
+    async def test_entity_differing_questions_miss(self, stored, asked):
+        """1 語だけ違う質問には、既定の閾値で別の質問の応答を返さないこと"""
+        cache = SemanticCache()
+        assert cache.threshold == HashingEmbedder.default_threshold
+        await store(cache, make_request(stored), "別の質問の回答")
+        assert cache.search(await cache.query_for(make_request(asked), "d")) is None
+
+class TestSemanticCache:
+    @pytest.mark.asyncio
+    async def test_hit_above_threshold(self):
+        """閾値以上に近い質問なら、過去の応答が返ること"""
+        cache = SemanticCache(threshold=0.9)
+        await store(cache, make_request(), "毎月 25 日です")
+        hit = cache.search(await cache.query_for(make_request(PARAPHRASE), "d"))
+        assert hit.message == "毎月 25 日です"
+        assert hit.question == QUESTION
+        assert cache.search(await cache.query_for(make_request("有給休暇の申請方法"), "d")) is None
+        assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+    @pytest.mark.asyncio
+    async def test_namespace_separates_system_prompts(self):
+        """システムプロンプトが違えば同じ質問でもヒットしないこと"""
+        cache = SemanticCache()
+        await store(cache, make_request(), "毎月 25 日です")
+        assert cache.search(await cache.query_for(make_request(system_prompt="別のアシスタント"), "d")) is None
+        assert cache.search(await cache.query_for(make_request(), "other-deployment")) is None
+
+    @pytest.mark.asyncio
+    async def test_bypass_for_follow_up_and_temperature(self):
+        """2 往復目以降と temperature > 0 は対象外になること"""
+        cache = SemanticCache()
+        history = [ChatMessage(role="user", content="質問"), ChatMessage(role="assistant", content="回答")]
+        assert await cache.query_for(make_request("それはなぜ？", history=history), "d") is None
+        assert await cache.query_for(make_request(temperature=0.7), "d") is None
+        assert cache.stats()["bypassed"] == 2
+
+    @pytest.mark.asyncio
+    async def test_lru_eviction(self):
+        """上限を超えると最も古く使われた質問から削除されること"""
+        cache = SemanticCache(KeywordEmbedder(), max_entries=2)
+        await store(cache, make_request("締め日"), "a")
+        await store(cache, make_request("有給"), "b")
+        assert cache.search(await cache.query_for(make_request("締め日は？"), "d")).message == "a"
+        await store(cache, make_request("天気"), "c")
+        assert cache.search(await cache.query_for(make_request("有給は？"), "d")) is None
+        assert cache.search(await cache.query_for(make_request("締め日は？"), "d")).message == "a"
+        assert cache.stats()["evictions"] == 1
+
+    @pytest.mark.asyncio
+    async def test_ttl_expiry(self):
+        now = [1000.0]
+        cache = SemanticCache(KeywordEmbedder(), ttl=60, clock=lambda: now[0])
+        await store(cache, make_request("締め日"), "a")
+        now[0] += 61
+        assert cache.search(await cache.query_for(make_request("締め日"), "d")) is None
+        await store(cache, make_request("有給"), "b")
+        assert cache.stats()["expired"] == 1 and cache.stats()["entries"] == 1
+
+    @pytest.mark.asyncio
+    async def test_same_question_replaces_entry(self):
+        cache = SemanticCache()
+        await store(cache, make_request(), "古い回答")
+        await store(cache, make_request(), "新しい回答")
+        assert cache.stats()["entries"] == 1
+        assert cache.search(await cache.query_for(make_request(), "d")).message == "新しい回答"
+
+    @pytest.mark.asyncio
+    async def test_index_persists_to_disk(self, tmp_path):
+        """保存した索引を読み込むと、同じ質問がヒットすること"""
+        path = str(tmp_path / "semantic.npz")
+        cache = SemanticCache(index_path=path)
+        for i in range(20):
+            await store(cache, make_request(f"質問その{i}について教えてください"), f"回答{i}")
+        await store(cache, make_request(), "毎月 25 日です")
+        cache.save()
+
+        restored = SemanticCache(index_path=path)
+        assert restored.stats()["entries"] == 21
+        assert restored.search(await restored.query_for(make_request(PARAPHRASE), "d")).message == "毎月 25 日です"
+
+        # 埋め込み関数が違う索引は読み込まない
+        other = SemanticCache(HashingEmbedder(dim=64), index_path=path)
+        assert other.stats()["entries"] == 0
+
+    def test_remove_keeps_rows_compact(self):
+        index = VectorIndex(2)
+        for i, vector in enumerate(([1, 0], [0, 1], [0.6, 0.8])):
+            index.add("ns", np.array(vector, dtype=np.float32), f"q{i}", f"a{i}", expires_at=1e12)
+        index.remove(0)
+        assert index.size == 2 and index.questions == ["q2", "q1"]
+        row, similarity = index.search("ns", np.array([0.6, 0.8], dtype=np.float32), now=0)
+        assert index.answers[row] == "a2" and similarity == pytest.approx(1.0)
+
+class TestSemanticCacheSettings:
+    def test_hashing_requires_opt_in(self, monkeypatch):
+        """hashing は SEMANTIC_CACHE_ALLOW_HASHING を指定しない限り有効にならないこと"""
+        import semantic_cache
+        monkeypatch.setattr(semantic_cache, "_semantic_cache", None)
+        monkeypatch.setattr(semantic_cache, "SEMANTIC_CACHE_ENABLED", True)
+        monkeypatch.setattr(semantic_cache, "SEMANTIC_CACHE_EMBEDDING", "hashing")
+        monkeypatch.setattr(semantic_cache, "SEMANTIC_CACHE_ALLOW_HASHING", False)
+        assert semantic_cache.get_semantic_cache() is None
+
+        monkeypatch.setattr(semantic_cache, "SEMANTIC_CACHE_ALLOW_HASHING", True)
+        monkeypatch.setattr(semantic_cache, "create_embedder", lambda: HashingEmbedder())
+        cache = semantic_cache.get_semantic_cache()
+        assert cache is not None and cache.threshold == 0.99
+
+class TestClientIntegration:
+    @pytest.mark.asyncio
+    async def test_paraphrase_skips_api_call(self):
+        """言い換えの質問では API を呼ばずに応答が返ること"""
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, json=completion_body("毎月 25 日です"))
+
+        client = make_client(handler, SemanticCache())
+        first = await client.chat_completion(make_request())
+        second = await client.chat_completion(make_request(PARAPHRASE))
+        assert len(calls) == 1
+        assert second.message == first.message
+        assert second.usage["cached"] is True
+        assert second.usage["semantic_similarity"] >= 0.9
+
+    @pytest.mark.asyncio
+    async def test_stream_replays_cached_answer(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(
+                200, content=stream_body(["毎月", " 25 日", "です"]), headers={"content-type": "text/event-stream"}
+            )
+
+        client = make_client(handler, SemanticCache())
+        first = "".join([piece async for piece in client.chat_completion_stream(make_request())])
+        second = "".join([piece async for piece in client.chat_completion_stream(make_request(PARAPHRASE))])
+        assert len(calls) == 1
+        assert first == second == "毎月 25 日です"
+
+    @pytest.mark.asyncio
+    async def test_embedding_error_falls_back_to_api(self):
+        class BrokenEmbedder:
+            name = "broken"
+
+            async def embed(self, text):
+                raise RuntimeError("embedding down")
+
+        client = make_client(lambda request: httpx.Response(200, json=completion_body("ok")),
+                             SemanticCache(BrokenEmbedder()))
+        assert (await client.chat_completion(make_request())).message == "ok"
+        assert client.semantic_cache.stats()["embed_errors"] == 1
@@ -0,0 +1,148 @@
+# -------------------------------------------------
+# ・ファイル名：test_tracing.py
+# ・ファイル内容：リクエスト単位のトレースの単体テスト
+# ・作成日時：2026/10/19 06:00:00  agent
+# -------------------------------------------------
+
+import pytest
+import httpx
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+import tracing
+from tracing import MemoryExporter, Tracer, parse_traceparent
+from main import app
+from test_azure_openai_client import completion_body, stream_body, make_client, make_request
+
+client = TestClient(app)
+
+@pytest.fixture
+def tracer():
+    """全てのリクエストを記録するトレーサーに差し替える"""
+    tracer = Tracer(MemoryExporter(), sample_rate=1.0, enabled=True)
+    with patch.object(tracing, "_tracer", tracer):
+        yield tracer
+
+def spans_of(tracer: Tracer):
+    return [span for trace in tracer.exporter.traces(100) for span in trace["spans"]]
+
+class TestTracer:
+    def test_sampling_decides_at_root(self):
+        """サンプリング対象外のルートでは子スパンも出力されないこと"""
+        tracer = Tracer(MemoryExporter(), sample_rate=0.5, enabled=True, rng=lambda: 0.9)
+        with tracer.span("root") as root:
+            with tracer.span("child") as child:
+                pass
+        assert not root.recording and not child.recording
+        assert tracer.exporter.traces() == []
+        assert tracer.stats()["roots"] == 1 and tracer.stats()["sampled"] == 0
+
+    def test_child_spans_share_trace_and_parent(self):
+        """子スパンが同じ trace_id と親の span_id を持つこと"""
+        tracer = Tracer(MemoryExporter(), sample_rate=1.0, enabled=True)
+        with tracer.span("root") as root:
+            with tracer.span("child", {"k": "v"}) as child:
+                pass
+        assert child.trace_id == root.trace_id
+        assert child.parent_id == root.span_id
+        assert root.parent_id is None
+        [trace] = tracer.exporter.traces()
+        assert [s["name"] for s in trace["spans"]] == ["root", "child"]
+        assert trace["spans"][1]["attributes"] == {"k": "v"}
+
+    def test_exception_is_recorded(self):
+        """例外がスパンに記録され、そのまま送出されること"""
+        tracer = Tracer(MemoryExporter(), sample_rate=1.0, enabled=True)
+        with pytest.raises(ValueError):
+            with tracer.span("root"):
+                raise ValueError("失敗")
+        [span] = spans_of(tracer)
+        assert span["status"] == "error"
+        assert span["events"][0]["attributes"]["type"] == "ValueError"
+
+    def test_incoming_traceparent_is_honored(self):
+        """上流の traceparent の trace_id・親・サンプリング判定を引き継ぐこと"""
+        trace_id, parent_id = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+        tracer = Tracer(MemoryExporter(), sample_rate=0.0, enabled=True)
+        with tracer.span("root", traceparent=f"00-{trace_id}-{parent_id}-01") as root:
+            pass
+        assert root.recording
+        assert (root.trace_id, root.parent_id) == (trace_id, parent_id)
+
+        with tracer.span("root", traceparent=f"00-{trace_id}-{parent_id}-00") as root:
+            pass
+        assert not root.recording
+
+    def test_parse_traceparent_rejects_invalid(self):
+        assert parse_traceparent("00-" + "0" * 32 + "-00f067aa0ba902b7-01") is None
+        assert parse_traceparent("00-xyz-00f067aa0ba902b7-01") is None
+        assert parse_traceparent(None) is None
+
+class TestInstrumentation:
+    def test_request_root_span_and_trace_header(self, tracer):
+        """リクエスト毎にルートスパンができ、X-Trace-Id が返ること"""
+        response = client.get("/")
+        assert response.status_code == 200
+        [trace] = tracer.exporter.traces()
+        assert response.headers["x-trace-id"] == trace["trace_id"]
+        [span] = trace["spans"]
+        assert span["name"] == "GET /"
+        assert span["attributes"]["http.status_code"] == 200
+
+    def test_client_traceparent_cannot_force_sampling(self):
+        """信頼するプロキシ以外からの traceparent ではサンプリングを強制できないこと"""
+        header = {"traceparent": "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"}
+        tracer = Tracer(MemoryExporter(), sample_rate=0.0, enabled=True)
+        with patch.object(tracing, "_tracer", tracer):
+            response = client.get("/", headers=header)
+        assert "x-trace-id" not in response.headers
+        assert tracer.stats()["ignored_traceparents"] == 1
+
+        assert not tracer.accepts_traceparent("203.0.113.5")
+        proxied = Tracer(MemoryExporter(), sample_rate=0.0, enabled=True, trusted_proxies="10.0.0.0/8, 127.0.0.1")
+        assert proxied.accepts_traceparent("10.1.2.3")
+        assert not proxied.accepts_traceparent("203.0.113.5")
+        assert not proxied.accepts_traceparent("testclient")
+        assert Tracer(MemoryExporter(), enabled=True, trust_traceparent=True).accepts_traceparent("203.0.113.5")
+
+    def test_unsampled_request_has_no_header(self):
+        tracer = Tracer(MemoryExporter(), sample_rate=0.0, enabled=True)
+        with patch.object(tracing, "_tracer", tracer):
+            response = client.get("/")
+        assert "x-trace-id" not in response.headers
+        assert tracer.exporter.traces() == []
+
+    @pytest.mark.asyncio
+    async def test_db_access_is_child_span(self, tracer):
+        """DB アクセスが現在のスパンの子になり、SQL が記録されること"""
+        import database
+        with patch.object(database, "db_connection") as connection:
+            connection.return_value.__enter__.return_value.cursor.return_value.fetchone.return_value = {"id": 1}
+            with tracer.span("root") as root:
+                await database.fetch_one("SELECT id\n  FROM users WHERE username = %s", ("a",))
+        db_span = next(s for s in spans_of(tracer) if s["name"] == "db.fetch_one")
+        assert db_span["parent_span_id"] == root.span_id
+        assert db_span["attributes"]["db.statement"] == "SELECT id FROM users WHERE username = %s"
+
+    @pytest.mark.asyncio
+    async def test_completion_span_records_usage(self, tracer):
+        llm = make_client(lambda request: httpx.Response(200, json=completion_body("ok")))
+        with tracer.span("root"):
+            await llm.chat_completion(make_request("トレース"))
+        span = next(s for s in spans_of(tracer) if s["name"] == "azure_openai.chat_completion")
+        assert span["attributes"]["llm.deployment"] == llm.pool.deployments[0].name
+        assert span["attributes"]["llm.prompt_tokens"] == 5
+
+    @pytest.mark.asyncio
+    async def test_stream_span_records_first_token_event(self, tracer):
+        """ストリームのスパンに最初のトークンのイベントが記録されること"""
+        llm = make_client(lambda request: httpx.Response(
+            200, content=stream_body(["a", "b", "c"]), headers={"content-type": "text/event-stream"}
+        ))
+        with tracer.span("root") as root:
+            chunks = [chunk async for chunk in llm.chat_completion_stream(make_request("トレース"))]
+        assert "".join(chunks) == "abc"
+        span = next(s for s in spans_of(tracer) if s["name"] == "azure_openai.chat_completion_stream")
+        assert span["parent_span_id"] == root.span_id
+        assert [e["name"] for e in span["events"]] == ["first_token"]
+        assert span["attributes"]["llm.completion_chunks"] == 3
+        assert span["attributes"]["llm.outcome"] == "ok"
@@ -0,0 +1,352 @@
+# -------------------------------------------------
+# ・ファイル名：tracing.py
+# ・ファイル内容：リクエスト単位のトレース（ルートスパン・DB / Azure OpenAI の子スパン）
+# ・作成日時：2026/10/19 06:00:00  agent
+# -------------------------------------------------
+#
+# OpenTelemetry と同じ考え方の軽量な実装（trace_id / span_id / 親子関係 / イベント / traceparent）。
+# サンプリングはルートスパンで決め、対象外のリクエストでは子スパンも記録しない。
+
+import contextvars
+import ipaddress
+import json
+import os
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# トレース設定
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACING_SAMPLE_RATE = float(os.getenv("TRACING_SAMPLE_RATE", "0.1"))
+# memory: プロセス内に直近のトレースを保持（/system/traces）/ file: JSON Lines で追記
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "memory")
+TRACING_FILE = os.getenv("TRACING_FILE", "traces.jsonl")
+TRACING_MEMORY_MAX_TRACES = int(os.getenv("TRACING_MEMORY_MAX_TRACES", "200"))
+# 受け取った traceparent の trace_id とサンプリング判定に従う相手。任意のクライアントに従うと
+# 「-01」を付けるだけで全リクエストを記録させられるため、既定では信頼するプロキシ（IP・CIDR の
+# カンマ区切り）からのリクエストのみ。true なら全てのクライアントの traceparent に従う
+TRACING_TRUST_TRACEPARENT = os.getenv("TRACING_TRUST_TRACEPARENT", "false").lower() == "true"
+TRACING_TRUSTED_PROXIES = os.getenv("TRACING_TRUSTED_PROXIES", "")
+
+class Span:
+    """1 つの処理区間"""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes", "events",
+                 "status", "start_ns", "end_ns", "_tracer")
+
+    recording = True
+
+    def __init__(self, tracer: "Tracer", name: str, trace_id: str, parent_id: Optional[str],
+                 attributes: Optional[Dict[str, Any]] = None):
+        self._tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes) if attributes else {}
+        self.events: List[Tuple[str, int, Dict[str, Any]]] = []
+        self.status = "ok"
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def add_event(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        self.events.append((name, time.time_ns(), attributes or {}))
+
+    def record_exception(self, exc: BaseException):
+        self.status = "error"
+        self.add_event("exception", {"type": type(exc).__name__, "message": str(exc)[:500]})
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self._tracer._export(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3) if self.end_ns else None,
+            "status": self.status,
+            "attributes": self.attributes,
+            "events": [
+                {"name": name, "time_unix_nano": at, "attributes": attributes}
+                for name, at, attributes in self.events
+            ],
+        }
+
+class NonRecordingSpan:
+    """サンプリング対象外（属性やイベントは捨てる）"""
+
+    recording = False
+
+    def __init__(self, trace_id: Optional[str] = None, span_id: Optional[str] = None):
+        self.trace_id = trace_id
+        self.span_id = span_id
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def add_event(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        pass
+
+    def record_exception(self, exc: BaseException):
+        pass
+
+    def end(self):
+        pass
+
+_NON_RECORDING = NonRecordingSpan()
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+def current_span():
+    return _current_span.get()
+
+def parse_networks(value: str) -> List[Any]:
+    """IP・CIDR のカンマ区切りを ip_network の一覧に変換"""
+    return [ipaddress.ip_network(item.strip(), strict=False) for item in value.split(",") if item.strip()]
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """W3C traceparent（00-<trace_id>-<parent_id>-<flags>）を (trace_id, parent_id, sampled) に変換"""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or len(parts[3]) != 2:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+class MemoryExporter:
+    """直近のトレースをプロセス内に保持（トレース数の上限付き）"""
+
+    def __init__(self, max_traces: int = TRACING_MEMORY_MAX_TRACES):
+        self.max_traces = max_traces
+        self._traces: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        with self._lock:
+            spans = self._traces.get(span.trace_id)
+            if spans is None:
+                spans = self._traces[span.trace_id] = []
+                while len(self._traces) > self.max_traces:
+                    self._traces.popitem(last=False)
+            spans.append(span.to_dict())
+
+    def traces(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """新しい順のトレース（スパンは開始時刻順）"""
+        with self._lock:
+            items = list(self._traces.items())[-limit:] if limit > 0 else []
+        return [
+            {"trace_id": trace_id, "spans": sorted(spans, key=lambda s: s["start_time_unix_nano"])}
+            for trace_id, spans in reversed(items)
+        ]
+
+    def close(self):
+        pass
+
+class FileExporter:
+    """スパンを JSON Lines で追記"""
+
+    def __init__(self, path: str = TRACING_FILE):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def create_exporter(kind: str = TRACING_EXPORTER):
+    """TRACING_EXPORTER に応じた出力先"""
+    if kind == "memory":
+        return MemoryExporter()
+    if kind == "file":
+        return FileExporter()
+    raise ValueError("TRACING_EXPORTER は memory・file のいずれかを指定してください")
+
+class Tracer:
+    """スパンを作り、サンプリング対象のものだけを出力先へ送る"""
+
+    def __init__(
+        self,
+        exporter=None,
+        sample_rate: float = TRACING_SAMPLE_RATE,
+        enabled: bool = TRACING_ENABLED,
+        trust_traceparent: bool = TRACING_TRUST_TRACEPARENT,
+        trusted_proxies: str = TRACING_TRUSTED_PROXIES,
+        rng: Callable[[], float] = random.random,
+    ):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.enabled = enabled and exporter is not None
+        self.trust_traceparent = trust_traceparent
+        self.trusted_proxies = parse_networks(trusted_proxies)
+        self._rng = rng
+
+        # 統計情報
+        self._roots = 0
+        self._sampled = 0
+        self._exported = 0
+        self._export_errors = 0
+        self._ignored_traceparents = 0
+
+    def accepts_traceparent(self, peer: Optional[str]) -> bool:
+        """peer（接続元の IP）から受け取った traceparent に従うか"""
+        if self.trust_traceparent:
+            return True
+        if not peer or not self.trusted_proxies:
+            return False
+        try:
+            address = ipaddress.ip_address(peer)
+        except ValueError:
+            return False
+        return any(address in network for network in self.trusted_proxies)
+
+    def _new_span(self, name: str, attributes: Optional[Dict[str, Any]], traceparent: Optional[str] = None):
+        """現在のスパンの子（無ければルート）を作る"""
+        if not self.enabled:
+            return _NON_RECORDING
+        parent = _current_span.get()
+        if parent is not None:
+            if not parent.recording:
+                return parent
+            return Span(self, name, parent.trace_id, parent.span_id, attributes)
+
+        # ルート: ここでサンプリングを決める
+        self._roots += 1
+        # traceparent は呼び出し側（TracingMiddleware）で信頼できる相手からのものに限る
+        remote = parse_traceparent(traceparent)
+        if remote is not None:
+            trace_id, parent_id, sampled = remote
+        else:
+            trace_id, parent_id, sampled = secrets.token_hex(16), None, self._rng() < self.sample_rate
+        if not sampled:
+            return NonRecordingSpan(trace_id)
+        self._sampled += 1
+        return Span(self, name, trace_id, parent_id, attributes)
+
+    @contextmanager
+    def span(self, name: str, attributes: Optional[Dict[str, Any]] = None,
+             traceparent: Optional[str] = None) -> Iterator[Any]:
+        """現在のスパンにして処理を囲む（例外は記録して再送出）"""
+        span = self._new_span(name, attributes, traceparent)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    def begin(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        """現在のスパンにはせずに開始する（複数のタスクにまたがる非同期ジェネレーター用。end() を呼ぶこと）"""
+        return self._new_span(name, attributes)
+
+    def _export(self, span: Span):
+        try:
+            self.exporter.export(span)
+            self._exported += 1
+        except Exception as e:
+            # トレースの出力失敗でリクエストを失敗させない
+            self._export_errors += 1
+            print(f"トレースの出力エラー: {str(e)}")
+
+    def close(self):
+        if self.exporter is not None:
+            self.exporter.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """トレースの統計情報"""
+        return {
+            "enabled": self.enabled,
+            "exporter": type(self.exporter).__name__ if self.exporter else None,
+            "sample_rate": self.sample_rate,
+            "roots": self._roots,
+            "sampled": self._sampled,
+            "exported_spans": self._exported,
+            "export_errors": self._export_errors,
+            "ignored_traceparents": self._ignored_traceparents,
+        }
+
+class TracingMiddleware:
+    """リクエスト毎のルートスパン（サンプリング対象なら X-Trace-Id を返す）"""
+
+    def __init__(self, app, route_label: Callable[[Dict[str, Any]], str]):
+        self.app = app
+        self.route_label = route_label
+
+    async def __call__(self, scope, receive, send):
+        tracer = get_tracer()
+        if scope["type"] != "http" or not tracer.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for name, value in scope.get("headers", ()):
+            if name == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+        if traceparent is not None:
+            client = scope.get("client")
+            if not tracer.accepts_traceparent(client[0] if client else None):
+                tracer._ignored_traceparents += 1
+                traceparent = None
+        method = scope["method"]
+        route = self.route_label(scope)
+        with tracer.span(f"{method} {route}", {"http.method": method, "http.route": route},
+                         traceparent=traceparent) as span:
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.status_code", message["status"])
+                    if span.recording:
+                        if message["status"] >= 500:
+                            span.status = "error"
+                        message.setdefault("headers", [])
+                        message["headers"] = list(message["headers"]) + [
+                            (b"x-trace-id", span.trace_id.encode("latin-1")),
+                        ]
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+
+# グローバルインスタンス
+_tracer: Optional[Tracer] = None
+
+def get_tracer() -> Tracer:
+    """トレーサーのシングルトンインスタンスを取得"""
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer(create_exporter() if TRACING_ENABLED else None)
+    return _tracer
+
+def close_tracer():
+    """出力先を閉じる"""
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+        _tracer = None
@@ -0,0 +1,328 @@
+# -------------------------------------------------
+# ・ファイル名：load_test.py
+# ・ファイル内容：非同期負荷試験ハーネス
+# ・作成日時：2026/10/18 14:00:00  agent
+# -------------------------------------------------
+#
+# 使い方:
+#   python load_test.py --users 50 --ramp-up 10 --duration 60 \
+#       --mix login=1,chat=2,chat_stream=3,history=4 --output results/run.json
+#
+#   # 以前の結果と比較
+#   python load_test.py --users 50 --duration 60 --compare results/run.json
+
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import time
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+ACTIONS = ("login", "chat", "chat_stream", "history")
+
+@dataclass
+class LoadTestConfig:
+    """負荷試験の設定"""
+    base_url: str = "http://localhost:8000"
+    username: str = "testAI"
+    password: str = "testAI00!"
+    users: int = 10
+    ramp_up: float = 5.0
+    duration: float = 30.0
+    think_time_min: float = 0.5
+    think_time_max: float = 2.0
+    max_tokens: int = 100
+    timeout: float = 120.0
+    mix: Dict[str, float] = field(default_factory=lambda: {
+        "login": 1, "chat": 2, "chat_stream": 3, "history": 4,
+    })
+    seed: Optional[int] = None
+
+def percentile(values: List[float], pct: float) -> float:
+    """パーセンタイル値（最近傍法）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """login=1,chat=2 形式の比率指定を解析"""
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in ACTIONS:
+            raise argparse.ArgumentTypeError(f"不明なアクションです: {name}（{', '.join(ACTIONS)}）")
+        mix[name] = float(weight or 1)
+    return mix
+
+class MetricsRecorder:
+    """エンドポイント毎の計測値を記録"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.first_chunk: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.statuses: Dict[str, Dict[str, int]] = {}
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    def record(self, action: str, latency: float, status: int, ok: bool, ttfc: Optional[float] = None):
+        self.latencies.setdefault(action, []).append(latency)
+        statuses = self.statuses.setdefault(action, {})
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        if not ok:
+            self.errors[action] = self.errors.get(action, 0) + 1
+        if ttfc is not None:
+            self.first_chunk.setdefault(action, []).append(ttfc)
+
+    def summary(self) -> dict:
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        endpoints = {}
+        all_latencies: List[float] = []
+        total_errors = 0
+        for action, values in self.latencies.items():
+            errors = self.errors.get(action, 0)
+            all_latencies.extend(values)
+            total_errors += errors
+            summary = {
+                "requests": len(values),
+                "throughput": round(len(values) / elapsed, 3) if elapsed else 0.0,
+                "error_rate": round(errors / len(values), 4) if values else 0.0,
+                "p50_ms": round(percentile(values, 50) * 1000, 1),
+                "p95_ms": round(percentile(values, 95) * 1000, 1),
+                "p99_ms": round(percentile(values, 99) * 1000, 1),
+                "statuses": self.statuses.get(action, {}),
+            }
+            ttfc = self.first_chunk.get(action)
+            if ttfc:
+                summary["ttfc_p50_ms"] = round(percentile(ttfc, 50) * 1000, 1)
+                summary["ttfc_p95_ms"] = round(percentile(ttfc, 95) * 1000, 1)
+                summary["ttfc_p99_ms"] = round(percentile(ttfc, 99) * 1000, 1)
+            endpoints[action] = summary
+        return {
+            "elapsed_sec": round(elapsed, 3),
+            "total": {
+                "requests": len(all_latencies),
+                "throughput": round(len(all_latencies) / elapsed, 3) if elapsed else 0.0,
+                "error_rate": round(total_errors / len(all_latencies), 4) if all_latencies else 0.0,
+                "p50_ms": round(percentile(all_latencies, 50) * 1000, 1),
+                "p95_ms": round(percentile(all_latencies, 95) * 1000, 1),
+                "p99_ms": round(percentile(all_latencies, 99) * 1000, 1),
+            },
+            "endpoints": endpoints,
+        }
+
+class VirtualUser:
+    """1 人分の仮想ユーザー"""
+
+    def __init__(self, user_id: int, config: LoadTestConfig, client: httpx.AsyncClient,
+                 metrics: MetricsRecorder, rng: random.Random):
+        self.user_id = user_id
+        self.config = config
+        self.client = client
+        self.metrics = metrics
+        self.rng = rng
+        self.token: Optional[str] = None
+
+    @property
+    def headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.token}"} if self.token else {}
+
+    def chat_payload(self) -> dict:
+        return {
+            "messages": [{"role": "user", "content": f"負荷試験ユーザー{self.user_id}からの質問です。"}],
+            "max_tokens": self.config.max_tokens,
+            "temperature": 0.7,
+        }
+
+    async def login(self):
+        started = time.perf_counter()
+        status = 0
+        try:
+            response = await self.client.post(
+                "/login", json={"username": self.config.username, "password": self.config.password}
+            )
+            status = response.status_code
+            if status == 200:
+                self.token = response.json()["access_token"]
+        except httpx.HTTPError:
+            pass
+        self.metrics.record("login", time.perf_counter() - started, status, status == 200)
+
+    async def chat(self):
+        started = time.perf_counter()
+        status = 0
+        try:
+            response = await self.client.post("/chat", json=self.chat_payload(), headers=self.headers)
+            status = response.status_code
+        except httpx.HTTPError:
+            pass
+        self.metrics.record("chat", time.perf_counter() - started, status, status == 200)
+
+    async def chat_stream(self):
+        started = time.perf_counter()
+        status = 0
+        first_chunk = None
+        ok = False
+        try:
+            async with self.client.stream(
+                "POST", "/chat/stream", json=self.chat_payload(), headers=self.headers
+            ) as response:
+                status = response.status_code
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    payload = json.loads(line[5:].strip() or "{}")
+                    if "chunk" in payload and first_chunk is None:
+                        first_chunk = time.perf_counter() - started
+                    if payload.get("done"):
+                        ok = status == 200
+                    if "error" in payload:
+                        ok = False
+                        break
+        except (httpx.HTTPError, json.JSONDecodeError):
+            ok = False
+        self.metrics.record("chat_stream", time.perf_counter() - started, status, ok, first_chunk)
+
+    async def history(self):
+        started = time.perf_counter()
+        status = 0
+        try:
+            response = await self.client.get("/chat/history", headers=self.headers)
+            status = response.status_code
+        except httpx.HTTPError:
+            pass
+        self.metrics.record("history", time.perf_counter() - started, status, status == 200)
+
+    async def run(self, deadline: float):
+        await self.login()
+        actions = list(self.config.mix.keys())
+        weights = list(self.config.mix.values())
+        while time.perf_counter() < deadline:
+            action = self.rng.choices(actions, weights=weights)[0]
+            await getattr(self, action)()
+            think = self.rng.uniform(self.config.think_time_min, self.config.think_time_max)
+            await asyncio.sleep(max(0.0, min(think, deadline - time.perf_counter())))
+
+class LoadTest:
+    """ランプアップ付きで仮想ユーザーを走らせる"""
+
+    def __init__(self, config: LoadTestConfig):
+        self.config = config
+        self.metrics = MetricsRecorder()
+
+    async def run(self) -> dict:
+        rng = random.Random(self.config.seed)
+        limits = httpx.Limits(max_connections=self.config.users * 2, max_keepalive_connections=self.config.users)
+        async with httpx.AsyncClient(
+            base_url=self.config.base_url, timeout=self.config.timeout, limits=limits
+        ) as client:
+            self.metrics = MetricsRecorder()
+            deadline = time.perf_counter() + self.config.ramp_up + self.config.duration
+            interval = self.config.ramp_up / self.config.users if self.config.users else 0
+            tasks = []
+            for user_id in range(self.config.users):
+                user = VirtualUser(user_id, self.config, client, self.metrics, random.Random(rng.random()))
+                tasks.append(asyncio.create_task(user.run(deadline)))
+                if interval:
+                    await asyncio.sleep(interval)
+            await asyncio.gather(*tasks)
+            self.metrics.finished = time.perf_counter()
+        return self.metrics.summary()
+
+def git_commit() -> Optional[str]:
+    """計測対象のコミット"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_report(result: dict, baseline: Optional[dict] = None):
+    """結果を表形式で出力（baseline があれば差分も表示）"""
+    print(f"\n📊 負荷試験結果  commit={result['meta']['git_commit']}  {result['elapsed_sec']}秒")
+    header = f"{'endpoint':14s}{'reqs':>7s}{'req/s':>9s}{'err%':>7s}{'p50':>9s}{'p95':>9s}{'p99':>9s}{'ttfc50':>9s}"
+    print(header)
+    print("-" * len(header))
+    rows = dict(result["endpoints"])
+    rows["TOTAL"] = result["total"]
+    for name, row in rows.items():
+        print(
+            f"{name:14s}{row['requests']:7d}{row['throughput']:9.2f}{row['error_rate'] * 100:7.1f}"
+            f"{row['p50_ms']:9.1f}{row['p95_ms']:9.1f}{row['p99_ms']:9.1f}"
+            f"{row.get('ttfc_p50_ms', 0.0):9.1f}"
+        )
+        if baseline:
+            base = baseline["total"] if name == "TOTAL" else baseline["endpoints"].get(name)
+            if base:
+                print(
+                    f"{'  (差分)':12s}{'':7s}{row['throughput'] - base['throughput']:+9.2f}"
+                    f"{(row['error_rate'] - base['error_rate']) * 100:+7.1f}"
+                    f"{row['p50_ms'] - base['p50_ms']:+9.1f}{row['p95_ms'] - base['p95_ms']:+9.1f}"
+                    f"{row['p99_ms'] - base['p99_ms']:+9.1f}"
+                    f"{row.get('ttfc_p50_ms', 0.0) - base.get('ttfc_p50_ms', 0.0):+9.1f}"
+                )
+    print("（レイテンシの単位: ミリ秒）")
+
+def main():
+    parser = argparse.ArgumentParser(description="バックエンドの非同期負荷試験")
+    parser.add_argument("--url", default=LoadTestConfig.base_url)
+    parser.add_argument("--username", default=LoadTestConfig.username)
+    parser.add_argument("--password", default=LoadTestConfig.password)
+    parser.add_argument("--users", type=int, default=LoadTestConfig.users)
+    parser.add_argument("--ramp-up", type=float, default=LoadTestConfig.ramp_up, help="全ユーザー起動までの秒数")
+    parser.add_argument("--duration", type=float, default=LoadTestConfig.duration, help="ランプアップ後の計測秒数")
+    parser.add_argument("--think-time", type=float, nargs=2, metavar=("MIN", "MAX"),
+                        default=(LoadTestConfig.think_time_min, LoadTestConfig.think_time_max))
+    parser.add_argument("--mix", type=parse_mix, default=None, help="例: login=1,chat=2,chat_stream=3,history=4")
+    parser.add_argument("--max-tokens", type=int, default=LoadTestConfig.max_tokens)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", help="結果の JSON を書き出すパス")
+    parser.add_argument("--compare", help="比較対象とする過去の結果 JSON")
+    args = parser.parse_args()
+
+    config = LoadTestConfig(
+        base_url=args.url,
+        username=args.username,
+        password=args.password,
+        users=args.users,
+        ramp_up=args.ramp_up,
+        duration=args.duration,
+        think_time_min=args.think_time[0],
+        think_time_max=args.think_time[1],
+        max_tokens=args.max_tokens,
+        seed=args.seed,
+    )
+    if args.mix:
+        config.mix = args.mix
+
+    print(f"🚀 負荷試験を開始します: {config.users}ユーザー / ランプアップ{config.ramp_up}秒 / {config.duration}秒")
+    result = asyncio.run(LoadTest(config).run())
+    result["meta"] = {
+        "timestamp": datetime.now().isoformat(),
+        "git_commit": git_commit(),
+        "config": asdict(config),
+    }
+
+    baseline = None
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+    print_report(result, baseline)
+
+    if args.output:
+        output = Path(args.output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"💾 結果を保存しました: {output}")
+
+if __name__ == "__main__":
+    main()